@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.territory import TerritoryIndex
+
+# Potenciales de calentamiento global a 100 años por informe del IPCC
+GWP_SETS = {
+    'AR4': {'CO2': 1.0, 'CH4': 25.0, 'N2O': 298.0},
+    'AR5': {'CO2': 1.0, 'CH4': 28.0, 'N2O': 265.0},
+    'AR6': {'CO2': 1.0, 'CH4': 27.0, 'N2O': 273.0},
+}
+
+# Columna de emisión (Gg) -> gas, categoría IPCC de la fuente
+EMISSION_SOURCES = {
+    'emision_fe': ('CH4', '3A1'),
+    'emision_ge': ('CH4', '3A2'),
+}
+
+# Animales tipo de bovinos (ver GrossEnergy.energy_selection)
+BOVINE_TYPES = [1, 2, 3, 4, 5, 6, 7]
+
+# Subcategoría IPCC por animal tipo de otras especies. Los animales tipo sin entrada van a "j" (otros)
+SPECIES_CATEGORIES = {}
+
+# Niveles territoriales: nivel -> columna de los datos de actividad (None es el total nacional)
+TERRITORY_LEVELS = {
+    'nacional': None,
+    'departamento': 'cod_depto',
+    'region': 'id_reg_ganadera',
+}
+
+# Código de las filas sin departamento, región, año o animal tipo. Se agregan como un territorio más y cuentan en
+# el total nacional
+UNASSIGNED = -1
+
+
+def leaf_category(source, at_id) -> np.ndarray:
+    """
+    Subcategoría IPCC de cada fila: bovinos en "a", otras especies según SPECIES_CATEGORIES
+    :param source: categoría de la fuente (3A1, 3A2)
+    :param at_id: animal tipo por fila
+    :return: arreglo de códigos
+    """
+    suffix = pd.Series(at_id).map(SPECIES_CATEGORIES).fillna('j').values
+    suffix = np.where(np.isin(at_id, BOVINE_TYPES), 'a', suffix)
+    return np.char.add(source, suffix.astype(str)).astype(object)
+
+
+def get_act_data(table='datos_act_bovinos_ipcc_temporal') -> pd.DataFrame:
+    """
+    Emisiones por fila de una tabla de datos de actividad
+    :param table: tabla de datos de actividad
+    :return: DataFrame cod_muni, cod_depto, id_reg_ganadera, ano, id_ani_tipo_ipcc, emision_fe, emision_ge
+    """
+    query = f""" SELECT cod_muni, cod_depto, id_reg_ganadera, ano, id_ani_tipo_ipcc, emision_fe, emision_ge
+                 FROM {table}
+             """
+    return pd.read_sql_query(query, con=pg_connection_str())
+
+
+class CO2eRollup:
+    """
+    Agregados de las emisiones por la jerarquía de categorías IPCC (3A1a -> 3A1 -> 3A -> 3) y por territorio y
+    año. Los subtotales se guardan en masa de cada gas, de modo que cambiar de GWP es un reescalamiento de los
+    subtotales y no un nuevo cálculo
+    """
+
+    def __init__(self, df_act, index=None):
+        """
+        :param df_act: emisiones por fila (ver get_act_data)
+        :param index: TerritoryIndex opcional. Si se entrega el departamento de cada fila sale del índice a partir
+                      de cod_muni y no de la columna cod_depto
+        """
+        if index is not None:
+            df_act = self.index_rollup(df_act, index)
+        self.leaves = self.leaves_calc(df_act)
+        self.subtotals = self.subtotals_calc()
+
+    @staticmethod
+    def index_rollup(df_act, index) -> pd.DataFrame:
+        """
+        Emisiones por departamento del índice territorial, región, año y animal tipo. La región se conserva de
+        cada fila porque un municipio puede estar en varias regiones ganaderas. Los municipios desconocidos van
+        al código UNASSIGNED
+        :param df_act: emisiones por fila con cod_muni
+        :param index: TerritoryIndex
+        :return: DataFrame cod_depto, id_reg_ganadera, ano, id_ani_tipo_ipcc, emision_fe, emision_ge
+        """
+        by = df_act[['id_reg_ganadera', 'ano', 'id_ani_tipo_ipcc']].fillna(UNASSIGNED)
+        values = df_act[list(EMISSION_SOURCES)].fillna(0.0)
+        return index.rollup(df_act['cod_muni'].values, values, 'cod_depto', by=by, unassigned=UNASSIGNED)
+
+    @staticmethod
+    def leaves_calc(df_act) -> pd.DataFrame:
+        """
+        Una sola pasada agrupada sobre las filas de actividad: suma por departamento, región, año, animal tipo.
+        Las llaves nulas se agrupan con el código UNASSIGNED (sin asignar)
+        :return: DataFrame cod_depto, id_reg_ganadera, ano, categoria, gas, valor
+        """
+        keys = ['cod_depto', 'id_reg_ganadera', 'ano', 'id_ani_tipo_ipcc']
+        df_act = df_act.fillna({key: UNASSIGNED for key in keys})
+        grouped = df_act.groupby(keys, sort=True)
+        groups = grouped.ngroup().values
+        df_keys = grouped.size().reset_index()[keys]
+        tables = []
+        for col, (gas, source) in EMISSION_SOURCES.items():
+            table = df_keys.copy()
+            table['categoria'] = leaf_category(source, table['id_ani_tipo_ipcc'].values)
+            table['gas'] = gas
+            table['valor'] = np.bincount(groups, weights=np.nan_to_num(df_act[col].values.astype('float64')),
+                                         minlength=len(df_keys))
+            tables.append(table)
+        df = pd.concat(tables, ignore_index=True)
+        return df.groupby(['cod_depto', 'id_reg_ganadera', 'ano', 'categoria', 'gas'], sort=True)['valor'] \
+            .sum().reset_index()
+
+    def subtotals_calc(self) -> pd.DataFrame:
+        """
+        Subtotales por nivel territorial, territorio, año, categoría y gas para todos los niveles de la jerarquía
+        :return: DataFrame nivel_territorio, territorio, ano, nivel_categoria, categoria, gas, valor
+        """
+        depth = self.leaves['categoria'].str.len().max()
+        tables = []
+        for level, col in TERRITORY_LEVELS.items():
+            territory = self.leaves[col].values if col is not None else np.zeros(len(self.leaves), dtype=int)
+            for cut in range(depth, 0, -1):
+                df = pd.DataFrame({'territorio': territory, 'ano': self.leaves['ano'].values,
+                                   'categoria': self.leaves['categoria'].str[:cut].values,
+                                   'gas': self.leaves['gas'].values, 'valor': self.leaves['valor'].values})
+                df = df.groupby(['territorio', 'ano', 'categoria', 'gas'], sort=True)['valor'].sum().reset_index()
+                df.insert(0, 'nivel_territorio', level)
+                df.insert(3, 'nivel_categoria', cut)
+                tables.append(df)
+        return pd.concat(tables, ignore_index=True)
+
+    def co2e(self, gwp='AR5') -> pd.DataFrame:
+        """
+        Subtotales en CO2 equivalente
+        :param gwp: nombre de GWP_SETS o diccionario gas -> potencial
+        :return: subtotales con la columna co2e (Gg CO2e)
+        """
+        factors = GWP_SETS[gwp] if isinstance(gwp, str) else gwp
+        df = self.subtotals.copy()
+        df['co2e'] = df['valor'].values * df['gas'].map(factors).values
+        return df
+
+    def totals(self, gwp='AR5', territory='nacional', category_level=None) -> pd.DataFrame:
+        """
+        Tabla de CO2 equivalente de un nivel territorial
+        :param gwp: nombre de GWP_SETS o diccionario gas -> potencial
+        :param territory: nivel de TERRITORY_LEVELS
+        :param category_level: longitud del código de categoría (1 = sector). Por defecto todos los niveles
+        :return: DataFrame territorio, ano, categoria, co2e
+        """
+        df = self.co2e(gwp)
+        rows = df['nivel_territorio'] == territory
+        if category_level is not None:
+            rows &= df['nivel_categoria'] == category_level
+        return df[rows].groupby(['territorio', 'ano', 'categoria'], sort=True)['co2e'].sum().reset_index()
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Agregados de emisiones en CO2 equivalente por categoria IPCC')
+    parser.add_argument('--gwp', type=str, default='AR5', choices=list(GWP_SETS), help='Potenciales del IPCC')
+    parser.add_argument('--proyectados', action='store_true', help='Usa los datos de actividad proyectados')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    table = 'datos_act_bovinos_ipcc_proyectados' if args.proyectados else 'datos_act_bovinos_ipcc_temporal'
+    rollup = CO2eRollup(get_act_data(table), TerritoryIndex())
+    df = rollup.co2e(args.gwp)
+    df.insert(0, 'gwp', args.gwp)
+    df.to_sql('emisiones_co2e', con=pg_connection_str(), if_exists='replace', index=False,
+              method="multi", chunksize=5000)
+    print(rollup.totals(args.gwp, category_level=1))
+
+
+if __name__ == '__main__':
+    main()
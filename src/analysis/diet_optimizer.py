@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+# Porcentajes de forraje evaluados (el suplemento completa el 100 %)
+DIET_SHARES = np.linspace(0.0, 100.0, 11)
+
+# Tabla con el frente de Pareto de cada perfil optimizado
+PARETO_TABLE = 'fe_dieta_pareto'
+
+
+def candidates(catalog, vp_ids=None, vs_ids=None, shares=None) -> pd.DataFrame:
+    """
+    Grilla de dietas candidatas: forraje x suplemento x porcentaje de forraje. Con 100 % de forraje el
+    suplemento no cambia el resultado y se evalúa una sola vez
+    :param catalog: Catalog
+    :param vp_ids: variedades de pasto. Por defecto todo el catálogo
+    :param vs_ids: suplementos. Por defecto todo el catálogo
+    :param shares: porcentajes de forraje. Por defecto DIET_SHARES
+    :return: DataFrame vp_id, vs_id, pf, ps
+    """
+    vp_ids = catalog.tables['variedad_pasto'].index.values if vp_ids is None else np.asarray(vp_ids)
+    vs_ids = catalog.tables['suplemento'].index.values if vs_ids is None else np.asarray(vs_ids)
+    shares = DIET_SHARES if shares is None else np.asarray(shares, dtype='float64')
+    vp, vs, pf = [m.ravel() for m in np.meshgrid(vp_ids, vs_ids, shares, indexing='ij')]
+    keep = (pf < 100) | (vs == vs_ids[0])
+    df = pd.DataFrame({'vp_id': vp[keep], 'vs_id': vs[keep], 'pf': pf[keep]})
+    df['ps'] = 100 - df['pf']
+    return df
+
+
+def pareto_front(fe, cms) -> np.ndarray:
+    """
+    Frente de Pareto minimizando el factor de emisión y el consumo de materia seca
+    :param fe: factor de emisión por candidato
+    :param cms: consumo de materia seca por candidato
+    :return: arreglo booleano de candidatos no dominados
+    """
+    order = np.lexsort((cms, fe))
+    best = np.minimum.accumulate(cms[order])
+    previous = np.concatenate([[np.inf], best[:-1]])
+    front = np.zeros(len(fe), dtype=bool)
+    front[order] = cms[order] < previous
+    return front
+
+
+def optimize_diet(profile, catalog=None, vp_ids=None, vs_ids=None, shares=None, block_rows=500000):
+    """
+    Búsqueda de la mezcla forraje/suplemento que minimiza el factor de emisión por fermentación entérica de un
+    perfil. Todas las dietas candidatas se evalúan por bloques con FeGeBatch; se descartan las que superan el
+    consumo potencial de materia seca (cms > cpms, el punto de control de ef_execution) y se retorna el
+    frente de Pareto de fe frente a cms
+    :param profile: perfil de fe_fermentacion (Series o DataFrame de una fila)
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :param vp_ids: variedades de pasto candidatas. Por defecto todo el catálogo
+    :param vs_ids: suplementos candidatos. Por defecto todo el catálogo
+    :param shares: porcentajes de forraje candidatos
+    :param block_rows: número máximo de candidatos por evaluación de FeGeBatch
+    :return: frente de Pareto ordenado por fe, todos los candidatos factibles
+    """
+    catalog = catalog if catalog is not None else Catalog()
+    profile = profile.to_frame().T if isinstance(profile, pd.Series) else profile
+    params = {k: np.asarray(v, dtype='float64')[0] for k, v in profiles_from_frame(profile).items()}
+    df = candidates(catalog, vp_ids, vs_ids, shares)
+    res = np.full((len(df), 3), np.nan)
+    for start in range(0, len(df), block_rows):
+        block = df.iloc[start:start + block_rows]
+        params.update({name: block[name].values for name in ('vp_id', 'vs_id', 'pf', 'ps')})
+        ef = FeGeBatch(catalog=catalog, **params)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            res[start:start + len(block)] = np.column_stack([ef.ef_calc(), ef.cms, ef.cpms_selection()])
+    df['fe'], df['cms'], df['cpms'] = res.T
+    with np.errstate(invalid='ignore'):
+        feasible = np.isfinite(res).all(axis=1) & (df['cms'].values <= df['cpms'].values)
+    df = df[feasible].reset_index(drop=True)
+    df['pareto'] = pareto_front(df['fe'].values, df['cms'].values)
+    return df[df['pareto']].sort_values(by=['fe']).reset_index(drop=True), df
+
+
+def write_pareto(df_pareto, profile_id, table=PARETO_TABLE) -> None:
+    """
+    Reemplaza el frente de Pareto de un perfil sin tocar los de los demás perfiles. El borrado y la escritura se
+    hacen en una sola transacción
+    :param df_pareto: frente de Pareto de optimize_diet
+    :param profile_id: id del perfil de fe_fermentacion
+    :param table: tabla de salida
+    """
+    df_pareto = df_pareto.copy()
+    df_pareto.insert(0, 'id', int(profile_id))
+    engine = create_engine(pg_connection_str())
+    with engine.begin() as connection:
+        if connection.dialect.has_table(connection, table):
+            connection.execute(text(f"DELETE FROM {table} WHERE id = :id"), {'id': int(profile_id)})
+        df_pareto.to_sql(table, con=connection, if_exists='append', index=False, method="multi", chunksize=5000)
+    engine.dispose()
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Optimizacion de la dieta para minimizar el factor de emision')
+    parser.add_argument('-id', type=int, required=True, help='Id del perfil de fe_fermentacion')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    query = f"SELECT * FROM fe_fermentacion WHERE id = {int(args.id)}"
+    profile = pd.read_sql_query(query, pg_connection_str())
+    df_pareto, _df = optimize_diet(profile)
+    write_pareto(df_pareto, args.id)
+    print(df_pareto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import json
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.enteric_fermentation.gross_energy_batch import GE_CATALOG_VALUES
+from src.manure_management.manure_batch import FeGeBatch, FE_FERMENTACION_COLUMNS, mcf_values, profiles_from_frame
+
+path_root = os.path.abspath(os.path.join(os.path.abspath(__file__), "../../../"))
+
+# Ejes continuos de la grilla: parámetro de FeGe -> nodos por defecto. El porcentaje de suplemento de los nodos es
+# 100 - pf; los perfiles con otro porcentaje de suplemento quedan fuera de la grilla (ver FastGrid.combo_index).
+# Al construir la grilla cada eje se recorta al rango de los perfiles (ver axes_from_frame) y un parámetro
+# constante queda con un solo nodo. fe y svbo son afines en ta, leche, grasa y ht, por lo que dos nodos son
+# exactos en esos ejes; el único quiebre en ta es la temperatura de confort del consumo de los terneros, que se
+# agrega como nodo desde el catálogo. El eje de peso incluye el quiebre de 350 kg de bfaf_calc_tp
+GRID_AXES = {
+    'ta': np.linspace(0.0, 35.0, 2),
+    'weight': np.linspace(50.0, 800.0, 16),
+    'milk': np.linspace(0.0, 8000.0, 2),
+    'pf': np.linspace(0.0, 100.0, 11),
+    'adult_w': np.linspace(200.0, 800.0, 9),
+    'gan': np.linspace(0.0, 1.5, 7),
+    'grease': np.linspace(0.0, 10.0, 2),
+    'ht': np.linspace(0.0, 24.0, 2),
+}
+
+# Salidas guardadas en la grilla: factor de emisión por fermentación entérica y sólidos volátiles anuales por la
+# capacidad máxima de producción de metano (svbo). fge = svbo * factor del estiércol, que depende de ta y de los
+# porcentajes de los sistemas de gestión y se calcula exacto en manure_factor
+GRID_OUTPUTS = ['fe', 'svbo']
+
+# Salidas de la interpolación
+RESULT_OUTPUTS = ['fe', 'fge']
+
+# Columna de fe_fermentacion de cada eje
+AXIS_COLUMNS = {param: col for col, param in FE_FERMENTACION_COLUMNS.items() if param in GRID_AXES}
+
+# Columnas de fe_fermentacion que definen una combinación: solo los ids categóricos del catálogo
+COMBO_COLUMNS = [col for col in FE_FERMENTACION_COLUMNS if col.startswith('id_')]
+
+# Tolerancia de por_pasto + por_suple = 100 de los perfiles que se interpolan
+DIET_TOLERANCE = 1e-6
+
+
+def combos_from_frame(df) -> pd.DataFrame:
+    """
+    Combinaciones distintas de ids presentes en los perfiles
+    :param df: perfiles con la estructura de fe_fermentacion
+    :return: DataFrame con COMBO_COLUMNS
+    """
+    return df[COMBO_COLUMNS].drop_duplicates().reset_index(drop=True)
+
+
+def axes_from_frame(df, catalog, axes=None) -> dict:
+    """
+    Nodos de cada eje recortados al rango de los perfiles: el mínimo, los nodos por defecto interiores y el
+    máximo. En ta se agregan las temperaturas de confort del catálogo
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param catalog: Catalog
+    :param axes: nodos por defecto. Por defecto GRID_AXES
+    :return: diccionario parámetro -> nodos
+    """
+    axes = GRID_AXES if axes is None else axes
+    table, column, _ = GE_CATALOG_VALUES['tc']
+    breaks = {'ta': catalog.tables[table][column].values.astype('float64')}
+    res = {}
+    for name in GRID_AXES:
+        nodes = np.concatenate([np.asarray(axes[name], dtype='float64'), breaks.get(name, [])])
+        values = df[AXIS_COLUMNS[name]].values.astype('float64')
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            res[name] = np.unique(nodes[np.isfinite(nodes)])
+            continue
+        low, high = values.min(), values.max()
+        res[name] = np.unique(np.concatenate([[low], nodes[(nodes > low) & (nodes < high)], [high]]))
+    return res
+
+
+def points_from_frame(df) -> list:
+    """
+    Coordenadas de los perfiles en los ejes de la grilla
+    :param df: perfiles con la estructura de fe_fermentacion
+    :return: lista de arreglos en el orden de GRID_AXES
+    """
+    return [df[AXIS_COLUMNS[name]].values.astype('float64') for name in GRID_AXES]
+
+
+def combo_awms(combos, catalog) -> np.ndarray:
+    """
+    AWMS de los sistemas de gestión de residuos A y B de cada combinación (ver FeGeBatch.awms_sel)
+    :param combos: combinaciones de combos_from_frame
+    :param catalog: Catalog
+    :return: arreglo (combinaciones, 2)
+    """
+    high = combos['id_at'].values == 1
+    return np.column_stack([np.where(high, catalog.lookup('gestion_residuos', 'alta_prod', combos[col].values),
+                                     catalog.lookup('gestion_residuos', 'otras', combos[col].values))
+                            for col in ('id_gestion_res1', 'id_gestion_res2')])
+
+
+def manure_factor(combos, awms, combo_idx, ta, p_sga, p_sgb) -> np.ndarray:
+    """
+    Factor del estiércol de fge (0.67 * mcfp / 100 * awmsp, ver FeGeBatch.ef_ge_calc) para los sistemas A y B
+    :param combos: combinaciones de combos_from_frame
+    :param awms: arreglo (combinaciones, 2) de combo_awms
+    :param combo_idx: combinación de cada punto
+    :param ta: temperatura de cada punto
+    :param p_sga: porcentaje del sistema A
+    :param p_sgb: porcentaje del sistema B
+    :return: arreglo por punto
+    """
+    shares = [np.asarray(p_sga, dtype='float64') / 100, np.asarray(p_sgb, dtype='float64') / 100]
+    sge = [combos[col].values[combo_idx] for col in ('id_gestion_est1', 'id_gestion_est2')]
+    mcfp = sum(mcf_values(s, ta) * share for s, share in zip(sge, shares)) / 100
+    awmsp = sum(awms[combo_idx, k] * share for k, share in enumerate(shares))
+    return 0.67 * (mcfp / 100) * awmsp
+
+
+def evaluate(combos, catalog, points, combo_idx, p_sga=100.0, p_sgb=0.0) -> np.ndarray:
+    """
+    Cálculo exacto con FeGeBatch para puntos de las combinaciones
+    :param combos: combinaciones de combos_from_frame
+    :param catalog: Catalog
+    :param points: lista de arreglos en el orden de GRID_AXES
+    :param combo_idx: combinación de cada punto
+    :param p_sga: porcentaje del sistema de gestión A
+    :param p_sgb: porcentaje del sistema de gestión B
+    :return: arreglo (fe, svbo, fge; puntos) con porcentaje de suplemento 100 - pf, como en los nodos de la grilla
+    """
+    params = {FE_FERMENTACION_COLUMNS[col]: combos[col].values[combo_idx] for col in COMBO_COLUMNS}
+    params.update(zip(GRID_AXES, points))
+    ef = FeGeBatch(catalog=catalog, ps=100.0 - params['pf'], p_sga=p_sga, p_sgb=p_sgb, **params)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.vstack([ef.ef_calc(), (ef.sv * 365) * ef.bo, ef.ef_ge_calc()])
+
+
+class FastGrid(object):
+    def __init__(self, path):
+        """
+        Grilla precalculada de fe y svbo sobre los parámetros continuos (GRID_AXES) para cada combinación de ids
+        del catálogo, con interpolación multilineal; fge se obtiene de svbo con el factor exacto del estiércol.
+        Los valores se guardan en un archivo .npy (float32) que se abre como memmap y los metadatos (ejes,
+        combinaciones, AWMS, versión del catálogo, error de la interpolación) en un .json
+        :param path: ruta del archivo sin extensión
+        """
+        self.path: str = path
+        with open(f'{path}.json') as json_file:
+            self.meta: dict = json.load(json_file)
+        self.axes: list = [np.asarray(self.meta['axes'][name]) for name in GRID_AXES]
+        self.combos: pd.DataFrame = pd.DataFrame(self.meta['combos'], columns=COMBO_COLUMNS)
+        self.awms: np.ndarray = np.asarray(self.meta['awms'], dtype='float64').reshape(-1, 2)
+        self.version: str = self.meta['version']
+        self.grid = np.load(f'{path}.npy', mmap_mode='r')
+
+    @staticmethod
+    def build(path, df, catalog=None, axes=None, block_rows=500000, n_check=20000, seed=None):
+        """
+        Construye y guarda la grilla para las combinaciones presentes en los perfiles
+        :param path: ruta del archivo sin extensión
+        :param df: perfiles con la estructura de fe_fermentacion
+        :param catalog: Catalog. Si no se entrega se lee de la base de datos
+        :param axes: nodos por defecto de los ejes, que se recortan al rango de los perfiles. Por defecto GRID_AXES
+        :param block_rows: número máximo de puntos por evaluación de FeGeBatch
+        :param n_check: perfiles tomados al azar para medir el error de la interpolación
+        :param seed: semilla de la muestra de verificación
+        :return: FastGrid
+        """
+        catalog = catalog if catalog is not None else Catalog()
+        axes = axes_from_frame(df, catalog, axes)
+        combos = combos_from_frame(df)
+        shape = tuple(len(axes[name]) for name in GRID_AXES)
+        nodes = [m.ravel() for m in np.meshgrid(*[axes[name] for name in GRID_AXES], indexing='ij')]
+        n_nodes = nodes[0].size
+        grid = np.lib.format.open_memmap(f'{path}.npy', mode='w+', dtype='float32',
+                                         shape=(len(combos), len(GRID_OUTPUTS)) + shape)
+        per_block = max(1, block_rows // n_nodes)
+        for start in range(0, len(combos), per_block):
+            idx = np.arange(start, min(start + per_block, len(combos)))
+            values = evaluate(combos, catalog, [np.tile(n, idx.size) for n in nodes], np.repeat(idx, n_nodes))
+            grid[idx] = values[:len(GRID_OUTPUTS)].reshape((len(GRID_OUTPUTS), idx.size) + shape).swapaxes(0, 1)
+        grid.flush()
+        del grid
+        meta = {'axes': {name: [float(x) for x in axes[name]] for name in GRID_AXES},
+                'outputs': GRID_OUTPUTS,
+                'combos': combos.astype('float64').values.tolist(),
+                'awms': combo_awms(combos, catalog).tolist(),
+                'version': catalog.version}
+        with open(f'{path}.json', 'w') as json_file:
+            json.dump(meta, json_file)
+        fast = FastGrid(path)
+        check = df.sample(n=min(n_check, len(df)), random_state=seed)
+        fast.meta['error_max'] = fast.max_error(check, catalog)
+        with open(f'{path}.json', 'w') as json_file:
+            json.dump(fast.meta, json_file)
+        return fast
+
+    @staticmethod
+    def open(path, df, catalog=None):
+        """
+        Abre la grilla y la reconstruye si no existe o si la versión del catálogo cambió
+        :return: FastGrid
+        """
+        catalog = catalog if catalog is not None else Catalog()
+        if os.path.exists(f'{path}.json') and os.path.exists(f'{path}.npy'):
+            fast = FastGrid(path)
+            if fast.version == catalog.version:
+                return fast
+        return FastGrid.build(path, df, catalog)
+
+    def combo_index(self, df) -> np.ndarray:
+        """
+        Combinación de cada perfil, -1 si la combinación no está en la grilla o si por_suple no es
+        100 - por_pasto (los nodos de la grilla solo cubren esa dieta). Esos perfiles deben calcularse con FeGeBatch
+        :param df: perfiles con las columnas COMBO_COLUMNS, por_pasto y por_suple
+        :return: arreglo de índices
+        """
+        combos = self.combos.reset_index().rename(columns={'index': 'combo'})
+        merged = df[COMBO_COLUMNS].astype('float64').merge(combos, on=COMBO_COLUMNS, how='left')
+        diet = df['por_pasto'].values.astype('float64') + df['por_suple'].values.astype('float64')
+        on_grid = np.abs(diet - 100.0) <= DIET_TOLERANCE
+        return np.where(on_grid, merged['combo'].fillna(-1).values, -1).astype('int64')
+
+    def interpolate(self, combo_idx, points, p_sga, p_sgb) -> np.ndarray:
+        """
+        Interpolación multilineal de fe y svbo, y fge con el factor exacto del estiércol. Los puntos fuera de los
+        ejes se llevan al borde de la grilla y los puntos sin combinación en la grilla (combo_idx -1) quedan
+        como NaN. El porcentaje de suplemento de los puntos es 100 - pf
+        :param combo_idx: combinación de cada punto
+        :param points: lista de arreglos en el orden de GRID_AXES
+        :param p_sga: porcentaje del sistema de gestión A de cada punto
+        :param p_sgb: porcentaje del sistema de gestión B de cada punto
+        :return: arreglo (salidas, puntos) en el orden de RESULT_OUTPUTS
+        """
+        combo_idx = np.asarray(combo_idx, dtype='int64')
+        known = (combo_idx >= 0) & (combo_idx < len(self.combos))
+        combo_pos = np.where(known, combo_idx, 0)
+        lower, upper, frac = [], [], []
+        for axis, x in zip(self.axes, points):
+            x = np.clip(np.asarray(x, dtype='float64'), axis[0], axis[-1])
+            i = np.clip(np.searchsorted(axis, x, side='right') - 1, 0, max(len(axis) - 2, 0))
+            j = np.minimum(i + 1, len(axis) - 1)
+            lower.append(i)
+            upper.append(j)
+            frac.append(np.where(j > i, (x - axis[i]) / np.where(j > i, axis[j] - axis[i], 1.0), 0.0))
+        # Solo los ejes con más de un nodo aportan esquinas
+        active = [k for k, axis in enumerate(self.axes) if len(axis) > 1]
+        res = np.zeros((len(GRID_OUTPUTS), combo_idx.size))
+        outputs = np.arange(len(GRID_OUTPUTS))[None, :]
+        for corner in range(2 ** len(active)):
+            bits = {k: (corner >> n) & 1 for n, k in enumerate(active)}
+            weight_c = np.ones(combo_idx.size)
+            index = []
+            for k in range(len(self.axes)):
+                b = bits.get(k, 0)
+                weight_c = weight_c * (frac[k] if b else 1 - frac[k])
+                index.append(upper[k] if b else lower[k])
+            values = self.grid[(combo_pos[:, None], outputs) + tuple(i[:, None] for i in index)]
+            res += (values * weight_c[:, None]).T
+        ta = np.asarray(points[list(GRID_AXES).index('ta')], dtype='float64')
+        res[1] = res[1] * manure_factor(self.combos, self.awms, combo_pos, ta, p_sga, p_sgb)
+        res[:, ~known] = np.nan
+        return res
+
+    def profiles_calc(self, df) -> np.ndarray:
+        """
+        fe y fge interpolados para perfiles con la estructura de fe_fermentacion
+        :param df: perfiles
+        :return: arreglo (salidas, perfiles), NaN en los perfiles fuera de la grilla (ver combo_index)
+        """
+        return self.interpolate(self.combo_index(df), points_from_frame(df), df['por_gestion1'].values,
+                                df['por_gestion2'].values)
+
+    def max_error(self, df, catalog) -> dict:
+        """
+        Error de la interpolación frente al cálculo exacto con FeGeBatch en los perfiles entregados, con su propio
+        porcentaje de suplemento. Los perfiles fuera de la grilla no entran en el error y se cuentan en excluidos
+        :param df: perfiles con la estructura de fe_fermentacion
+        :param catalog: Catalog
+        :return: diccionario salida -> {'abs': error absoluto, 'rel': error relativo, 'rel_p99': percentil 99},
+                 y excluidos -> número de perfiles fuera de la grilla
+        """
+        ef = FeGeBatch(catalog=catalog, **profiles_from_frame(df))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            exact = np.vstack([ef.ef_calc(), ef.ef_ge_calc()])
+        approx = self.profiles_calc(df)
+        errors = {'excluidos': int((self.combo_index(df) < 0).sum())}
+        for k, name in enumerate(RESULT_OUTPUTS):
+            valid = np.isfinite(exact[k]) & np.isfinite(approx[k])
+            diff = np.abs(approx[k][valid] - exact[k][valid])
+            scale = np.abs(exact[k][valid])
+            rel = diff[scale > 0] / scale[scale > 0]
+            errors[name] = {'abs': float(diff.max()) if diff.size else None,
+                            'rel': float(rel.max()) if rel.size else None,
+                            'rel_p99': float(np.percentile(rel, 99)) if rel.size else None}
+        return errors
+
+
+def main():
+    df = pd.read_sql_query("SELECT * FROM fe_fermentacion", pg_connection_str())
+    os.makedirs(f'{path_root}/results', exist_ok=True)
+    fast = FastGrid.open(f'{path_root}/results/fe_ge_grilla', df)
+    print(fast.meta['error_max'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+import sys
+import os
+import argparse
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.territory import TerritoryIndex, MUNICIPALITY
+from src.analysis.co2e_rollup import GWP_SETS, EMISSION_SOURCES, UNASSIGNED, leaf_category
+from src.land_use.deforestacion import EMISSION_UNIT
+
+# Tabla con las filas normalizadas de cada módulo
+INVENTORY_TABLE = 'inventario_afolu'
+
+# Tabla con los subtotales en caché por módulo, categoría, año y gas
+SUBTOTALS_TABLE = 'inventario_afolu_subtotales'
+
+# Columnas del esquema largo
+LONG_COLUMNS = ['modulo', 'categoria', 'nivel_territorio', 'territorio', 'ano', 'gas', 'valor']
+
+# Códigos IPCC: sector, categoría, subcategoría, letra y numeral romano (3, 3B, 3B1, 3B1a, 3B1aiii)
+CATEGORY_PATTERN = re.compile(r'^(\d)([A-Z])?(\d+)?([a-z])?([ivx]+)?$')
+
+# Niveles territoriales de 3b1aiii_resultados, del más fino al más grueso
+FOREST_TERRITORIES = ['cod_muni', 'cod_depto', 'id_subregion']
+
+# Nivel del índice territorial al que se llevan las filas por municipio de todos los módulos
+TERRITORY_LEVEL = 'cod_depto'
+
+
+def category_levels(code, root) -> list:
+    """
+    Categorías desde una subcategoría hasta el sector. Los nombres que no son códigos IPCC (subcategorías
+    de deforestacion_resultado) se ubican bajo la categoría raíz del módulo
+    :param code: código o nombre de la categoría
+    :param root: categoría raíz del módulo (3A, 3B)
+    :return: lista de categorías de la más fina al sector
+    """
+    match = CATEGORY_PATTERN.match(str(code))
+    if match is None:
+        return [str(code)] + category_levels(root, root)
+    parts = [part for part in match.groups() if part]
+    return [''.join(parts[:i]) for i in range(len(parts), 0, -1)]
+
+
+def livestock_slice(index, df_act=None) -> pd.DataFrame:
+    """
+    Emisiones de fermentación entérica y gestión del estiércol (CH4) por departamento, desde
+    datos_act_bovinos_ipcc_temporal. Las sumas por municipio se llevan a TERRITORY_LEVEL con el índice
+    territorial; los municipios desconocidos van al código UNASSIGNED
+    :param index: TerritoryIndex
+    :param df_act: emisiones por municipio, año y animal tipo. Por defecto se leen de la base de datos
+    :return: DataFrame con LONG_COLUMNS sin modulo
+    """
+    if df_act is None:
+        query = """ SELECT cod_muni, ano, id_ani_tipo_ipcc, SUM(emision_fe) as emision_fe,
+                           SUM(emision_ge) as emision_ge
+                    FROM datos_act_bovinos_ipcc_temporal
+                    GROUP BY cod_muni, ano, id_ani_tipo_ipcc
+                """
+        df_act = pd.read_sql_query(query, con=pg_connection_str())
+    by = df_act[['ano', 'id_ani_tipo_ipcc']].fillna(UNASSIGNED)
+    df_act = index.rollup(df_act[MUNICIPALITY].values, df_act[list(EMISSION_SOURCES)].fillna(0.0), TERRITORY_LEVEL,
+                          by=by, unassigned=UNASSIGNED)
+    tables = []
+    for col, (gas, source) in EMISSION_SOURCES.items():
+        tables.append(pd.DataFrame({'categoria': leaf_category(source, df_act['id_ani_tipo_ipcc'].values),
+                                    'nivel_territorio': TERRITORY_LEVEL, 'territorio': df_act[TERRITORY_LEVEL].values,
+                                    'ano': df_act['ano'].values, 'gas': gas, 'valor': df_act[col].values}))
+    return pd.concat(tables, ignore_index=True)
+
+
+def deforestation_slice(index, df=None) -> pd.DataFrame:
+    """
+    Emisiones de deforestación (CO2) por bioma desde deforestacion_resultado: una columna por subcategoría en t
+    CO2, que se pasan a Gg. La columna unidad debe indicar un reporte de emisiones (id_type 2 o 3, id_report 3
+    a 6); un reporte de hectáreas o una tabla sin unidad produce ValueError
+    :param index: TerritoryIndex (los biomas no están en el índice, no se usa)
+    :param df: contenido de deforestacion_resultado. Por defecto se lee de la base de datos
+    :return: DataFrame con LONG_COLUMNS sin modulo
+    """
+    if df is None:
+        df = pd.read_sql('deforestacion_resultado', con=pg_connection_str())
+    units = set(df['unidad']) if 'unidad' in df.columns else {None}
+    if units != {EMISSION_UNIT}:
+        raise ValueError(f"deforestacion_resultado tiene unidad {sorted(map(str, units))}; el inventario requiere "
+                         f"un reporte de emisiones en {EMISSION_UNIT} (id_type 2 o 3, id_report 3 a 6)")
+    df = df.drop(columns=['unidad']).melt(id_vars=['bioma', 'ano'], var_name='categoria', value_name='valor')
+    df = df.rename(columns={'bioma': 'territorio'})
+    df['nivel_territorio'] = 'bioma'
+    df['gas'] = 'CO2'
+    df['valor'] = df['valor'] / 1000.0
+    return df
+
+
+def forest_plantation_slice(index, df=None) -> pd.DataFrame:
+    """
+    Emisiones netas de plantaciones forestales (3B1aiii, CO2) desde 3b1aiii_resultados. El territorio es la
+    columna territorial presente en la tabla; si no hay ninguna el resultado es nacional y si es el municipio se
+    lleva a TERRITORY_LEVEL con el índice territorial, como la ganadería. Los valores en t CO2 se pasan a Gg y se
+    suman sobre especie, fuente y sistema de siembra
+    :param index: TerritoryIndex
+    :param df: contenido de 3b1aiii_resultados. Por defecto se lee de la base de datos
+    :return: DataFrame con LONG_COLUMNS sin modulo
+    """
+    if df is None:
+        df = pd.read_sql('3b1aiii_resultados', con=pg_connection_str())
+    columns = [col for col in FOREST_TERRITORIES if col in df.columns and (df[col] != 'Todas').any()]
+    level = columns[0] if columns else 'nacional'
+    if level == MUNICIPALITY:
+        values = {'valor': df['ems_bt_net'].values / 1000.0}
+        df = index.rollup(pd.to_numeric(df[MUNICIPALITY], errors='coerce').values, values, TERRITORY_LEVEL,
+                          by=df['anio'].rename('ano'), unassigned=UNASSIGNED)
+        df = df.rename(columns={TERRITORY_LEVEL: 'territorio'})
+        level = TERRITORY_LEVEL
+    else:
+        territory = df[level].values if columns else 0
+        df = pd.DataFrame({'territorio': territory, 'ano': df['anio'].values,
+                           'valor': df['ems_bt_net'].values / 1000.0})
+        df = df.groupby(['territorio', 'ano'], sort=True)['valor'].sum().reset_index()
+    df['categoria'] = '3B1aiii'
+    df['nivel_territorio'] = level
+    df['gas'] = 'CO2'
+    return df
+
+
+# Módulo -> lectura de su tabla de resultados, categoría raíz
+MODULES = {
+    'ganaderia': (livestock_slice, '3A'),
+    'deforestacion': (deforestation_slice, '3B'),
+    'plantaciones': (forest_plantation_slice, '3B'),
+}
+
+
+def module_slice(module, index) -> pd.DataFrame:
+    """
+    Filas de un módulo en el esquema largo
+    :param module: nombre en MODULES
+    :param index: TerritoryIndex compartido por los módulos
+    :return: DataFrame con LONG_COLUMNS (territorio como texto)
+    """
+    reader, _root = MODULES[module]
+    df = reader(index)
+    df['modulo'] = module
+    df['territorio'] = df['territorio'].astype(str)
+    df['valor'] = pd.to_numeric(df['valor'], errors='coerce').fillna(0.0)
+    return df[LONG_COLUMNS]
+
+
+def subtotals_calc(df, root) -> pd.DataFrame:
+    """
+    Subtotales nacionales de un módulo para todos los niveles de la jerarquía de categorías
+    :param df: filas de module_slice
+    :param root: categoría raíz del módulo
+    :return: DataFrame modulo, categoria, nivel_categoria, ano, gas, valor
+    """
+    leaves = df.groupby(['modulo', 'categoria', 'ano', 'gas'], sort=True)['valor'].sum().reset_index()
+    levels = {code: category_levels(code, root) for code in leaves['categoria'].unique()}
+    tables = []
+    for depth in range(max(len(v) for v in levels.values()) if levels else 0):
+        codes = leaves['categoria'].map(lambda code: levels[code][depth] if depth < len(levels[code]) else None)
+        table = leaves.assign(categoria=codes.values)[codes.notnull().values]
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=['modulo', 'categoria', 'nivel_categoria', 'ano', 'gas', 'valor'])
+    df_sub = pd.concat(tables, ignore_index=True)
+    df_sub = df_sub.groupby(['modulo', 'categoria', 'ano', 'gas'], sort=True)['valor'].sum().reset_index()
+    df_sub.insert(2, 'nivel_categoria', df_sub['categoria'].map(lambda code: len(category_levels(code, root))))
+    return df_sub
+
+
+def replace_slice(table, module, df) -> None:
+    """
+    Reemplaza las filas de un módulo en una tabla del inventario sin tocar las de los demás módulos. El borrado
+    y la escritura se hacen en una sola transacción, de modo que una falla no deja el módulo sin filas
+    :param table: INVENTORY_TABLE o SUBTOTALS_TABLE
+    :param module: nombre en MODULES
+    :param df: filas nuevas del módulo
+    """
+    engine = create_engine(pg_connection_str())
+    with engine.begin() as connection:
+        if connection.dialect.has_table(connection, table):
+            connection.execute(text(f"DELETE FROM {table} WHERE modulo = :modulo"), {'modulo': module})
+        df.to_sql(table, con=connection, if_exists='append', index=False, method="multi", chunksize=5000)
+    engine.dispose()
+
+
+def refresh_module(module, index=None) -> pd.DataFrame:
+    """
+    Vuelve a leer la tabla de resultados de un módulo y reemplaza solo su parte del inventario y de los
+    subtotales en caché
+    :param module: nombre en MODULES
+    :param index: TerritoryIndex. Si no se entrega se lee de la base de datos
+    :return: subtotales del módulo
+    """
+    df = module_slice(module, index if index is not None else TerritoryIndex())
+    df_sub = subtotals_calc(df, MODULES[module][1])
+    replace_slice(INVENTORY_TABLE, module, df)
+    replace_slice(SUBTOTALS_TABLE, module, df_sub)
+    return df_sub
+
+
+def national_totals(gwp='AR5', df_sub=None) -> pd.DataFrame:
+    """
+    Total nacional AFOLU en CO2 equivalente a partir de los subtotales en caché de todos los módulos
+    :param gwp: nombre de GWP_SETS o diccionario gas -> potencial
+    :param df_sub: subtotales. Por defecto se leen de SUBTOTALS_TABLE
+    :return: DataFrame categoria, nivel_categoria, ano, co2e (Gg CO2e)
+    """
+    df_sub = df_sub if df_sub is not None else pd.read_sql(SUBTOTALS_TABLE, con=pg_connection_str())
+    factors = GWP_SETS[gwp] if isinstance(gwp, str) else gwp
+    df = df_sub.assign(co2e=df_sub['valor'].values * df_sub['gas'].map(factors).values)
+    return df.groupby(['categoria', 'nivel_categoria', 'ano'], sort=True)['co2e'].sum().reset_index()
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Inventario nacional AFOLU a partir de los resultados de cada modulo')
+    parser.add_argument('modulos', type=str, nargs='*',
+                        help=f'Modulos a actualizar {list(MODULES)} (por defecto todos)')
+    parser.add_argument('--gwp', type=str, default='AR5', choices=list(GWP_SETS), help='Potenciales del IPCC')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    index = TerritoryIndex()
+    for module in args.modulos or list(MODULES):
+        df_sub = refresh_module(module, index)
+        print(f"{module}={len(df_sub)}")
+    df_tot = national_totals(args.gwp)
+    print(df_tot[df_tot['nivel_categoria'] == 1].to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
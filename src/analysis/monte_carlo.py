@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.enteric_fermentation.gross_energy_batch import GE_CATALOG_VALUES
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+from src.analysis.co2e_rollup import UNASSIGNED
+
+# Distribuciones de los parámetros: parámetro -> (distribución, dispersión, relativa, compartida)
+# relativa: la dispersión es una fracción del valor central. compartida: una sola muestra por iteración
+# para todos los perfiles (coeficientes del catálogo), en lugar de una muestra por perfil
+UNCERTAINTY = {
+    'ta': ('normal', 1.0, False, False),
+    'weight': ('normal', 0.10, True, False),
+    'milk': ('normal', 0.15, True, False),
+    'grease': ('normal', 0.10, True, False),
+    'pf': ('uniform', 10.0, False, False),
+    'edr_f': ('normal', 0.05, True, True),
+    'edr_s': ('normal', 0.05, True, True),
+    'fdaf': ('normal', 0.10, True, True),
+    'fdnf': ('normal', 0.10, True, True),
+    'fdas': ('normal', 0.10, True, True),
+    'fdns': ('normal', 0.10, True, True),
+}
+
+# Rangos permitidos para los parámetros muestreados (el resto se limita a valores no negativos)
+LIMITS = {
+    'ta': (-10.0, 50.0),
+    'pf': (0.0, 100.0),
+}
+
+# Valores del catálogo que se reutilizan entre iteraciones en lugar de consultarse de nuevo
+CATALOG_VALUES = list(GE_CATALOG_VALUES) + ['sap', 'sbp', 'awms_a', 'awms_b']
+
+
+def sample(rng, dist, center, spread, relative, shape):
+    """
+    Muestras de un parámetro alrededor de su valor central
+    :param rng: generador de números aleatorios
+    :param dist: 'normal', 'uniform' o 'triangular'
+    :param center: valor central, arreglo (1, perfiles) o (iteraciones, perfiles)
+    :param spread: desviación estándar (normal) o semiancho (uniform, triangular)
+    :param relative: si la dispersión es una fracción del valor central
+    :param shape: forma de las muestras aleatorias
+    :return: arreglo de muestras
+    """
+    scale = spread * np.abs(center) if relative else spread
+    if dist == 'normal':
+        return center + scale * rng.standard_normal(shape)
+    elif dist == 'uniform':
+        return center + scale * rng.uniform(-1.0, 1.0, shape)
+    elif dist == 'triangular':
+        return center + scale * rng.triangular(-1.0, 0.0, 1.0, shape)
+    raise ValueError(f'Distribucion no soportada: {dist}')
+
+
+def draw_block(rng, base, params, n_draws, uncertainty):
+    """
+    Parámetros de FeGeBatch para un bloque de iteraciones
+    :param rng: generador de números aleatorios
+    :param base: FeGeBatch con la estimación puntual de los perfiles
+    :param params: parámetros de los perfiles
+    :param n_draws: número de iteraciones del bloque
+    :param uncertainty: distribuciones de los parámetros
+    :return: parámetros de FeGeBatch de tamaño n_draws * perfiles
+    """
+    size = base.size
+    block = {k: np.tile(np.asarray(v, dtype='float64'), n_draws) for k, v in params.items()}
+    for name in CATALOG_VALUES:
+        block[name] = np.tile(getattr(base, name), n_draws)
+    for name, (dist, spread, relative, shared) in uncertainty.items():
+        center = block[name].reshape(n_draws, size)
+        shape = (n_draws, 1) if shared else (n_draws, size)
+        low, high = LIMITS.get(name, (0.0, np.inf))
+        block[name] = np.clip(sample(rng, dist, center, spread, relative, shape), low, high).ravel()
+    if 'pf' in uncertainty:
+        total = np.tile(base.pf + base.ps, n_draws)
+        block['ps'] = np.clip(total - block['pf'], 0.0, 100.0)
+    return block
+
+
+def group_sums(values, groups, weights, n_groups):
+    """
+    Suma ponderada por grupo de cada iteración de un bloque. Una iteración con algún perfil NaN en el grupo se
+    descarta (NaN) en lugar de sumarlo como cero
+    :param values: arreglo (iteraciones, perfiles)
+    :param groups: grupo de cada perfil
+    :param weights: peso de cada perfil
+    :param n_groups: número de grupos
+    :return: sumas (iteraciones, grupos), iteraciones descartadas (iteraciones, grupos)
+    """
+    n = values.shape[0]
+    index = (np.arange(n)[:, None] * n_groups + groups[None, :]).ravel()
+    missing = np.isnan(values)
+    sums = np.bincount(index, weights=np.where(missing, 0.0, values * weights).ravel(), minlength=n * n_groups)
+    dropped = np.bincount(index, weights=missing.ravel(), minlength=n * n_groups).reshape(n, n_groups) > 0
+    sums = sums.reshape(n, n_groups)
+    sums[dropped] = np.nan
+    return sums, dropped
+
+
+def monte_carlo(df, n_draws=10000, uncertainty=None, percentiles=(2.5, 50.0, 97.5), group_by='id_at',
+                weights=None, block_rows=250000, seed=None, catalog=None, dtype='float64', profile_draws=1000):
+    """
+    Análisis de incertidumbre de Monte Carlo para el factor de emisión por fermentación entérica (fe)
+    y por gestión de estiércol (fge). Las iteraciones se evalúan en bloques de a lo sumo block_rows
+    perfiles-iteración con FeGeBatch y de cada bloque solo se guardan las sumas por grupo y, para los percentiles
+    por perfil, las primeras profile_draws iteraciones (las iteraciones son independientes, de modo que son una
+    muestra uniforme de todas). La memoria queda acotada por el bloque, profile_draws x perfiles y
+    iteraciones x grupos, sin una matriz de iteraciones x perfiles
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param n_draws: número de iteraciones
+    :param uncertainty: distribuciones de los parámetros. Por defecto UNCERTAINTY
+    :param percentiles: percentiles a reportar
+    :param group_by: columna(s) de df para los agregados. Las llaves nulas se agrupan con el código UNASSIGNED
+    :param weights: peso de cada perfil en el agregado (ej. número de animales). Por defecto 1
+    :param block_rows: número máximo de perfiles-iteración por bloque
+    :param seed: semilla del generador de números aleatorios
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :param dtype: precisión de las iteraciones. 'float32' reduce a la mitad la memoria de cada bloque
+        (ver precision_report para el error frente a float64)
+    :param profile_draws: iteraciones guardadas por perfil para sus percentiles
+    :return: percentiles por perfil, percentiles por agregado. Los perfiles con estimación puntual NaN se excluyen
+        del agregado (columna <salida>_excluidos) y las iteraciones con algún perfil NaN del grupo se descartan de
+        sus percentiles (columna <salida>_descartadas)
+    """
+    uncertainty = UNCERTAINTY if uncertainty is None else uncertainty
+    catalog = catalog if catalog is not None else Catalog()
+    rng = np.random.default_rng(seed)
+    params = profiles_from_frame(df)
+    base = FeGeBatch(catalog=catalog, **params)
+    size = base.size
+
+    df_prof = df[['id']].copy() if 'id' in df.columns else pd.DataFrame(index=df.index)
+    df_prof['fe'] = base.ef_calc()
+    df_prof['fge'] = base.ef_ge_calc()
+    keys = df[[group_by] if isinstance(group_by, str) else list(group_by)].fillna(UNASSIGNED)
+    grouped = keys.groupby(list(keys.columns), sort=True)
+    groups = grouped.ngroup().values
+    df_agg = grouped.size().rename('perfiles').reset_index()
+    n_groups = len(df_agg)
+    w = np.ones(size) if weights is None else np.asarray(weights, dtype='float64')
+    # los perfiles sin estimación puntual se excluyen del agregado
+    valid = {name: np.isfinite(df_prof[name].values) for name in ('fe', 'fge')}
+    n_sample = min(n_draws, profile_draws)
+    samples = {name: np.empty((n_sample, size), dtype='float32') for name in valid}
+    totals = {name: np.empty((n_draws, n_groups)) for name in valid}
+    dropped = {name: np.empty((n_draws, n_groups), dtype=bool) for name in valid}
+
+    draws_per_block = max(1, block_rows // size)
+    for start in range(0, n_draws, draws_per_block):
+        n = min(draws_per_block, n_draws - start)
+        ef = FeGeBatch(catalog=catalog, dtype=dtype, **draw_block(rng, base, params, n, uncertainty))
+        for name, values in (('fe', ef.ef_calc()), ('fge', ef.ef_ge_calc())):
+            values = values.reshape(n, size)
+            if start < n_sample:
+                k = min(n, n_sample - start)
+                samples[name][start:start + k] = values[:k]
+            keep = valid[name]
+            totals[name][start:start + n], dropped[name][start:start + n] = \
+                group_sums(values[:, keep], groups[keep], w[keep], n_groups)
+
+    # los perfiles y grupos con todas las iteraciones NaN quedan con percentiles NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name in ('fe', 'fge'):
+            for p, v in zip(percentiles, np.nanpercentile(samples[name], percentiles, axis=0)):
+                df_prof[f'{name}_p{p:g}'] = v
+        for name in ('fe', 'fge'):
+            keep = valid[name]
+            df_agg[f'{name}_excluidos'] = np.bincount(groups[~keep], minlength=n_groups)
+            df_agg[name] = np.bincount(groups[keep], weights=df_prof[name].values[keep] * w[keep],
+                                       minlength=n_groups)
+            df_agg[f'{name}_descartadas'] = dropped[name].sum(axis=0)
+            for p, v in zip(percentiles, np.nanpercentile(totals[name], percentiles, axis=0)):
+                df_agg[f'{name}_p{p:g}'] = v
+    return df_prof, df_agg
+
+
+def main():
+    df = pd.read_sql_query("SELECT * FROM fe_fermentacion", pg_connection_str())
+    df_prof, df_agg = monte_carlo(df, n_draws=10000, seed=2020)
+    df_prof.to_sql('fe_fermentacion_incertidumbre', con=pg_connection_str(), if_exists='replace', index=False,
+                   method="multi", chunksize=5000)
+    print(df_agg)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.enteric_fermentation.gross_energy_batch import GE_CATALOG_VALUES
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame, FE_FERMENTACION_COLUMNS
+
+# Nombre del escenario sin cambios
+BASE = 'base'
+
+# Atributos de GrossEnergyBatch con el id -> parámetro de FeGe
+ID_PARAMS = {
+    'ca_id': 'ca_id',
+    'id_cs': 'cs_id',
+    'vp_id': 'vp_id',
+    'vs_id': 'vs_id',
+    'ac_id': 'coe_act_id',
+    'cp_id': 'cp_id',
+}
+
+# Columnas sumadas en los totales nacionales
+EMISSION_COLUMNS = ['emision_fe', 'emision_ge', 'perfiles_excluidos', 'numero_excluido']
+
+# Valores del catálogo que se comparten entre escenarios -> parámetros de FeGe de los que dependen
+SHARED_VALUES = {
+    **{name: [ID_PARAMS[id_name]] for name, (_table, _column, id_name) in GE_CATALOG_VALUES.items()},
+    'sap': ['at_id'],
+    'sbp': ['at_id'],
+    'awms_a': ['at_id', 'sgra_id'],
+    'awms_b': ['at_id', 'sgrb_id'],
+}
+
+
+def get_act_data() -> pd.DataFrame:
+    """
+    Número de animales de bovinos por año, región ganadera y animal tipo
+    :return: DataFrame año, id_reg, id_at, numero
+    """
+    query = """ SELECT ano as año, id_reg_ganadera as id_reg, id_ani_tipo_ipcc as id_at, SUM(numero) as numero
+                FROM datos_act_bovinos_ipcc_temporal
+                GROUP BY ano, id_reg_ganadera, id_ani_tipo_ipcc
+            """
+    return pd.read_sql_query(query, pg_connection_str())
+
+
+def catalog_values(catalog, params, names) -> dict:
+    """
+    Valores del catálogo de FeGeBatch para parámetros dados, sin construir el lote completo
+    :param catalog: Catalog
+    :param params: parámetros de FeGeBatch
+    :param names: valores de SHARED_VALUES a consultar
+    :return: diccionario valor -> arreglo
+    """
+    values = {}
+    at_id = params['at_id']
+    for name in names:
+        if name in GE_CATALOG_VALUES:
+            table, column, id_name = GE_CATALOG_VALUES[name]
+            values[name] = catalog.lookup(table, column, params[ID_PARAMS[id_name]])
+        elif name in ('sap', 'sbp'):
+            column = 'bovino_alta_prod' if name == 'sap' else 'bovino_otras'
+            values[name] = catalog.lookup('produccion_metano', column, np.where(at_id == 1, 1, 2))
+        else:
+            ids = params['sgra_id'] if name == 'awms_a' else params['sgrb_id']
+            values[name] = np.where(at_id == 1, catalog.lookup('gestion_residuos', 'alta_prod', ids),
+                                    catalog.lookup('gestion_residuos', 'otras', ids))
+    return values
+
+
+def apply_rule(values, rule) -> np.ndarray:
+    """
+    Aplica un cambio a una columna
+    :param values: valores base
+    :param rule: valor fijo, función, o diccionario {'sumar': x} / {'multiplicar': x}
+    :return: valores del escenario
+    """
+    values = np.asarray(values, dtype='float64')
+    if callable(rule):
+        return np.asarray(rule(values), dtype='float64') * np.ones_like(values)
+    if isinstance(rule, dict):
+        return (values + rule.get('sumar', 0.0)) * rule.get('multiplicar', 1.0)
+    return np.full(values.shape, rule, dtype='float64')
+
+
+def scenario_params(df, params, scenario):
+    """
+    Parámetros de un escenario y filas que cambian respecto al escenario base
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param params: parámetros base de FeGeBatch
+    :param scenario: diccionario columna de fe_fermentacion -> cambio (ver apply_rule). La llave opcional
+        'filtro' ({columna: [valores]}) restringe los cambios a los perfiles que cumplen el filtro
+    :return: parámetros del escenario, arreglo booleano de filas cambiadas, parámetros cambiados
+    """
+    scenario = dict(scenario)
+    rows = np.ones(len(df), dtype=bool)
+    for col, values in scenario.pop('filtro', {}).items():
+        rows &= df[col].isin(values).values
+    new = dict(params)
+    changed = np.zeros(len(df), dtype=bool)
+    for col, rule in scenario.items():
+        param = FE_FERMENTACION_COLUMNS[col]
+        values = np.where(rows, apply_rule(params[param], rule), params[param])
+        changed |= values != params[param]
+        new[param] = values
+    return new, changed, [FE_FERMENTACION_COLUMNS[col] for col in scenario]
+
+
+def run_scenarios(df, df_act, scenarios, catalog=None, block_rows=500000):
+    """
+    Evaluación de escenarios de mitigación sobre todos los perfiles. Solo se recalculan las filas que cambian
+    en cada escenario, apiladas escenarios x perfiles en bloques de FeGeBatch, y los valores del catálogo del
+    escenario base se reutilizan cuando el escenario no cambia los ids de los que dependen.
+    Las emisiones se obtienen multiplicando la matriz escenarios x perfiles de factores por el número de animales
+    :param df: perfiles con la estructura de fe_fermentacion (con id_reg e id_at)
+    :param df_act: número de animales de get_act_data
+    :param scenarios: diccionario nombre -> cambios (ver scenario_params)
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :param block_rows: número máximo de filas por evaluación de FeGeBatch
+    :return: emisiones por escenario, año y animal tipo; totales nacionales por escenario y año. Los perfiles con
+        factor NaN en un escenario no entran en sus emisiones y se cuentan en perfiles_excluidos y numero_excluido
+    """
+    catalog = catalog if catalog is not None else Catalog()
+    names = [BASE] + [name for name in scenarios if name != BASE]
+    params = {k: np.asarray(v, dtype='float64') for k, v in profiles_from_frame(df).items()}
+    base = FeGeBatch(catalog=catalog, **params)
+    shared = {name: getattr(base, name) for name in SHARED_VALUES}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fe = np.tile(base.ef_calc(), (len(names), 1))
+        fge = np.tile(base.ef_ge_calc(), (len(names), 1))
+
+    stacked, targets = [], []
+    for s, name in enumerate(names[1:], start=1):
+        new, changed, touched = scenario_params(df, params, scenarios[name])
+        rows = np.flatnonzero(changed)
+        block = {k: v[rows] for k, v in new.items()}
+        stale = [k for k in SHARED_VALUES if set(SHARED_VALUES[k]) & set(touched)]
+        block.update({k: v[rows] for k, v in shared.items() if k not in stale})
+        block.update(catalog_values(catalog, block, stale))
+        stacked.append(block)
+        targets.append((np.full(rows.size, s), rows))
+    if stacked:
+        block = {k: np.concatenate([b[k] for b in stacked]) for k in stacked[0]}
+        s_idx = np.concatenate([t[0] for t in targets])
+        p_idx = np.concatenate([t[1] for t in targets])
+        for start in range(0, len(s_idx), block_rows):
+            end = start + block_rows
+            ef = FeGeBatch(catalog=catalog, **{k: v[start:end] for k, v in block.items()})
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fe[s_idx[start:end], p_idx[start:end]] = ef.ef_calc()
+                fge[s_idx[start:end], p_idx[start:end]] = ef.ef_ge_calc()
+
+    pos = df[['id_reg', 'id_at']].reset_index(drop=True).reset_index().rename(columns={'index': 'perfil'})
+    act = df_act.merge(pos, on=['id_reg', 'id_at'], how='inner')
+    groups = act.groupby(['año', 'id_at'], sort=True).ngroup().values
+    keys = act.groupby(['año', 'id_at'], sort=True).size().reset_index()[['año', 'id_at']]
+    numero = act['numero'].values / 1000000.0
+    tables = []
+    for s, name in enumerate(names):
+        table = keys.copy()
+        table.insert(0, 'escenario', name)
+        # los perfiles sin factor en el escenario (ej. un id que no está en el catálogo) se excluyen y se
+        # reportan, en lugar de sumarse como cero y aparecer como una reducción
+        valid = np.isfinite(fe[s, act['perfil'].values]) & np.isfinite(fge[s, act['perfil'].values])
+        for col, values in (('emision_fe', fe), ('emision_ge', fge)):
+            table[col] = np.bincount(groups[valid], weights=values[s, act['perfil'].values[valid]] * numero[valid],
+                                     minlength=len(keys))
+        table['perfiles_excluidos'] = np.bincount(groups[~valid], minlength=len(keys))
+        table['numero_excluido'] = np.bincount(groups[~valid], weights=act['numero'].values[~valid],
+                                               minlength=len(keys))
+        tables.append(table)
+    df_emis = pd.concat(tables, ignore_index=True)
+    df_nat = df_emis.groupby(['escenario', 'año'], sort=False)[EMISSION_COLUMNS].sum().reset_index()
+    return df_emis, df_nat
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Evaluacion de escenarios de mitigacion')
+    parser.add_argument('escenarios', type=str, help='Archivo JSON: nombre -> {columna: cambio, "filtro": {...}}')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    with open(args.escenarios) as json_file:
+        scenarios = json.load(json_file)
+    df = pd.read_sql_query("SELECT * FROM fe_fermentacion", pg_connection_str())
+    df_emis, df_nat = run_scenarios(df, get_act_data(), scenarios)
+    df_emis.to_sql('emisiones_escenarios', con=pg_connection_str(), if_exists='replace', index=False,
+                   method="multi", chunksize=5000)
+    df_nat.to_sql('emisiones_escenarios_nacional', con=pg_connection_str(), if_exists='replace', index=False,
+                  method="multi", chunksize=5000)
+    print(df_nat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+from src.analysis.monte_carlo import CATALOG_VALUES
+
+# Entradas numéricas de los perfiles (los ids son categóricos y no se perturban)
+PROFILE_INPUTS = ['ta', 'pf', 'ps', 'weight', 'adult_w', 'gan', 'milk', 'grease', 'ht', 'p_sga', 'p_sgb']
+
+# Salidas analizadas: nombre -> atributo o método de FeGeBatch
+OUTPUTS = {
+    'fe': 'ef_calc',
+    'fge': 'ef_ge_calc',
+    'ym': 'ym',
+    'cms': 'cms',
+    'ceb': 'tge',
+}
+
+# Columnas de identificación de los perfiles que se copian a la tabla de sensibilidad
+ID_COLUMNS = ['id', 'id_reg', 'id_at']
+
+
+def outputs(ef) -> dict:
+    """
+    Salidas de un FeGeBatch
+    :return: diccionario salida -> arreglo
+    """
+    res = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, attr in OUTPUTS.items():
+            value = getattr(ef, attr)
+            res[name] = value() if callable(value) else value
+    return res
+
+
+def sensitivity(df, inputs=None, step=0.01, block_rows=500000, catalog=None) -> pd.DataFrame:
+    """
+    Derivadas por diferencias centrales y elasticidades de fe, fge, ym, cms y ceb respecto a cada entrada
+    numérica, para todos los perfiles a la vez. Cada entrada se perturba en +-h con h = step * |x|
+    (o h = step si x = 0) y todas las perturbaciones se evalúan apiladas en un solo FeGeBatch por bloque
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param inputs: entradas a analizar. Por defecto las de los perfiles, los valores del catálogo y dep
+    :param step: tamaño relativo de la perturbación
+    :param block_rows: número máximo de filas por evaluación de FeGeBatch
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :return: tabla con una fila por perfil, entrada y salida
+    """
+    inputs = PROFILE_INPUTS + CATALOG_VALUES + ['dep'] if inputs is None else inputs
+    catalog = catalog if catalog is not None else Catalog()
+    params = profiles_from_frame(df)
+    base = FeGeBatch(catalog=catalog, **params)
+    size = base.size
+    y0 = outputs(base)
+    params.update({name: getattr(base, name) for name in CATALOG_VALUES})
+    params = {k: np.asarray(v, dtype='float64') for k, v in params.items()}
+    per_block = max(1, block_rows // (2 * size))
+    ids = df[[c for c in ID_COLUMNS if c in df.columns]].reset_index(drop=True)
+    tables = []
+    for start in range(0, len(inputs), per_block):
+        names = inputs[start:start + per_block]
+        n = 2 * len(names)
+        block = {k: np.tile(v, n) for k, v in params.items()}
+        x0, h = {}, {}
+        for i, name in enumerate(names):
+            x0[name] = getattr(base, name)
+            h[name] = np.where(x0[name] != 0, step * np.abs(x0[name]), step)
+            if name not in block:
+                # dep: NaN en las filas que no la perturban para que FeGeBatch la calcule
+                block[name] = np.full(n * size, np.nan)
+            block[name][2 * i * size:(2 * i + 1) * size] = x0[name] + h[name]
+            block[name][(2 * i + 1) * size:(2 * i + 2) * size] = x0[name] - h[name]
+        y = outputs(FeGeBatch(catalog=catalog, **block))
+        for i, name in enumerate(names):
+            for out, values in y.items():
+                up = values[2 * i * size:(2 * i + 1) * size]
+                down = values[(2 * i + 1) * size:(2 * i + 2) * size]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    deriv = (up - down) / (2 * h[name])
+                    elast = deriv * x0[name] / y0[out]
+                table = ids.copy()
+                table['entrada'] = name
+                table['salida'] = out
+                table['valor_entrada'] = x0[name]
+                table['valor_salida'] = y0[out]
+                table['derivada'] = deriv
+                table['elasticidad'] = elast
+                tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def main():
+    df = pd.read_sql_query("SELECT * FROM fe_fermentacion", pg_connection_str())
+    df_sens = sensitivity(df)
+    df_sens.to_sql('fe_sensibilidad', con=pg_connection_str(), if_exists='replace', index=False,
+                   method="multi", chunksize=5000)
+    print(df_sens.groupby(['salida', 'entrada'])['elasticidad'].median().unstack(0))
+
+
+if __name__ == '__main__':
+    main()
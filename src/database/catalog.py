@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+
+# Tablas de coeficientes usadas por GrossEnergy, FactorEF y FeGe: tabla -> (llave, columnas)
+CATALOG_TABLES = {
+    'categoria_animal': ('id_categoria_animal', ['coe_cat_animal', 'temp_conf', 'rcms', 'ib']),
+    'condicion_sexual': ('id_cond_sexual', ['coe_cond_sexual']),
+    'variedad_pasto': ('id_variedad', ['ed_rumiantes', 'energia_bruta_pasto', 'fdn_dieta', 'fda', 'enm_rumiantes',
+                                       'ceniza_dieta', 'pc_dieta']),
+    'suplemento': ('id_suplemento', ['edt_rumiantes', 'energia_bruta_pasto', 'fdn_dieta', 'fda', 'enm_rumiantes',
+                                     'ceniza_dieta', 'pc_dieta']),
+    'coeficiente_actividad': ('id_coe_actividad', ['coe_actividad']),
+    'coeficiente_prenez': ('id_coe_prenez', ['coe_prenez']),
+    'produccion_metano': ('id', ['bovino_alta_prod', 'bovino_otras']),
+    'gestion_residuos': ('id', ['alta_prod', 'otras']),
+}
+
+# Llaves del catálogo usadas por los perfiles: llave -> (columna de fe_fermentacion, tabla).
+# pm_id no es una columna: se deriva del animal tipo (1 alta producción, 2 otros)
+PROFILE_KEYS = {
+    'ca_id': ('id_ca', 'categoria_animal'),
+    'cs_id': ('id_cs', 'condicion_sexual'),
+    'vp_id': ('id_pasto', 'variedad_pasto'),
+    'vs_id': ('id_suple', 'suplemento'),
+    'coe_act_id': ('id_coe_acti', 'coeficiente_actividad'),
+    'cp_id': ('id_cp', 'coeficiente_prenez'),
+    'sgra_id': ('id_gestion_res1', 'gestion_residuos'),
+    'sgrb_id': ('id_gestion_res2', 'gestion_residuos'),
+    'pm_id': (None, 'produccion_metano'),
+}
+
+# Tablas de alimentos de la dieta: tabla -> columnas en el orden de FEED_NUTRIENTS
+FEED_TABLES = {
+    'variedad_pasto': ['ed_rumiantes', 'energia_bruta_pasto', 'fdn_dieta', 'fda', 'enm_rumiantes', 'ceniza_dieta',
+                       'pc_dieta'],
+    'suplemento': ['edt_rumiantes', 'energia_bruta_pasto', 'fdn_dieta', 'fda', 'enm_rumiantes', 'ceniza_dieta',
+                   'pc_dieta'],
+}
+
+# Nutrientes de los alimentos: energía digerible, energía bruta, fdn, fda, enm, ceniza y proteína cruda
+FEED_NUTRIENTS = ['ed', 'eb', 'fdn', 'fda', 'enm', 'cen', 'pc']
+
+
+def profile_keys(df, key) -> np.ndarray:
+    """
+    Ids del catálogo usados por cada perfil de fe_fermentacion
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param key: llave de PROFILE_KEYS
+    :return: arreglo de ids
+    """
+    col, _table = PROFILE_KEYS[key]
+    if col is None:
+        return np.where(df['id_at'].values == 1, 1, 2)
+    return df[col].values
+
+
+def get_catalog_tables() -> dict:
+    """
+    Lectura de todas las tablas de coeficientes en una sola conexión
+    :return: diccionario tabla -> DataFrame
+    """
+    conn = pg_connection_str()
+    tables = {}
+    for table, (key, columns) in CATALOG_TABLES.items():
+        query = "SELECT {0}, {1} FROM {2}".format(key, ', '.join(columns), table)
+        tables[table] = pd.read_sql_query(query, conn)
+    return tables
+
+
+class Catalog(object):
+    def __init__(self, tables=None):
+        """
+        Catálogo de coeficientes en memoria para los cálculos por lotes. Cada tabla se indexa por su llave,
+        de modo que una consulta para miles de perfiles es una sola operación vectorizada.
+        :param tables: diccionario tabla -> DataFrame. Si no se entrega se lee de la base de datos
+        """
+        if tables is None:
+            tables = get_catalog_tables()
+        self.tables: dict = {}
+        for table, (key, columns) in CATALOG_TABLES.items():
+            df = tables[table][[key] + columns].drop_duplicates(subset=[key])
+            df = df.astype({key: 'int64'}).set_index(key).sort_index()
+            self.tables[table] = df.astype('float64')
+        self.feeds: pd.DataFrame = self.feeds_calc()
+        self.version: str = self.version_calc()
+
+    def feeds_calc(self):
+        """
+        Matriz alimentos x nutrientes con los forrajes (variedad_pasto) y los suplementos en una sola tabla
+        :return: DataFrame indexado por (tabla, id) con las columnas FEED_NUTRIENTS
+        """
+        feeds = []
+        for table, columns in FEED_TABLES.items():
+            df = self.tables[table][columns].copy()
+            df.columns = FEED_NUTRIENTS
+            df.index = pd.MultiIndex.from_product([[table], df.index], names=['tabla', 'id'])
+            feeds.append(df)
+        return pd.concat(feeds)
+
+    def feed_positions(self, table, ids):
+        """
+        Posición de cada alimento en la matriz de alimentos, -1 si no existe
+        :param table: tabla del alimento ('variedad_pasto' o 'suplemento'), escalar o arreglo
+        :param ids: arreglo de ids
+        :return: arreglo de posiciones
+        """
+        ids = np.asarray(ids, dtype='float64')
+        tables = np.broadcast_to(np.asarray(table), ids.shape)
+        pos = np.full(ids.shape, -1, dtype='int64')
+        offset = 0
+        for name in FEED_TABLES:
+            rows = tables == name
+            pos[rows] = np.where(self.has(name, ids[rows]), self.positions(name, ids[rows]) + offset, -1)
+            offset += len(self.tables[name])
+        return pos
+
+    def version_calc(self):
+        """
+        Huella del contenido del catálogo. Cambia cuando se corrige cualquier fila de cualquier tabla
+        :return: version (hex)
+        """
+        md5 = hashlib.md5()
+        for table in sorted(self.tables):
+            df = self.tables[table]
+            md5.update(table.encode())
+            md5.update(pd.util.hash_pandas_object(df.reset_index(), index=False).values.tobytes())
+        return md5.hexdigest()
+
+    def positions(self, table, ids):
+        """
+        Posición de cada id dentro de la tabla, -1 si no existe
+        :param table: nombre de la tabla del catálogo
+        :param ids: arreglo de ids
+        :return: arreglo de posiciones
+        """
+        ids = np.asarray(ids, dtype='float64')
+        pos = np.full(ids.shape, -1, dtype='int64')
+        valid = np.isfinite(ids)
+        pos[valid] = self.tables[table].index.get_indexer(ids[valid].astype('int64'))
+        return pos
+
+    def has(self, table, ids):
+        """
+        Verifica la existencia de los ids en la tabla
+        :return: arreglo booleano
+        """
+        return self.positions(table, ids) >= 0
+
+    def rows(self, table, ids):
+        """
+        Filas completas del catálogo por id. Los ids inexistentes quedan como NaN
+        :param table: nombre de la tabla del catálogo
+        :param ids: arreglo de ids
+        :return: arreglo (ids, columnas)
+        """
+        pos = self.positions(table, ids)
+        values = self.tables[table].values
+        values = np.vstack([values, np.full((1, values.shape[1]), np.nan)])
+        return values[pos]
+
+    def lookup(self, table, column, ids):
+        """
+        Consulta vectorizada de una columna del catálogo. Los ids inexistentes quedan como NaN
+        :param table: nombre de la tabla del catálogo
+        :param column: columna a consultar
+        :param ids: arreglo de ids
+        :return: arreglo de valores
+        """
+        pos = self.positions(table, ids)
+        values = np.append(self.tables[table][column].values, np.nan)
+        return values[pos]
+
+
+def main():
+    catalog = Catalog()
+    print(f"version del catalogo: {catalog.version}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection
+
+# Tabla con el promedio de fe_otras_especies por animal tipo
+OTHER_FACTORS_TABLE = 'fe_otras_especies_promedio'
+
+# Contador de cambios de fe_otras_especies (version) y versión con la que se construyó el promedio (promedio)
+VERSION_TABLE = 'fe_otras_especies_version'
+
+# Trigger por sentencia que incrementa el contador en cada escritura de fe_otras_especies
+VERSION_TRIGGER = 'fe_otras_especies_cambio'
+
+
+def install_version_trigger(cur) -> bool:
+    """
+    Crea el contador de cambios y su trigger si el trigger no existe (primera corrida o fe_otras_especies
+    recreada). Al instalarlo se incrementa el contador, porque los cambios anteriores no quedaron contados
+    :param cur: cursor abierto
+    :return: True si se instaló el trigger
+    """
+    cur.execute(f"""SELECT 1 FROM pg_trigger
+                    WHERE tgname = '{VERSION_TRIGGER}' AND tgrelid = 'fe_otras_especies'::regclass""")
+    if cur.fetchall():
+        return False
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (version bigint NOT NULL, promedio bigint)")
+    cur.execute(f"""INSERT INTO {VERSION_TABLE} (version)
+                    SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {VERSION_TABLE})""")
+    cur.execute(f"""CREATE OR REPLACE FUNCTION {VERSION_TRIGGER}() RETURNS trigger AS $$
+                    BEGIN
+                        UPDATE {VERSION_TABLE} SET version = version + 1;
+                        RETURN NULL;
+                    END $$ LANGUAGE plpgsql""")
+    cur.execute(f"""CREATE TRIGGER {VERSION_TRIGGER}
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fe_otras_especies
+                    FOR EACH STATEMENT EXECUTE PROCEDURE {VERSION_TRIGGER}()""")
+    cur.execute(f"UPDATE {VERSION_TABLE} SET version = version + 1")
+    return True
+
+
+def source_version(cur) -> int:
+    """
+    Versión de fe_otras_especies: una lectura de una fila del contador mantenido por el trigger, en lugar de
+    recorrer la tabla
+    :param cur: cursor abierto
+    :return: versión
+    """
+    install_version_trigger(cur)
+    cur.execute(f"SELECT version FROM {VERSION_TABLE}")
+    return cur.fetchall()[0][0]
+
+
+def built_version(cur):
+    """
+    Versión de fe_otras_especies con la que se construyó la tabla de promedios
+    :param cur: cursor abierto
+    :return: versión o None si la tabla de promedios no existe o nunca se construyó
+    """
+    cur.execute(f"SELECT to_regclass('{OTHER_FACTORS_TABLE}')")
+    if cur.fetchall()[0][0] is None:
+        return None
+    cur.execute(f"SELECT promedio FROM {VERSION_TABLE}")
+    return cur.fetchall()[0][0]
+
+
+def build_averages(cur, version) -> None:
+    """
+    Reconstruye la tabla de promedios y registra la versión de fe_otras_especies usada
+    :param cur: cursor abierto
+    :param version: versión de source_version
+    """
+    cur.execute(f"DROP TABLE IF EXISTS {OTHER_FACTORS_TABLE}")
+    cur.execute(f"""CREATE TABLE {OTHER_FACTORS_TABLE} AS
+                    SELECT id_animal_tipo_ipcc, AVG(fe_ch4_fermentacin_enterica) as fe,
+                    AVG(fe_ch4_gestion_estiercol) as gen
+                    FROM fe_otras_especies
+                    GROUP BY id_animal_tipo_ipcc""")
+    cur.execute(f"UPDATE {VERSION_TABLE} SET promedio = %s", (version,))
+
+
+def refresh_other_factors(force=False) -> bool:
+    """
+    Mantiene fe_otras_especies_promedio (id_animal_tipo_ipcc, fe, gen). La tabla solo se reconstruye cuando
+    cambia la versión de fe_otras_especies, de modo que las emisiones proyectadas leen una tabla pequeña
+    precalculada en lugar de evaluar el promedio en cada corrida. Una fuente vacía también queda en caché
+    :param force: reconstruye la tabla aunque fe_otras_especies no haya cambiado
+    :return: True si la tabla se reconstruyó
+    """
+    conn_ = pg_connection()
+    with conn_ as connection:
+        cur = connection.cursor()
+        version = source_version(cur)
+        rebuild = force or built_version(cur) != version
+        if rebuild:
+            build_averages(cur, version)
+    conn_.close()
+    return rebuild
+
+
+def main():
+    print(f"reconstruida={refresh_other_factors()}")
+
+
+if __name__ == '__main__':
+    main()
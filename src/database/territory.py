@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+
+# Tablas con municipio y sus niveles superiores: tabla -> columnas de los niveles superiores
+TERRITORY_TABLES = {
+    'datos_act_bovinos_ipcc_temporal': ['cod_depto', 'id_reg_ganadera'],
+    'b1aiii_datos_actividad': ['cod_depto', 'id_subregion', 'id_zona_upra'],
+}
+
+# Nivel base del índice
+MUNICIPALITY = 'cod_muni'
+
+# Nivel con un solo territorio
+NATIONAL = 'nacional'
+
+
+def get_territory_tables() -> dict:
+    """
+    Combinaciones de municipio y niveles superiores de cada tabla de TERRITORY_TABLES con su número de filas de
+    actividad (n)
+    :return: diccionario tabla -> DataFrame
+    """
+    conn = pg_connection_str()
+    tables = {}
+    for table, columns in TERRITORY_TABLES.items():
+        keys = ', '.join([MUNICIPALITY] + columns)
+        query = "SELECT {0}, COUNT(*) AS n FROM {1} GROUP BY {0}".format(keys, table)
+        tables[table] = pd.read_sql_query(query, conn)
+    return tables
+
+
+def segment_sum(index, values, size) -> np.ndarray:
+    """
+    Suma de valores por segmento. Las posiciones negativas (territorios desconocidos) se descartan
+    :param index: posición del segmento de cada fila
+    :param values: arreglo (filas) o (filas, columnas)
+    :param size: número de segmentos
+    :return: arreglo (size) o (size, columnas)
+    """
+    index = np.asarray(index)
+    values = np.asarray(values, dtype='float64')
+    keep = index >= 0
+    if values.ndim == 1:
+        return np.bincount(index[keep], weights=values[keep], minlength=size)
+    # Una sola pasada para todas las columnas: segmento x columna aplanado
+    cols = values.shape[1]
+    flat = (index[keep, None] * cols + np.arange(cols)).ravel()
+    return np.bincount(flat, weights=values[keep].ravel(), minlength=size * cols).reshape(size, cols)
+
+
+class TerritoryIndex(object):
+    def __init__(self, tables=None):
+        """
+        Índice territorial en memoria: arreglos de enteros que ubican cada municipio en cada nivel superior
+        (departamento, región ganadera, subregión, zona UPRA), de modo que agregar de municipio a cualquier
+        nivel es un solo np.bincount
+        :param tables: diccionario tabla -> DataFrame con cod_muni, niveles y opcionalmente n (filas de actividad
+                       de la combinación, 1 si no se entrega). Si no se entrega se lee de la base de datos
+        """
+        if tables is None:
+            tables = get_territory_tables()
+        df = pd.concat([tables[table] for table in TERRITORY_TABLES], ignore_index=True, sort=False)
+        df = df[df[MUNICIPALITY].notnull()]
+        df = df.assign(n=df['n'].fillna(1) if 'n' in df.columns else 1)
+        self.municipalities: np.ndarray = np.unique(df[MUNICIPALITY].values.astype('int64'))
+        self.levels: dict = {}
+        self.ambiguous: dict = {}
+        for level in dict.fromkeys(col for columns in TERRITORY_TABLES.values() for col in columns):
+            self.levels[level], self.ambiguous[level] = self.level_calc(df, level)
+
+    def level_calc(self, df, level):
+        """
+        Códigos de un nivel y posición del padre de cada municipio. Si un municipio aparece con varios padres
+        se usa el de más filas de actividad (suma de n sobre las tablas); los empates van al código menor. Los
+        municipios con varios padres se cuentan para reportarlos
+        :param df: combinaciones municipio, niveles, n
+        :param level: columna del nivel
+        :return: (códigos ordenados, posición del padre por municipio o -1), municipios con varios padres
+        """
+        pairs = df[[MUNICIPALITY, level, 'n']].dropna(subset=[MUNICIPALITY, level])
+        pairs = pairs.astype({MUNICIPALITY: 'int64', level: 'int64'})
+        codes = np.unique(pairs[level].values)
+        counts = pairs.groupby([MUNICIPALITY, level])['n'].sum().reset_index()
+        counts = counts.sort_values(by=[MUNICIPALITY, 'n', level], ascending=[True, False, True])
+        ambiguous = counts[MUNICIPALITY].duplicated().sum()
+        counts = counts.drop_duplicates(subset=[MUNICIPALITY])
+        parent = np.full(len(self.municipalities), -1, dtype='int64')
+        parent[np.searchsorted(self.municipalities, counts[MUNICIPALITY].values)] = \
+            np.searchsorted(codes, counts[level].values)
+        return (codes, parent), int(ambiguous)
+
+    def positions(self, cod_muni) -> np.ndarray:
+        """
+        Posición de cada municipio en el índice, -1 si no existe
+        :param cod_muni: arreglo de códigos de municipio
+        :return: arreglo de posiciones
+        """
+        cod_muni = np.asarray(cod_muni, dtype='float64')
+        pos = np.full(cod_muni.shape, -1, dtype='int64')
+        valid = np.isfinite(cod_muni)
+        ids = cod_muni[valid].astype('int64')
+        found = np.searchsorted(self.municipalities, ids)
+        found = np.where(found < len(self.municipalities), found, 0)
+        pos[valid] = np.where(self.municipalities[found] == ids, found, -1)
+        return pos
+
+    def codes(self, level) -> np.ndarray:
+        """
+        Códigos de un nivel en el orden de las agregaciones
+        :param level: cod_muni, nacional o una columna de TERRITORY_TABLES
+        :return: arreglo de códigos
+        """
+        if level == MUNICIPALITY:
+            return self.municipalities
+        if level == NATIONAL:
+            return np.zeros(1, dtype='int64')
+        return self.levels[level][0]
+
+    def parent(self, cod_muni, level) -> np.ndarray:
+        """
+        Posición en el nivel de cada municipio, -1 si el municipio o su padre no existen
+        :param cod_muni: arreglo de códigos de municipio
+        :param level: cod_muni, nacional o una columna de TERRITORY_TABLES
+        :return: arreglo de posiciones en codes(level)
+        """
+        pos = self.positions(cod_muni)
+        if level == MUNICIPALITY:
+            return pos
+        if level == NATIONAL:
+            return np.where(pos >= 0, 0, -1)
+        parent = np.append(self.levels[level][1], -1)
+        return parent[pos]
+
+    def parent_codes(self, cod_muni, level, missing=-1) -> np.ndarray:
+        """
+        Código en el nivel de cada municipio
+        :param cod_muni: arreglo de códigos de municipio
+        :param level: cod_muni, nacional o una columna de TERRITORY_TABLES
+        :param missing: código de los municipios sin padre o desconocidos
+        :return: arreglo de códigos
+        """
+        pos = self.parent(cod_muni, level)
+        return np.where(pos >= 0, self.codes(level)[np.maximum(pos, 0)], missing)
+
+    def rollup(self, cod_muni, values, level, by=None, unassigned=None) -> pd.DataFrame:
+        """
+        Agregación de valores por municipio a un nivel en una sola pasada
+        :param cod_muni: código de municipio por fila
+        :param values: DataFrame o diccionario columna -> arreglo con los valores por fila
+        :param level: cod_muni, nacional o una columna de TERRITORY_TABLES
+        :param by: arreglo, Series o DataFrame opcional con otras llaves por fila (por ejemplo año y animal tipo).
+                   Las filas con llaves nulas se descartan y solo se devuelven las combinaciones con filas
+        :param unassigned: código para las filas con municipio desconocido o sin padre en el nivel. Si es None
+                           esas filas se descartan
+        :return: DataFrame level, (llaves de by), columnas de values
+        """
+        values = pd.DataFrame(values)
+        index = self.parent(cod_muni, level)
+        codes = self.codes(level)
+        if unassigned is not None:
+            index = np.where(index >= 0, index, len(codes))
+            codes = np.append(codes, unassigned)
+        if by is None:
+            sums = segment_sum(index, values.values, len(codes))
+            df = pd.DataFrame({level: codes})
+        else:
+            by = pd.DataFrame(by) if isinstance(by, pd.DataFrame) else \
+                pd.DataFrame({getattr(by, 'name', None) or 'by': np.asarray(by)})
+            grouped = by.groupby(list(by.columns), sort=True)
+            by_pos = grouped.ngroup().fillna(-1).values.astype('int64')
+            df_by = grouped.size().reset_index()[list(by.columns)]
+            index = np.where((index >= 0) & (by_pos >= 0), index * len(df_by) + by_pos, -1)
+            size = len(codes) * len(df_by)
+            sums = segment_sum(index, values.values, size)
+            rows = segment_sum(index, np.ones(len(index)), size) > 0
+            df = df_by.iloc[np.tile(np.arange(len(df_by)), len(codes))].reset_index(drop=True)
+            df.insert(0, level, np.repeat(codes, len(df_by)))
+            df, sums = df[rows].reset_index(drop=True), sums[rows]
+        for i, col in enumerate(values.columns):
+            df[col] = sums[:, i]
+        return df
+
+
+def main():
+    index = TerritoryIndex()
+    print(f"municipios={len(index.municipalities)}")
+    for level, (codes, parent) in index.levels.items():
+        print(f"{level}={len(codes)} sin_padre={(parent < 0).sum()} ambiguos={index.ambiguous[level]}")
+
+
+if __name__ == '__main__':
+    main()
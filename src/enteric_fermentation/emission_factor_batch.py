@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.enteric_fermentation.gross_energy_batch import GrossEnergyBatch
+
+
+class FactorEFBatch(GrossEnergyBatch):
+    def __init__(self, **kwargs):
+        """
+        Versión vectorizada de FactorEF
+        :param kwargs: parámetros de GrossEnergyBatch
+        """
+        super().__init__(**kwargs)
+        tp = self.at_id == 5
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.gepd = self.gepd_calc()
+            self.fda = self.fda_calc()
+            self.fdn = self.fdn_calc()
+            self.fcm = self.fcm_calc()
+            self.eqsbw = np.where(tp, self.eqsbw_calc_tp(), self.eqsbw_calc())
+            self.cms_tp = self.cms_calc_tp()
+            self.cms = self.cms_calc()
+            self.ym = np.where(tp, self.ym_calc_tp(), self.ym_calc())
+        self.ajl = np.where(self.milk / 365 >= 11.5, 1.7, 0.0).astype(self.dtype)
+
+    def fda_calc(self):
+        """
+        Fibra en detergente acido ponderada (%).
+        :return: fda
+        """
+        if self.diet is not None:
+            return self.diet_values['fda']
+        return self.fdaf * self.pf / 100 + self.fdas * self.ps / 100
+
+    def fdn_calc(self):
+        """
+        Fibra en detergente neutro ponderada (%).
+        :return: fdn
+        """
+        if self.diet is not None:
+            return self.diet_values['fdn']
+        return self.fdnf * self.pf / 100 + self.fdns * self.ps / 100
+
+    def ym_calc(self):
+        """
+        Cálculo del Ym para todas las categoría diferentes a 3A1av Ganado Bovino Terneros pre-destetos
+        :return: ym
+        """
+        return ((3.41 + 0.52 * self.cms - 0.996 * (self.cms * self.fda / 100) +
+                 1.15 * (self.cms * self.fdn / 100)) * 100) / self.tge
+
+    def ym_calc_tp(self):
+        """
+        Cálculo del Ym para la categoría  3A1av Ganado Bovino Terneros pre-destetos
+        :return: ym
+        """
+        return ((3.41 + 0.52 * self.cms_tp - 0.996 * (self.cms_tp * self.fda / 100) +
+                 1.15 * (self.cms_tp * self.fdn / 100)) * 100) / (self.gepd * self.cms_tp)
+
+    def eqsbw_calc(self):
+        """
+        Peso equivalente vacío
+        :return:
+        """
+        return (self.weight * 0.96) * 400 / (self.adult_w * 0.96)
+
+    def eqsbw_calc_tp(self):
+        """
+        Peso equivalente vacío
+        :return: kg
+        """
+        return (self.weight + (self.gan * 365) * 0.96) * (435 / (self.adult_w * 0.96))
+
+    def bfaf_calc(self):
+        """
+        Factor de ajuste por grasa corporal
+        :return:
+        """
+        fagc = 0.7714 + (0.00196 * (self.weight * 0.96 * self.eqsbw) / (self.adult_w * 0.96)) - \
+            (0.000000371 * (self.weight * 0.96 * self.eqsbw) / ((self.adult_w * 0.96) ** 2))
+        return np.where(self.weight > 350, fagc, 1.0)
+
+    def bfaf_calc_tp(self):
+        """
+        Factor de ajuste por grasa corporal
+        :return:
+        """
+        fagc = 0.7714 + (((0.00196 * (self.weight + (self.gan * 365) * 0.96)) * self.eqsbw) /
+                         (self.adult_w * 0.96)) - (0.000000371 * (((self.weight + (self.gan * 365)) * 0.96) *
+                                                                  self.eqsbw) / ((self.adult_w * 0.96) ** 2))
+        return np.where(self.weight > 350, fagc, 1.0)
+
+    def gepd_calc(self):
+        """
+        energía bruta ponderada de la dieta (MJ kg -1 ).
+        :return:ebpd
+        """
+        if self.diet is not None:
+            return self.diet_values['eb']
+        return self.ebf * self.pf / 100 + self.ebs * self.ps / 100
+
+    def fcm_calc(self):
+        """
+        Leche corregida por grasa al 3.5% (kg/día)
+        :return: f_cm
+        """
+        return 0.4324 * (self.milk / 365) + 16.216 * (self.milk / 365) * (self.grease / 100)
+
+    def temp_adj(self):
+        """
+        Ajuste del consumo por temperatura ambiente
+        :return:
+        """
+        return 1 - (self.rcms / 100) * (self.ta - self.tc)
+
+    def ef_calc(self):
+        """
+        Factor de emisión por fermentación entérica para todas las categorías 3A1ai - 3A1avii
+        (ver FactorEF.gbvap_ef ... gbge_ef). Los terneros pre-destetos usan 273.75 días
+        :return: factor de emision (Kg CH4 animal-1 año-1)
+        """
+        days = np.where(self.at_id == 5, 273.75, 365.0).astype(self.dtype)
+        return (self.tge * (self.ym / 100) * days) / 55.65
+
+    def cms_calc(self):
+        """
+        Consumo de materia seca (calculado a través del consumo de energía)
+        :return: cms (kg dia-1)
+        """
+        return self.tge / self.gepd
+
+    def cms_calc_tp(self):
+        """
+        Consumo de materia seca (calculado a través del consumo de energía)
+        :return: cms (kg dia-1)
+        """
+        enm = self.enmf / 4.184
+        return (((self.weight + (self.gan * 365)) * 0.96) ** 0.75) * \
+            (((0.2435 * enm) - (0.0466 * (enm ** 2)) - 0.0869) / enm) * self.bfaf_calc_tp() * self.bi * \
+            self.temp_adj()
+
+    def cms_pv_calc(self):
+        """
+        Consumo de materia seca como porcentaje de peso vivo
+        :return: cmspv
+        """
+        return self.cms / self.weight
+
+    def cmcf_calc(self):
+        """
+        Consumo de forraje (kg dia-1)
+        :return: cf
+        """
+        return self.cms * self.pf / 100
+
+    def cmcs_calc(self):
+        """
+        Consumo de concentrado/suplemento
+        :return: cf (kg día -1)
+        """
+        return self.cms * self.ps / 100
+
+    def cpmsgbvap(self):
+        """
+        Consumo potencial de materia seca para 3A1ai Ganado Bovino Vacas de Alta Producción
+        :return: cpms (kg día -1 )
+        """
+        return (0.0185 * self.weight + 0.305 * self.fcm) * self.temp_adj()
+
+    def cpmsgbvbp(self):
+        """
+        Consumo potencial de materia seca para 3A1aii Ganado Bovino Vacas de Baja Producción
+        :return: cpms (kg día -1 )
+        """
+        enm = self.enmf / 4.184
+        return ((self.weight ** 0.75) * (0.14652 * enm) - (0.0517 * enm ** 2) - 0.0074 + (0.305 * self.fcm) +
+                self.ajl) * self.temp_adj()
+
+    def cpmsgbpc(self):
+        """
+        Consumo potencial de materia seca para 3A1aiii Ganado Bovino Vacas para Producción de Carne
+        :return: cpms (kg día -1 )
+        """
+        enm = self.enmf / 4.184
+        return (((self.weight * 0.96) ** 0.75) * (0.04997 * (enm ** 2) + 0.04631) / enm) * self.temp_adj() + \
+            (0.2 * (self.milk / 365))
+
+    def cpmsgbtfr(self):
+        """
+        Consumo potencial de materia seca para 3A1aiv Ganado Bovino Toros utilizados con fines reproductivos
+        :return: cpms (kg día -1 )
+        """
+        return (3.83 + 0.0143 * (self.weight * 0.96)) * self.temp_adj()
+
+    def cpmsgbtp(self):
+        """
+        Consumo potencial de materia seca para 3A1av Ganado Bovino Terneros pre-destetos
+        :return: cpms (kg día -1 )
+        """
+        enm = self.enmf / 4.184
+        return ((self.weight * 0.96) ** 0.75) * (((0.2435 * enm) - (0.0466 * (enm ** 2)) - 0.1128) / enm) * \
+            self.bfaf_calc() * self.bi * self.temp_adj()
+
+    def cpmsgbtr(self):
+        """
+        Consumo potencial de materia seca para 3A1avi Ganado Bovino Terneras de remplazo y
+        3A1avii Ganado Bovino Ganado de engorde
+        :return: cpms (kg día -1 )
+        """
+        enm = self.enmf / 4.184
+        return ((self.weight * 0.96) ** 0.75) * (((0.2435 * enm) - (0.0466 * (enm ** 2)) - 0.0869) / enm) * \
+            self.bfaf_calc() * self.bi * self.temp_adj()
+
+    def cpms_selection(self):
+        """
+        Selección del consumo potencial de materia seca dependiendo del animal tipo
+        :return: cpms (kg día -1 )
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.select([self.at_id == 1, self.at_id == 2, self.at_id == 3, self.at_id == 4, self.at_id == 5,
+                              np.isin(self.at_id, [6, 7])],
+                             [self.cpmsgbvap(), self.cpmsgbvbp(), self.cpmsgbpc(), self.cpmsgbtfr(), self.cpmsgbtp(),
+                              self.cpmsgbtr()], np.nan)
+
+
+def main():
+    ef = FactorEFBatch(at_id=5, ca_id=2, weight=110, adult_w=577, milk=545, grease=3.5, cp_id=1, cs_id=2,
+                       coe_act_id=3, pf=100, ps=0, vp_id=15, vs_id=1, ta=16, ht=0.0)
+    print(f"factor de emision: {np.round(ef.ef_calc(), 2)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.catalog import Catalog, FEED_TABLES
+
+# Valores del catálogo usados por GrossEnergy: atributo -> (tabla, columna, parámetro con el id)
+GE_CATALOG_VALUES = {
+    'a1': ('categoria_animal', 'coe_cat_animal', 'ca_id'),
+    'tc': ('categoria_animal', 'temp_conf', 'ca_id'),
+    'bi': ('categoria_animal', 'ib', 'ca_id'),
+    'fcs': ('condicion_sexual', 'coe_cond_sexual', 'id_cs'),
+    'edr_f': ('variedad_pasto', 'ed_rumiantes', 'vp_id'),
+    'ebf': ('variedad_pasto', 'energia_bruta_pasto', 'vp_id'),
+    'fdnf': ('variedad_pasto', 'fdn_dieta', 'vp_id'),
+    'fdaf': ('variedad_pasto', 'fda', 'vp_id'),
+    'enmf': ('variedad_pasto', 'enm_rumiantes', 'vp_id'),
+    'cen_f': ('variedad_pasto', 'ceniza_dieta', 'vp_id'),
+    'pc_f': ('variedad_pasto', 'pc_dieta', 'vp_id'),
+    'edr_s': ('suplemento', 'edt_rumiantes', 'vs_id'),
+    'ebs': ('suplemento', 'energia_bruta_pasto', 'vs_id'),
+    'fdns': ('suplemento', 'fdn_dieta', 'vs_id'),
+    'fdas': ('suplemento', 'fda', 'vs_id'),
+    'enms': ('suplemento', 'enm_rumiantes', 'vs_id'),
+    'cen_s': ('suplemento', 'ceniza_dieta', 'vs_id'),
+    'pc_s': ('suplemento', 'pc_dieta', 'vs_id'),
+    'ca': ('coeficiente_actividad', 'coe_actividad', 'ac_id'),
+    'cp': ('coeficiente_prenez', 'coe_prenez', 'cp_id'),
+}
+
+
+def diet_matrix(catalog, profile, table, feed_id, share, size=None) -> np.ndarray:
+    """
+    Matriz perfiles x alimentos con el porcentaje de cada alimento en la dieta, a partir de una lista larga
+    (perfil, tabla, id del alimento, porcentaje). Los perfiles con un alimento inexistente quedan como NaN
+    :param catalog: Catalog
+    :param profile: posición del perfil en el lote
+    :param table: tabla del alimento ('variedad_pasto' o 'suplemento')
+    :param feed_id: id del alimento en su tabla
+    :param share: porcentaje del alimento en la dieta (%)
+    :param size: número de perfiles. Por defecto el mayor perfil + 1
+    :return: arreglo (perfiles, alimentos)
+    """
+    profile = np.asarray(profile, dtype='int64')
+    share = np.asarray(share, dtype='float64')
+    pos = catalog.feed_positions(table, feed_id)
+    size = profile.max() + 1 if size is None else size
+    n_feeds = len(catalog.feeds)
+    valid = pos >= 0
+    diet = np.bincount(profile[valid] * n_feeds + pos[valid], weights=share[valid], minlength=size * n_feeds)
+    diet = diet.reshape(size, n_feeds)
+    diet[profile[~valid]] = np.nan
+    return diet
+
+
+class GrossEnergyBatch(object):
+    def __init__(self, catalog=None, at_id=1, ca_id=1, coe_act_id=2, ta=13.0, pf=100.0, ps=0, vp_id=1, vs_id=40,
+                 weight=500.0, adult_w=550.0, cp_id=2, gan=0.0, milk=0.0, grease=0.0, ht=0.0, cs_id=1, dtype='float64',
+                 **kwargs):
+        """
+        Versión vectorizada de GrossEnergy. Recibe los mismos parámetros que GrossEnergy pero como arreglos
+        (un elemento por perfil) y calcula todos los perfiles a la vez con un catálogo en memoria.
+        Los valores del catálogo (a1, tc, edr_f, ebf, ...) pueden entregarse en kwargs para reemplazar la consulta,
+        al igual que la digestibilidad de la dieta (dep, NaN para calcularla en ese perfil).
+        La dieta puede entregarse en kwargs como matriz perfiles x alimentos de porcentajes (diet, ver diet_matrix)
+        en lugar de un forraje (vp_id, pf) y un suplemento (vs_id, ps): los nutrientes ponderados se calculan
+        entonces como el producto de la matriz de la dieta por la matriz alimentos x nutrientes del catálogo.
+        Los perfiles con datos inválidos quedan como NaN o inf en lugar de lanzar excepciones.
+        :param catalog: Catalog con las tablas de coeficientes. Si no se entrega se lee de la base de datos
+        :param dtype: precisión de las entradas y de los cálculos intermedios ('float64' o 'float32')
+        :param kwargs: valores del catálogo precalculados por perfil
+        """
+        self.catalog: Catalog = catalog if catalog is not None else Catalog()
+        self.dtype = np.dtype(dtype)
+        self.diet = None if kwargs.get('diet') is None else np.atleast_2d(np.asarray(kwargs['diet'],
+                                                                                     dtype=self.dtype))
+        self.at_id, self.ca_id, self.ac_id, self.ta, self.pf, self.ps, self.vp_id, self.vs_id, self.weight, \
+            self.adult_w, self.cp_id, self.gan, self.milk, self.grease, self.ht, self.id_cs = \
+            self._arrays(at_id, ca_id, coe_act_id, ta, pf, ps, vp_id, vs_id, weight, adult_w, cp_id, gan, milk,
+                         grease, ht, cs_id, 0 if self.diet is None else np.zeros(len(self.diet)))[:-1]
+        self.size: int = self.at_id.size
+        self.kwargs: dict = kwargs
+        for name, (table, column, id_name) in GE_CATALOG_VALUES.items():
+            setattr(self, name, self.catalog_value(name, table, column, getattr(self, id_name)))
+        self.diet_values: dict = {}
+        if self.diet is not None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.diet_values = self.diet_calc()
+                self.pf = self.diet_values['forraje']
+                self.ps = self.diet_values['suplemento']
+                if 'enmf' not in kwargs:
+                    # enm del forraje: promedio de los forrajes de la dieta (de toda la dieta si no hay forraje)
+                    self.enmf = np.where(self.pf > 0, self.diet_values['enm_f'] * 100 / self.pf,
+                                         self.diet_values['enm'])
+        self.rcms = np.select([(self.ca_id == 1) & (self.ta > self.tc),
+                               (self.ca_id == 2) & (self.ta > self.tc)], [2.0, 1.5], 1.0).astype(self.dtype)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.dep = self.d_ep()
+            if 'dep' in kwargs:
+                dep = self._arrays(kwargs['dep'], self.at_id)[0]
+                self.dep = np.where(np.isnan(dep), self.dep, dep)
+            self.reg = self.reg_rel()
+            self.rem = self.rem_rel()
+            self.tge = self.energy_selection()
+
+    def _arrays(self, *values):
+        """
+        Convierte los parámetros a arreglos 1-D de igual tamaño con la precisión del cálculo
+        :return: lista de arreglos
+        """
+        arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype=self.dtype)) for v in values])
+        return [np.ascontiguousarray(a.ravel()) for a in arrays]
+
+    def catalog_value(self, name, table, column, ids):
+        """
+        Valor del catálogo por perfil, o el valor entregado en kwargs
+        :return: arreglo de valores
+        """
+        if name in self.kwargs:
+            return self._arrays(self.kwargs[name], ids)[0]
+        return self.catalog.lookup(table, column, ids).astype(self.dtype)
+
+    def diet_calc(self):
+        """
+        Nutrientes ponderados de la dieta como un solo producto (perfiles x alimentos) @ (alimentos x nutrientes).
+        Además de los nutrientes del catálogo incluye la digestibilidad de cada alimento (dig = ed * 100 / eb),
+        la enm solo de los forrajes y los porcentajes de forraje y de suplemento.
+        Los nutrientes no finitos del catálogo (nulos, eb = 0) solo dejan como NaN a los perfiles que usan ese
+        alimento, como en el cálculo por perfil
+        :return: diccionario nutriente -> arreglo
+        """
+        feeds = self.catalog.feeds
+        forage = (feeds.index.get_level_values('tabla') == list(FEED_TABLES)[0]).astype('float64')
+        nutrients = feeds.assign(dig=feeds['ed'] * 100 / feeds['eb'], enm_f=feeds['enm'] * forage,
+                                 forraje=100 * forage, suplemento=100 * (1 - forage))
+        values = nutrients.values.astype(self.dtype)
+        invalid = ~np.isfinite(values)
+        values = self.diet @ np.where(invalid, 0, values) / 100
+        used = (np.nan_to_num(self.diet) > 0).astype(self.dtype)
+        values[(used @ invalid.astype(self.dtype)) > 0] = np.nan
+        return dict(zip(nutrients.columns, values.T))
+
+    def d_ep(self):
+        """
+        Digestibilidad de la dieta - dep
+        :return:
+        """
+        if self.diet is not None:
+            return self.diet_values['dig']
+        return (self.edr_f * 100 / self.ebf) * self.pf / 100 + (self.edr_s * 100 / self.ebs) * self.ps / 100
+
+    def rem_rel(self):
+        """
+        Relación entre la energía neta disponible en una dieta para mantenimiento
+        y la energía digerible consumida (rem)
+        :return: rem
+        """
+        return (1.123 - (4.092 * 0.001 * self.dep) + (1.126 * 0.00001 * (self.dep ** 2))) - (25.4 / self.dep)
+
+    def reg_rel(self):
+        """
+        Relación entre la energía neta disponible en la dieta para crecimiento y
+        la energía digerible consumida
+        :return: reg
+        """
+        return 1.164 - (5.16 * 0.001 * self.dep) + (1.308 * 0.00001 * (self.dep ** 2)) - (37.4 / self.dep)
+
+    def base_energy(self):
+        """
+        Término común de mantenimiento: peso metabólico por coeficiente ajustado por temperatura
+        :return: (Mj día -1)
+        """
+        return (self.weight ** 0.75) * (self.a1 + (0.0029288 * (self.tc - self.ta)))
+
+    def maintenance(self):
+        """
+        Cálculo del requerimiento de energía bruta para mantenimiento GEm o em
+        :return: em (Mj día -1)
+        """
+        return self.base_energy() / self.rem / (self.dep / 100)
+
+    def activity(self):
+        """
+        Cálculo del requerimiento de energía bruta de actividad GEa o ea
+        :return: ea (Mj día -1)
+        """
+        return self.base_energy() * self.ca / self.rem / (self.dep / 100)
+
+    def breastfeeding(self):
+        """
+        Cálculo del requerimiento de energía bruta para lactancia o producción de leche GEl o el
+        :return: el (Mj día -1)
+        """
+        return (self.milk / 365) * (1.47 + 0.4 * self.grease) / self.rem / (self.dep / 100)
+
+    def work(self):
+        """
+        Requerimiento de energía bruta para el trabajo
+        :return: ew
+        """
+        return self.base_energy() * 0.1 * self.ht / self.rem / (self.dep / 100)
+
+    def pregnancy(self):
+        """
+        Requerimiento de energía bruta para gestación o preñez
+        :return: ep (Mj día -1)
+        """
+        return self.base_energy() * self.cp / self.rem / (self.dep / 100)
+
+    def grow(self):
+        """
+        Requerimiento de energía bruta para ganancia de peso o crecimiento
+        :return:GEg o eg (Mj día -1)
+        """
+        return ((22.02 * (self.weight / (self.fcs * self.adult_w)) ** 0.75) * self.gan ** 1.097) / self.reg / \
+            (self.dep / 100)
+
+    def milk_energy(self):
+        """
+        Aporte de energía bruta de la leche consumida por el ternero.
+        :return: me (Mj día -1)
+        """
+        return (self.milk / 365) * ((44.01 * self.grease + 163.56) * 4.184 / 0.4536) * 0.001
+
+    def energy_selection(self):
+        """
+        Seleción del la enegía bruta total dependiendo del animal tipo (ver GrossEnergy.ne_vap ... ne_ge).
+        Los animales tipo fuera del rango 1-7 quedan como NaN
+        :return: energy
+        """
+        base = self.maintenance() + self.activity() + self.work()
+        cows = base + self.breastfeeding() + self.pregnancy()
+        grow = self.grow()
+        return np.select([np.isin(self.at_id, [1, 2, 3]), self.at_id == 4, self.at_id == 5,
+                          np.isin(self.at_id, [6, 7])],
+                         [cows, base, base + grow - self.milk_energy(), base + grow], np.nan)
+
+
+def main():
+    ge = GrossEnergyBatch(at_id=[1, 4, 6], ca_id=[1, 2, 2], weight=[540.0, 600.0, 250.0], adult_w=600.0,
+                          milk=[3660, 0, 0], grease=3.5, cp_id=2, cs_id=1, coe_act_id=2, pf=80, ps=20, vp_id=15,
+                          vs_id=40, ta=14.0, gan=[0.0, 0.0, 0.4])
+    print(ge.tge)
+
+
+if __name__ == '__main__':
+    main()
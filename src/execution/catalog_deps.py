@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import argparse
+import numpy as np
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.catalog import PROFILE_KEYS, profile_keys
+from src.execution import emissions_all
+from src.execution.fe_ge_all import get_data, masive_calc
+
+
+def build_index(df) -> dict:
+    """
+    Índice inverso del catálogo a las filas de fe_fermentacion que lo usan
+    :param df: perfiles con la estructura de fe_fermentacion
+    :return: diccionario llave -> {id del catálogo -> arreglo de ids de fe_fermentacion}
+    """
+    ids = df['id'].values
+    index = {}
+    for key in PROFILE_KEYS:
+        keys = profile_keys(df, key)
+        valid = ~np.isnan(keys.astype('float64'))
+        order = np.argsort(keys[valid], kind='stable')
+        values, starts = np.unique(keys[valid][order], return_index=True)
+        index[key] = {int(v): rows for v, rows in zip(values, np.split(ids[valid][order], starts[1:]))}
+    return index
+
+
+def dependent_rows(index, changes) -> np.ndarray:
+    """
+    Filas de fe_fermentacion que dependen de las llaves modificadas
+    :param index: índice de build_index
+    :param changes: diccionario llave -> lista de ids del catálogo modificados. Ej. {'vp_id': [15]}
+    :return: ids de fe_fermentacion
+    """
+    rows = [index[key][int(i)] for key, ids in changes.items() for i in ids if int(i) in index[key]]
+    if not rows:
+        return np.array([], dtype='int64')
+    return np.unique(np.concatenate(rows))
+
+
+def recalculation(changes, municipal=False) -> None:
+    """
+    Recalcula solo las filas de fe_fermentacion que dependen de las llaves modificadas del catálogo y luego
+    las emisiones de datos_act_bovinos_ipcc_temporal y datos_act_bovinos_ipcc_proyectados que usan esos factores,
+    incluidas las de las filas que quedaron rechazadas
+    :param changes: diccionario llave -> lista de ids del catálogo modificados
+    :param municipal: las emisiones históricas usan los factores por municipio (ver emissions_all.calculation)
+    """
+    df = get_data()
+    ids = dependent_rows(build_index(df), changes)
+    print(f"filas dependientes={len(ids)}")
+    if len(ids) == 0:
+        return
+    masive_calc(incremental=False, ids=ids)
+    # llaves de todas las filas dependientes: las que pasaron a rechazos quedan sin factor y sus emisiones
+    # también deben actualizarse
+    df = df[df['id'].isin(ids)]
+    keys = list(df[['id_reg', 'id_at']].drop_duplicates().itertuples(index=False, name=None))
+    if not keys:
+        return
+    emissions_all.calculation(keys=keys, municipal=municipal)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Recalculo de los factores de emision y emisiones que dependen '
+                                                 'de filas corregidas del catalogo')
+    parser.add_argument('--vp_id', nargs='+', type=int, default=[], help='Variedades de pasto modificadas')
+    parser.add_argument('--vs_id', nargs='+', type=int, default=[], help='Suplementos modificados')
+    parser.add_argument('--ca_id', nargs='+', type=int, default=[], help='Categorias animal modificadas')
+    parser.add_argument('--cp_id', nargs='+', type=int, default=[], help='Coeficientes de preñez modificados')
+    parser.add_argument('--cs_id', nargs='+', type=int, default=[], help='Condiciones sexuales modificadas')
+    parser.add_argument('--coe_act_id', nargs='+', type=int, default=[], help='Coeficientes de actividad modificados')
+    parser.add_argument('--sgra_id', nargs='+', type=int, default=[], help='Gestion de residuos A modificados')
+    parser.add_argument('--sgrb_id', nargs='+', type=int, default=[], help='Gestion de residuos B modificados')
+    parser.add_argument('--gr_id', nargs='+', type=int, default=[],
+                        help='Filas de gestion_residuos modificadas (sistemas A y B)')
+    parser.add_argument('--pm_id', nargs='+', type=int, default=[], help='Filas de produccion_metano modificadas')
+    parser.add_argument('--municipio', action='store_true',
+                        help='Las emisiones historicas usan los factores de emision por municipio')
+    return parser.parse_args()
+
+
+def main():
+    arg = vars(create_parser())
+    municipal = arg.pop('municipio')
+    gr_id = arg.pop('gr_id')
+    arg['sgra_id'] = arg['sgra_id'] + gr_id
+    arg['sgrb_id'] = arg['sgrb_id'] + gr_id
+    recalculation({key: ids for key, ids in arg.items() if ids}, municipal)
+
+
+if __name__ == '__main__':
+    main()
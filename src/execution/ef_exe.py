@@ -3,10 +3,21 @@
 import sys
 import os
 import argparse
+import importlib.util
+import pandas as pd
 
 sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
 
 from src.manure_management.manure_mgmt import FeGe
+from src.manure_management.manure_batch import FeGeBatch, FE_FERMENTACION_COLUMNS
+from src.database.catalog import Catalog
+
+# Nombres de las opciones de la línea de comandos -> parámetros de FeGe
+BATCH_ALIASES = {
+    'wg': 'weight',
+    'adult_wg': 'adult_w',
+    'gn_wg': 'gan',
+}
 
 
 def ef_execution(prnt=True, **kwargs):
@@ -187,6 +198,111 @@ def ef_execution(prnt=True, **kwargs):
         return fe, ceb, cms, cf, cc, cpms, ccms, dpcms, ym, fge
 
 
+def batch_format(path, default='jsonl') -> str:
+    """
+    Formato de un archivo de perfiles según su extensión. '-' (entrada o salida estándar) y los archivos sin
+    extensión conocida usan el formato por defecto
+    :param path: ruta del archivo
+    :param default: formato por defecto
+    :return: 'csv', 'parquet' o 'jsonl'
+    """
+    if path == '-':
+        return default
+    ext = os.path.splitext(path)[1].lower()
+    return {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.jsonl': 'jsonl', '.json': 'jsonl'}.get(
+        ext, default)
+
+
+# Motores de pandas para Parquet. Son dependencias opcionales: solo se requieren para archivos .parquet/.pq
+PARQUET_ENGINES = ['pyarrow', 'fastparquet']
+
+
+def check_parquet(*formats) -> None:
+    """
+    Verifica que haya un motor de Parquet instalado si la entrada o la salida es Parquet
+    :param formats: formatos de la entrada y la salida (ver batch_format)
+    """
+    if 'parquet' in formats and not any(importlib.util.find_spec(engine) for engine in PARQUET_ENGINES):
+        raise ImportError(f"Los archivos Parquet requieren {' o '.join(PARQUET_ENGINES)} "
+                          f"(pip install {PARQUET_ENGINES[0]}); use CSV o JSON lines en su lugar")
+
+
+def batch_read(path, chunk_rows):
+    """
+    Lectura por bloques de los perfiles
+    :param path: archivo CSV, Parquet o JSON lines, o '-' para la entrada estándar
+    :param chunk_rows: número de perfiles por bloque
+    :return: iterador de DataFrames
+    """
+    fmt = batch_format(path)
+    if fmt == 'parquet':
+        df = pd.read_parquet(path)
+        return (df.iloc[start:start + chunk_rows] for start in range(0, len(df), chunk_rows))
+    source = sys.stdin if path == '-' else path
+    if fmt == 'csv':
+        return pd.read_csv(source, chunksize=chunk_rows)
+    return pd.read_json(source, lines=True, chunksize=chunk_rows)
+
+
+def batch_params(df) -> dict:
+    """
+    Parámetros de FeGeBatch a partir de las columnas de un bloque. Se aceptan los nombres de FeGe, los de las
+    opciones de la línea de comandos (wg, adult_wg, gn_wg) y los de fe_fermentacion; los parámetros ausentes
+    toman el valor por defecto de FeGe
+    :param df: bloque de perfiles
+    :return: diccionario parámetro -> arreglo
+    """
+    names = {**FE_FERMENTACION_COLUMNS, **BATCH_ALIASES}
+    params = {}
+    for col in df.columns:
+        param = names.get(col, col)
+        if param in FE_FERMENTACION_COLUMNS.values():
+            params[param] = df[col].values
+    return params
+
+
+def batch_execution(source, target='-', chunk_rows=10000, catalog=None) -> int:
+    """
+    Modo por lotes de ef_execution: lee perfiles de un archivo CSV, Parquet o JSON lines (o de la entrada
+    estándar), los calcula por bloques con FeGeBatch y un solo catálogo en memoria, y escribe cada bloque
+    con las columnas de entrada más fe, ceb, cms, cf, cc, cpms, ccms, dpcms, ym y fge en el formato de la
+    salida. CSV y JSON lines se escriben a medida que se calcula cada bloque; Parquet al final
+    :param source: archivo de entrada o '-'
+    :param target: archivo de salida o '-' para la salida estándar. Sin extensión conocida se usa el formato
+                   de la entrada
+    :param chunk_rows: número de perfiles por bloque
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :return: número de perfiles calculados
+    """
+    fmt = batch_format(target, batch_format(source))
+    check_parquet(batch_format(source), fmt)
+    catalog = catalog if catalog is not None else Catalog()
+    out = None
+    if fmt != 'parquet':
+        out = sys.stdout if target == '-' else open(target, 'w')
+    frames, total = [], 0
+    try:
+        for df in batch_read(source, chunk_rows):
+            res = FeGeBatch(catalog=catalog, **batch_params(df)).results()
+            df = pd.concat([df.reset_index(drop=True), res], axis=1)
+            if fmt == 'parquet':
+                frames.append(df)
+            elif fmt == 'csv':
+                df.to_csv(out, index=False, header=total == 0)
+            else:
+                out.write(df.to_json(orient='records', lines=True, double_precision=15).rstrip('\n') + '\n')
+            if out is not None:
+                out.flush()
+            total += len(df)
+        if fmt == 'parquet':
+            pd.concat(frames, ignore_index=True).to_parquet(sys.stdout.buffer if target == '-' else target,
+                                                            index=False)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    return total
+
+
 def create_parser():
     parser = argparse.ArgumentParser(description='Modulo para el calculo del factor de emision '
                                                  'de  fermentación entérica')
@@ -213,12 +329,21 @@ def create_parser():
     parser.add_argument('-sgeb_id', type=int, help='Sistema de gestion de estiercol B')
     parser.add_argument('-sgrb_id', type=int, help='Sistema de gestion de residuos B')
     parser.add_argument('-p_sgb', type=float, help='Porcentaje de Gestion de estiercol B')
+    parser.add_argument('-lote', type=str, help='Modo por lotes: archivo de perfiles CSV, Parquet o JSON lines '
+                                                '(- para la entrada estandar)')
+    parser.add_argument('-salida', type=str, default='-', help='Archivo de resultados del modo por lotes '
+                                                              '(- para la salida estandar). Sin extension se '
+                                                              'usa el formato de la entrada')
+    parser.add_argument('-bloque', type=int, default=10000, help='Perfiles por bloque del modo por lotes')
     return parser.parse_args()
 
 
 def main():
     args = create_parser()
     arg = vars(args)
+    if arg['lote'] is not None:
+        batch_execution(arg['lote'], arg['salida'], arg['bloque'])
+        return
     ef_execution(at_id=arg['at_id'],
                  ca_id=arg['ca_id'],
                  coe_act_id=arg['coe_act_id'],
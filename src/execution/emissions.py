@@ -2,24 +2,97 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import argparse
+import numpy as np
 import pandas as pd
 sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
 
 from src.database.db_utils import pg_connection_str, pg_connection
 
 
-def get_act_data():
+def keys_filter(keys) -> str:
+    """
+    Filtro SQL por pares (id_reg, id_at) de fe_fermentacion_temporal
+    :param keys: lista de pares (id_reg, id_at)
+    :return: condición WHERE
+    """
+    values = ', '.join(f'({int(reg)}, {int(at)})' for reg, at in keys)
+    return f"WHERE (FE.id_reg, FE.id_at) IN (VALUES {values})"
+
+
+def act_query(keys=None, municipal=False) -> str:
+    """
+    Consulta de los datos de actividad con sus factores de emisión
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se leen las filas que usan esos factores
+    :param municipal: usa los factores de fe_fermentacion_municipio y el regional donde no haya factor municipal
+    :return: consulta SQL
+    """
     query = """ SELECT DA.id, ano as año, cod_muni, id_reg_ganadera, id_ani_tipo_ipcc, numero, emision_fe, emision_ge,
                 FE.fe_fermentacion_ent as fe, FE.fe_gestion_est as gen
                 FROM datos_act_bovinos_ipcc_temporal as DA
                 INNER JOIN fe_fermentacion_temporal as FE ON FE.id_reg = DA.id_reg_ganadera AND 
                 FE.id_at = DA.id_ani_tipo_ipcc
             """
-    df = pd.read_sql_query(query, con=pg_connection_str())
+    if municipal:
+        query = """ SELECT DA.id, DA.ano as año, DA.cod_muni, id_reg_ganadera, id_ani_tipo_ipcc, numero, emision_fe,
+                    emision_ge, COALESCE(FM.fe_fermentacion_ent, FE.fe_fermentacion_ent) as fe,
+                    COALESCE(FM.fe_gestion_est, FE.fe_gestion_est) as gen
+                    FROM datos_act_bovinos_ipcc_temporal as DA
+                    INNER JOIN fe_fermentacion_temporal as FE ON FE.id_reg = DA.id_reg_ganadera AND 
+                    FE.id_at = DA.id_ani_tipo_ipcc
+                    LEFT JOIN fe_fermentacion_municipio as FM ON FM.cod_muni = DA.cod_muni AND 
+                    FM.id_reg = DA.id_reg_ganadera AND FM.id_at = DA.id_ani_tipo_ipcc AND FM.ano = DA.ano
+                """
+    if keys is not None:
+        query = query + keys_filter(keys)
+    return query
+
+
+def get_act_data(keys=None, municipal=False):
+    """
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se leen las filas que usan esos factores
+    :param municipal: usa los factores de fe_fermentacion_municipio y el regional donde no haya factor municipal
+    """
+    df = pd.read_sql_query(act_query(keys=keys, municipal=municipal), con=pg_connection_str())
     return df
 
 
-def update_db(df) -> None:
+def changed_rows(df, previous, columns, rtol=1e-9) -> np.ndarray:
+    """
+    Filas cuyos valores nuevos difieren de los leídos antes del cálculo. Los nulos y NaN se consideran iguales y
+    las columnas de texto se comparan exactamente
+    :param df: valores nuevos con id
+    :param previous: valores guardados con id
+    :param columns: columnas a comparar
+    :param rtol: tolerancia relativa
+    :return: arreglo booleano de filas cambiadas
+    """
+    old = df[['id']].merge(previous[['id'] + columns], on='id', how='left')
+    changed = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            changed |= ~np.isclose(df[col].values.astype('float64'), old[col].values.astype('float64'), rtol=rtol,
+                                   atol=0.0, equal_nan=True)
+        else:
+            changed |= df[col].values != old[col].values
+    return changed
+
+
+def update_db(df, previous=None, rtol=1e-9) -> int:
+    """
+    Escritura masiva de emision_fe y emision_ge. Si se entregan los valores leídos antes del cálculo solo se
+    envían las filas que cambiaron
+    :param df: id, emision_fe, emision_ge
+    :param previous: id, emision_fe, emision_ge guardados
+    :param rtol: tolerancia relativa de la comparación
+    :return: filas escritas
+    """
+    if previous is not None:
+        changed = changed_rows(df, previous, ['emision_fe', 'emision_ge'], rtol)
+        print(f"datos_act_bovinos_ipcc_temporal: cambiadas={changed.sum()} sin_cambio={(~changed).sum()}")
+        df = df[changed]
+        if df.empty:
+            return 0
     df = df.where(pd.notnull(df), 'nan')
     zipped = zip(df.id, df.emision_fe, df.emision_ge)
     tp_to_str = str(tuple(zipped))
@@ -33,17 +106,81 @@ def update_db(df) -> None:
         cur = connection.cursor()
         cur.execute(query_)
     conn_.close()
+    return len(df)
+
+
+def pushdown_update(table, query) -> None:
+    """
+    Cálculo de las emisiones dentro de Postgres con un solo UPDATE ... FROM sobre la misma consulta de
+    los datos de actividad, sin traer las filas a pandas
+    :param table: tabla de datos de actividad a actualizar
+    :param query: consulta con id, numero, fe y gen
+    """
+    query_ = f"""UPDATE {table} AS da
+                 SET emision_fe = v.fe * v.numero / 1000000.0, emision_ge = v.gen * v.numero / 1000000.0
+                 FROM ({query}) AS v
+                 WHERE da.id = v.id"""
+    conn_ = pg_connection()
+    with conn_ as connection:
+        cur = connection.cursor()
+        cur.execute(query_)
+    conn_.close()
+
+
+def parity_check(df, rtol=1e-9) -> bool:
+    """
+    Compara las emisiones guardadas con el cálculo de pandas (fe * numero / 1e6). Los nulos y NaN se
+    consideran iguales
+    :param df: datos de actividad con emision_fe, emision_ge, fe, gen y numero
+    :param rtol: tolerancia relativa
+    :return: True si todas las filas coinciden
+    """
+    ok = True
+    for col, factor in (('emision_fe', 'fe'), ('emision_ge', 'gen')):
+        expected = (df[factor] * df.numero / 1000000.0).values.astype('float64')
+        stored = df[col].values.astype('float64')
+        same = np.isclose(stored, expected, rtol=rtol, atol=0.0, equal_nan=True)
+        print(f"{col}: filas distintas={(~same).sum()}")
+        ok &= bool(same.all())
+    return ok
+
+
+def calculation(keys=None, municipal=False, pushdown=False, check=False):
+    """
+    Cálculo de las emisiones de datos_act_bovinos_ipcc_temporal
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se actualizan las filas que usan esos factores
+    :param municipal: usa los factores de fe_fermentacion_municipio
+    :param pushdown: calcula con un UPDATE ... FROM dentro de Postgres en lugar de pandas
+    :param check: después del cálculo compara las emisiones guardadas con el cálculo de pandas
+    :return: resultado de la comparación si check, None en otro caso
+    """
+    if pushdown:
+        pushdown_update('datos_act_bovinos_ipcc_temporal', act_query(keys=keys, municipal=municipal))
+    else:
+        df = get_act_data(keys=keys, municipal=municipal)
+        if df.empty:
+            return
+        previous = df[['id', 'emision_fe', 'emision_ge']].copy()
+        df.emision_ge = df.gen * df.numero / 1000000.0
+        df.emision_fe = df.fe * df.numero / 1000000.0
+        update_db(df, previous)
+    if check:
+        return parity_check(get_act_data(keys=keys, municipal=municipal))
 
 
-def calculation():
-    df = get_act_data()
-    df.emision_ge = df.gen * df.numero / 1000000.0
-    df.emision_fe = df.fe * df.numero / 1000000.0
-    update_db(df)
+def create_parser():
+    parser = argparse.ArgumentParser(description='Cálculo de las emisiones de bovinos')
+    parser.add_argument('--municipio', action='store_true',
+                        help='Usa los factores de emision por municipio de fe_fermentacion_municipio')
+    parser.add_argument('--sql', action='store_true', help='Calcula las emisiones dentro de la base de datos')
+    parser.add_argument('--verificar', action='store_true',
+                        help='Compara las emisiones guardadas con el calculo de pandas')
+    return parser.parse_args()
 
 
 def main():
-    calculation()
+    args = create_parser()
+    calculation(municipal=args.municipio, pushdown=args.sql, check=args.verificar)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import time
+import argparse
+import queue
+import threading
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+
+from src.database.db_utils import pg_connection_str, pg_connection
+from src.execution import emissions, projected_emissions
+from src.database.other_species import refresh_other_factors, OTHER_FACTORS_TABLE
+
+# Tablas de datos de actividad: tabla -> incluye otras especies
+ACT_TABLES = {
+    'datos_act_bovinos_ipcc_temporal': False,
+    'datos_act_bovinos_ipcc_proyectados': True,
+}
+
+# Tablas de datos de actividad que usan los factores por municipio cuando se piden (como emissions --municipio).
+# Las proyectadas usan siempre los factores regionales, como projected_emissions
+MUNICIPAL_TABLES = ['datos_act_bovinos_ipcc_temporal']
+
+# Llaves de la unión con fe_fermentacion_municipio
+MUNICIPAL_KEYS = ['cod_muni', 'id_reg_ganadera', 'id_ani_tipo_ipcc', 'ano']
+
+# Columnas leídas de los datos de actividad (las emisiones guardadas permiten escribir solo las filas que cambian)
+ACT_COLUMNS = ['id', 'cod_muni', 'ano', 'id_reg_ganadera', 'id_ani_tipo_ipcc', 'numero', 'emision_fe', 'emision_ge']
+
+# Escritura masiva de cada tabla de datos de actividad
+WRITERS = {
+    'datos_act_bovinos_ipcc_temporal': emissions.update_db,
+    'datos_act_bovinos_ipcc_proyectados': projected_emissions.update_db,
+}
+
+
+def get_factors() -> pd.DataFrame:
+    """
+    Factores de emisión de bovinos por región ganadera y animal tipo (una sola lectura para ambas tablas)
+    :return: DataFrame id_reg_ganadera, id_ani_tipo_ipcc, fe, gen
+    """
+    query = """ SELECT id_reg as id_reg_ganadera, id_at as id_ani_tipo_ipcc, fe_fermentacion_ent as fe,
+                fe_gestion_est as gen
+                FROM fe_fermentacion_temporal
+            """
+    return pd.read_sql_query(query, con=pg_connection_str())
+
+
+def get_municipal_factors() -> pd.DataFrame:
+    """
+    Factores de emisión de bovinos por municipio, región ganadera, animal tipo y año
+    :return: DataFrame cod_muni, id_reg_ganadera, id_ani_tipo_ipcc, ano, fe, gen
+    """
+    query = """ SELECT cod_muni, id_reg as id_reg_ganadera, id_at as id_ani_tipo_ipcc, ano, fe_fermentacion_ent as fe,
+                fe_gestion_est as gen
+                FROM fe_fermentacion_municipio
+            """
+    return pd.read_sql_query(query, con=pg_connection_str())
+
+
+def table_factors(table, df_municipal):
+    """
+    Factores por municipio que usa una tabla de datos de actividad
+    :param table: tabla de datos de actividad
+    :param df_municipal: factores de get_municipal_factors o None
+    :return: df_municipal si la tabla está en MUNICIPAL_TABLES, None en otro caso
+    """
+    return df_municipal if table in MUNICIPAL_TABLES else None
+
+
+def get_other_factors() -> pd.DataFrame:
+    """
+    Promedio de los factores de fe_otras_especies por animal tipo, desde la tabla precalculada
+    :return: DataFrame id_ani_tipo_ipcc, fe, gen
+    """
+    refresh_other_factors()
+    query = f"SELECT id_animal_tipo_ipcc as id_ani_tipo_ipcc, fe, gen FROM {OTHER_FACTORS_TABLE}"
+    return pd.read_sql_query(query, con=pg_connection_str())
+
+
+def get_years(table) -> list:
+    """
+    Años presentes en una tabla de datos de actividad
+    :param table: tabla de datos de actividad
+    :return: lista de años ordenada
+    """
+    query = f"SELECT DISTINCT ano FROM {table} ORDER BY ano"
+    return pd.read_sql_query(query, con=pg_connection_str())['ano'].tolist()
+
+
+def get_activity(table, keys=None, years=None) -> pd.DataFrame:
+    """
+    Datos de actividad sin unir a los factores: la unión se hace en memoria con los factores leídos una vez
+    :param table: tabla de datos de actividad
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se leen esas filas
+    :param years: par (año inicial, año final). Si se entrega solo se leen esos años
+    :return: DataFrame id, cod_muni, ano, id_reg_ganadera, id_ani_tipo_ipcc, numero, emision_fe, emision_ge
+             (guardadas)
+    """
+    query = f"SELECT {', '.join(ACT_COLUMNS)} FROM {table} "
+    conditions = []
+    if keys is not None:
+        values = ', '.join(f'({int(reg)}, {int(at)})' for reg, at in keys)
+        conditions.append(f"(id_reg_ganadera, id_ani_tipo_ipcc) IN (VALUES {values})")
+    if years is not None:
+        conditions.append(f"ano BETWEEN {int(years[0])} AND {int(years[1])}")
+    if conditions:
+        query = query + "WHERE " + " AND ".join(conditions)
+    return pd.read_sql_query(query, con=pg_connection_str())
+
+
+def act_emissions(df_act, df_factors, df_others=None, df_municipal=None) -> pd.DataFrame:
+    """
+    Emisiones de una tabla de datos de actividad con los mismos factores que emissions y projected_emissions
+    :param df_act: datos de actividad
+    :param df_factors: factores de bovinos
+    :param df_others: factores de otras especies. Si no se entrega solo se calculan los bovinos
+    :param df_municipal: factores por municipio. Si se entrega se usan en lugar del regional donde existan, como
+                         emissions --municipio
+    :return: DataFrame id, emision_fe, emision_ge ordenado por id
+    """
+    df = df_act.merge(df_factors, on=['id_reg_ganadera', 'id_ani_tipo_ipcc'], how='inner')
+    if df_municipal is not None:
+        df = df.merge(df_municipal, on=MUNICIPAL_KEYS, how='left', suffixes=('', '_municipio'))
+        df['fe'] = df['fe_municipio'].fillna(df['fe'])
+        df['gen'] = df['gen_municipio'].fillna(df['gen'])
+    if df_others is not None:
+        df = pd.concat([df, df_act.merge(df_others, on='id_ani_tipo_ipcc', how='inner')], ignore_index=True)
+    df['emision_fe'] = df.fe * df.numero / 1000000.0
+    df['emision_ge'] = df.gen * df.numero / 1000000.0
+    return df.sort_values(by=['id'])[['id', 'emision_fe', 'emision_ge']]
+
+
+def calculation(keys=None, municipal=False) -> None:
+    """
+    Cálculo de las emisiones históricas y proyectadas en una sola pasada. Los factores de fe_fermentacion_temporal
+    y el promedio de fe_otras_especies se leen una vez y se unen en memoria con cada tabla de actividad;
+    cada tabla se escribe con su UPDATE masivo
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se actualizan las filas de bovinos que usan
+                 esos factores
+    :param municipal: usa los factores de fe_fermentacion_municipio en MUNICIPAL_TABLES y el regional donde no
+                      haya factor municipal. Debe coincidir con el modo de la última corrida de emissions, de lo
+                      contrario las emisiones municipales se reemplazan por las regionales
+    """
+    df_factors = get_factors()
+    df_others = get_other_factors() if keys is None else None
+    df_municipal = get_municipal_factors() if municipal else None
+    for table, others in ACT_TABLES.items():
+        df_act = get_activity(table, keys)
+        df = act_emissions(df_act, df_factors, df_others if others else None, table_factors(table, df_municipal))
+        written = WRITERS[table](df, df_act) if not df.empty else 0
+        print(f"{table}={len(df)} escritas={written}")
+
+
+def year_partitions(years, years_per_partition) -> list:
+    """
+    Rangos de años consecutivos
+    :param years: años ordenados
+    :param years_per_partition: años por partición
+    :return: lista de pares (año inicial, año final)
+    """
+    return [(years[i], years[min(i + years_per_partition, len(years)) - 1])
+            for i in range(0, len(years), years_per_partition)]
+
+
+def partition_calc(table, years, df_factors, df_others, df_municipal=None) -> dict:
+    """
+    Lectura, cálculo y escritura de una partición de años
+    :return: diccionario tabla, desde, hasta, filas, escritas, segundos
+    """
+    start = time.perf_counter()
+    df_act = get_activity(table, years=years)
+    df = act_emissions(df_act, df_factors, df_others, df_municipal)
+    written = WRITERS[table](df, df_act) if not df.empty else 0
+    return {'tabla': table, 'desde': years[0], 'hasta': years[1], 'filas': len(df), 'escritas': written,
+            'segundos': time.perf_counter() - start}
+
+
+def partitioned_calculation(years_per_partition=1, max_workers=None, municipal=False) -> pd.DataFrame:
+    """
+    Cálculo de las emisiones históricas y proyectadas por particiones de años procesadas en paralelo.
+    Cada partición corre en su propio proceso (la unión y el cálculo en pandas no liberan el GIL), lee solo sus
+    años con sus propias conexiones, se une en memoria a los factores compartidos y se escribe con su propio
+    UPDATE masivo, de modo que la memoria queda acotada por el tamaño de la partición
+    :param years_per_partition: años por partición
+    :param max_workers: procesos simultáneos. Por defecto el número de núcleos
+    :param municipal: usa los factores por municipio (ver calculation)
+    :return: tiempos por partición
+    """
+    df_factors = get_factors()
+    df_others = get_other_factors()
+    df_municipal = get_municipal_factors() if municipal else None
+    max_workers = max_workers if max_workers is not None else os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(partition_calc, table, years, df_factors, df_others if others else None,
+                                   table_factors(table, df_municipal))
+                   for table, others in ACT_TABLES.items()
+                   for years in year_partitions(get_years(table), years_per_partition)]
+        report = pd.DataFrame([future.result() for future in futures])
+    return report
+
+
+def stream_writer(table, chunks, errors, written) -> None:
+    """
+    Hilo de escritura: escribe cada bloque de la cola con el UPDATE masivo de la tabla hasta recibir None
+    :param table: tabla de datos de actividad
+    :param chunks: cola de pares (emisiones, datos de actividad leídos)
+    :param errors: lista donde se guarda la excepción de la escritura
+    :param written: lista donde se guardan las filas escritas por bloque
+    """
+    while True:
+        chunk = chunks.get()
+        if chunk is None:
+            return
+        if not errors:
+            try:
+                written.append(WRITERS[table](*chunk))
+            except Exception as error:
+                errors.append(error)
+
+
+def stream_table(table, df_factors, df_others=None, chunk_rows=50000, queue_size=2, df_municipal=None) -> tuple:
+    """
+    Cálculo de las emisiones de una tabla como flujo: un cursor del lado del servidor entrega bloques de
+    chunk_rows filas, cada bloque se une a los factores en memoria y se entrega a un hilo de escritura por una
+    cola acotada. La lectura y el cálculo de un bloque se solapan con la escritura de los anteriores y la memoria
+    queda acotada por (queue_size + 2) bloques, sin importar el tamaño de la tabla
+    :param table: tabla de datos de actividad
+    :param df_factors: factores de bovinos
+    :param df_others: factores de otras especies
+    :param chunk_rows: filas por bloque
+    :param queue_size: bloques calculados en espera de escritura
+    :param df_municipal: factores por municipio (ver act_emissions)
+    :return: tupla (filas calculadas, filas escritas); las escritas son solo las que cambiaron
+    """
+    chunks = queue.Queue(maxsize=queue_size)
+    errors, written = [], []
+    writer = threading.Thread(target=stream_writer, args=(table, chunks, errors, written), daemon=True)
+    writer.start()
+    total = 0
+    conn_ = pg_connection()
+    try:
+        with conn_ as connection:
+            cur = connection.cursor(name=f'stream_{table}')
+            cur.itersize = chunk_rows
+            cur.execute(f"SELECT {', '.join(ACT_COLUMNS)} FROM {table}")
+            while not errors:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                df_act = pd.DataFrame(rows, columns=ACT_COLUMNS)
+                df = act_emissions(df_act, df_factors, df_others, df_municipal)
+                if not df.empty:
+                    chunks.put((df, df_act))
+                    total += len(df)
+            cur.close()
+    finally:
+        chunks.put(None)
+        writer.join()
+        conn_.close()
+    if errors:
+        raise errors[0]
+    return total, sum(written)
+
+
+def streaming_calculation(chunk_rows=50000, queue_size=2, municipal=False) -> None:
+    """
+    Cálculo de las emisiones históricas y proyectadas como flujo con memoria constante (ver stream_table)
+    :param chunk_rows: filas por bloque
+    :param queue_size: bloques calculados en espera de escritura
+    :param municipal: usa los factores por municipio (ver calculation)
+    """
+    df_factors = get_factors()
+    df_others = get_other_factors()
+    df_municipal = get_municipal_factors() if municipal else None
+    for table, others in ACT_TABLES.items():
+        total, written = stream_table(table, df_factors, df_others if others else None, chunk_rows, queue_size,
+                                      table_factors(table, df_municipal))
+        print(f"{table}={total} escritas={written}")
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Cálculo de las emisiones históricas y proyectadas')
+    parser.add_argument('--paralelo', action='store_true', help='Procesa particiones de años en paralelo')
+    parser.add_argument('--anos', type=int, default=1, help='Años por partición')
+    parser.add_argument('--procesos', type=int, default=None, help='Procesos simultáneos (por defecto núcleos)')
+    parser.add_argument('--flujo', action='store_true', help='Procesa las tablas como flujo con memoria constante')
+    parser.add_argument('--bloque', type=int, default=50000, help='Filas por bloque del flujo')
+    parser.add_argument('--municipio', action='store_true',
+                        help='Usa los factores de emision por municipio en los datos historicos')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    if args.paralelo:
+        report = partitioned_calculation(args.anos, args.procesos, args.municipio)
+        print(report.to_string(index=False))
+        return
+    if args.flujo:
+        streaming_calculation(args.bloque, municipal=args.municipio)
+        return
+    calculation(municipal=args.municipio)
+
+
+if __name__ == '__main__':
+    main()
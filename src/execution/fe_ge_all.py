@@ -2,11 +2,27 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import json
+import glob
+import shutil
+import hashlib
+import argparse
+import numpy as np
 import pandas as pd
+from sqlalchemy import create_engine, text
 sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
 
 from src.database.db_utils import pg_connection_str, pg_connection
-from src.execution.ef_exe import ef_execution
+from src.database.catalog import Catalog, PROFILE_KEYS, profile_keys
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame, FE_FERMENTACION_COLUMNS
+from src.execution.fe_validation import validate_profiles, rejects_frame, RESULTADO_NO_FINITO
+from src.execution.emissions import changed_rows
+
+# Columnas escritas en fe_fermentacion_temporal
+RESULT_COLUMNS = ['fe_fermentacion_ent', 'ym', 'fe_gestion_est', 'huella']
+
+path_root = os.path.abspath(os.path.join(os.path.abspath(__file__), "../../../"))
+checkpoint_root = f'{path_root}/results/fe_ge_all_checkpoint'
 
 
 def get_data() -> pd.DataFrame:
@@ -17,89 +33,244 @@ def get_data() -> pd.DataFrame:
     return df
 
 
-def update_db(df) -> None:
+def get_fingerprints() -> pd.DataFrame:
+    """
+    Huellas y resultados almacenados en fe_fermentacion_temporal. Crea la columna huella si no existe
+    :return: DataFrame id, fe_fermentacion_ent, ym, fe_gestion_est, huella
+    """
+    conn_ = pg_connection()
+    with conn_ as connection:
+        cur = connection.cursor()
+        cur.execute("ALTER TABLE fe_fermentacion_temporal ADD COLUMN IF NOT EXISTS huella varchar(16)")
+    conn_.close()
+    query = "SELECT id, fe_fermentacion_ent, ym, fe_gestion_est, huella FROM fe_fermentacion_temporal"
+    return pd.read_sql_query(query, pg_connection_str())
+
+
+def fingerprints(df, catalog) -> pd.Series:
+    """
+    Huella por fila de las columnas de entrada de fe_fermentacion y de las filas del catálogo que usa el perfil.
+    Cambia cuando cambia cualquier entrada del perfil o cualquier fila del catálogo de la que depende
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param catalog: Catalog
+    :return: huella hexadecimal por fila
+    """
+    inputs = [df[list(FE_FERMENTACION_COLUMNS)].astype('float64').values]
+    for key, (_col, table) in PROFILE_KEYS.items():
+        inputs.append(catalog.rows(table, profile_keys(df, key)))
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(np.hstack(inputs)), index=False).values
+    return pd.Series([f'{h:016x}' for h in hashes], index=df.index)
+
+
+def update_db(df, previous=None, rtol=1e-9) -> int:
+    """
+    Escritura masiva de fe, ym, fge y huella. Si se entregan los valores guardados solo se envían las filas
+    que cambiaron
+    :param df: id y RESULT_COLUMNS
+    :param previous: id y RESULT_COLUMNS guardados (ver get_fingerprints)
+    :param rtol: tolerancia relativa de la comparación
+    :return: filas escritas
+    """
+    if previous is not None:
+        changed = changed_rows(df, previous, RESULT_COLUMNS, rtol)
+        print(f"fe_fermentacion_temporal: cambiadas={changed.sum()} sin_cambio={(~changed).sum()}")
+        df = df[changed]
+        if df.empty:
+            return 0
     df = df.where(pd.notnull(df), 'nan')
-    zipped = zip(df.id, df.fe_fermentacion_ent, df.ym, df.fe_gestion_est)
+    zipped = zip(df.id, df.fe_fermentacion_ent, df.ym, df.fe_gestion_est, df.huella)
     tp_to_str = str(tuple(zipped))
     update = tp_to_str[1:len(tp_to_str) - 1]
     query_ = f"""UPDATE fe_fermentacion_temporal AS fet 
-                 SET fe_fermentacion_ent = v.fe_fermentacion_ent, ym = v.ym, fe_gestion_est = v.fe_gestion_est 
-                 FROM (VALUES {update}) AS v (id, fe_fermentacion_ent, ym, fe_gestion_est) 
+                 SET fe_fermentacion_ent = v.fe_fermentacion_ent, ym = v.ym, fe_gestion_est = v.fe_gestion_est,
+                 huella = v.huella
+                 FROM (VALUES {update}) AS v (id, fe_fermentacion_ent, ym, fe_gestion_est, huella) 
                  WHERE fet.id = v.id"""
     conn_ = pg_connection()
     with conn_ as connection:
         cur = connection.cursor()
         cur.execute(query_)
     conn_.close()
+    return len(df)
+
+
+def write_rejects(df_rejects, ids=None) -> None:
+    """
+    Escribe los rechazos en fe_fermentacion_rechazos. Si se entregan ids solo se reemplazan los rechazos de esos
+    perfiles (borrado y escritura en una sola transacción); si no, se reemplaza la tabla completa
+    :param df_rejects: rechazos de rejects_frame
+    :param ids: ids de fe_fermentacion recalculados
+    """
+    if ids is None:
+        df_rejects.to_sql('fe_fermentacion_rechazos', con=pg_connection_str(), if_exists='replace', index=False,
+                          method="multi", chunksize=5000)
+        return
+    engine = create_engine(pg_connection_str())
+    with engine.begin() as connection:
+        exists = connection.execute(text("SELECT to_regclass('fe_fermentacion_rechazos')")).scalar() is not None
+        if exists and len(ids):
+            connection.execute(text(f"""DELETE FROM fe_fermentacion_rechazos
+                                        WHERE id IN ({', '.join(str(int(i)) for i in ids)})"""))
+        df_rejects.to_sql('fe_fermentacion_rechazos', con=connection, if_exists='append', index=False,
+                          method="multi", chunksize=5000)
+    engine.dispose()
 
 
-def masive_calc():
+def run_signature(df, incremental, chunk_rows) -> str:
+    """
+    Firma de una corrida: perfiles, sus huellas (entradas + filas del catálogo usadas) y parámetros de los bloques
+    :param df: perfiles ordenados por id con huella
+    :param incremental: si la corrida es incremental
+    :param chunk_rows: número de perfiles por bloque
+    :return: firma md5
+    """
+    md5 = hashlib.md5(f'{incremental}-{chunk_rows}'.encode())
+    md5.update(pd.util.hash_pandas_object(df[['id', 'huella']], index=False).values.tobytes())
+    return md5.hexdigest()
+
+
+def checkpoint_path(signature) -> str:
+    """
+    Directorio del punto de control de una corrida. Cada firma tiene su propio directorio, de modo que una
+    corrida parcial (ids de catalog_deps) no borra el punto de control de una corrida completa interrumpida
+    :param signature: firma de la corrida
+    :return: ruta del directorio
+    """
+    return f'{checkpoint_root}/{signature}'
+
+
+def load_checkpoint(signature) -> set:
+    """
+    Bloques terminados de una corrida anterior con la misma firma. Si la firma cambió (otros perfiles,
+    entradas o catálogo) no hay bloques terminados
+    :param signature: firma de la corrida
+    :return: conjunto de bloques terminados
+    """
+    meta_path = f'{checkpoint_path(signature)}/meta.json'
+    if os.path.exists(meta_path):
+        with open(meta_path) as json_file:
+            meta = json.load(json_file)
+        if meta['signature'] == signature:
+            return set(meta['chunks'])
+    return set()
+
+
+def save_checkpoint(signature, chunks, chunk, df_rejects) -> None:
+    """
+    Registra un bloque terminado y sus rechazos
+    :param signature: firma de la corrida
+    :param chunks: bloques terminados
+    :param chunk: bloque recién terminado
+    :param df_rejects: rechazos del bloque
+    """
+    checkpoint_dir = checkpoint_path(signature)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    df_rejects.to_csv(f'{checkpoint_dir}/rechazos_{chunk}.csv', index=False)
+    chunks.add(chunk)
+    with open(f'{checkpoint_dir}/meta.json.tmp', 'w') as json_file:
+        json.dump({'signature': signature, 'chunks': sorted(chunks)}, json_file)
+    os.replace(f'{checkpoint_dir}/meta.json.tmp', f'{checkpoint_dir}/meta.json')
+
+
+def chunk_calc(df, catalog):
+    """
+    Validación y cálculo en lote de un bloque de perfiles
+    :param df: bloque de perfiles con huella
+    :param catalog: Catalog
+    :return: bloque con fe, ym, fge y huella actualizados (NaN en los rechazos), filas calculadas, rechazos
+    """
+    df = df.copy()
+    valid, df_rejects = validate_profiles(df, catalog)
+    res = FeGeBatch(catalog=catalog, **profiles_from_frame(df[valid])).results()
+    finite = np.isfinite(res[['fe', 'ym', 'fge']].values).all(axis=1)
+    df_rejects = pd.concat([df_rejects,
+                            rejects_frame(df[valid], ~finite, RESULTADO_NO_FINITO, 'id',
+                                          'fe, ym o fge no finito')], ignore_index=True)
+    idx = df.index[valid][finite]
+    df.loc[idx, 'fe_fermentacion_ent'] = res['fe'].values[finite]
+    df.loc[idx, 'ym'] = res['ym'].values[finite]
+    df.loc[idx, 'fe_gestion_est'] = res['fge'].values[finite]
+    # los rechazos no guardan huella para que se validen de nuevo en la siguiente corrida, ni factores que ya no
+    # corresponden a sus entradas
+    rejected = ~df.index.isin(idx)
+    df.loc[rejected, 'huella'] = ''
+    df.loc[rejected, ['fe_fermentacion_ent', 'ym', 'fe_gestion_est']] = np.nan
+    return df, df.loc[idx], df_rejects
+
+
+def masive_calc(incremental=True, ids=None, chunk_rows=50000, resume=False) -> pd.DataFrame:
+    """
+    Cálculo de fe, ym y fge para todos los perfiles de fe_fermentacion. Los perfiles se validan antes del
+    cálculo, los válidos se calculan en lote con FeGeBatch y los rechazos se guardan en
+    fe_fermentacion_rechazos con su código de motivo.
+    Los perfiles se procesan en bloques de chunk_rows filas ordenadas por id; cada bloque se escribe en la
+    base de datos al terminar y se registra en un punto de control local, de modo que una corrida
+    interrumpida puede reanudarse sin repetir los bloques terminados
+    :param incremental: solo recalcula las filas cuya huella (entradas + filas del catálogo usadas) cambió
+    :param ids: solo recalcula estos ids de fe_fermentacion; solo sus rechazos se reemplazan
+    :param chunk_rows: número de perfiles por bloque
+    :param resume: omite los bloques terminados de la última corrida con los mismos perfiles, entradas y catálogo.
+        El punto de control de cada corrida va en su propio directorio (checkpoint_path), así que una corrida no
+        borra el de otra con otra firma
+    :return: filas recalculadas en esta corrida
+    """
     df = get_data()
-    fails = 1
-    for i in df.index:
-        try:
-            at_id: int = int(df.at[i, 'id_at'])
-            ca_id: int = int(df.at[i, 'id_ca'])
-            coe_act_id: int = int(df.at[i, 'id_coe_acti'])
-            ta: float = df.at[i, 'temp']
-            pf: float = df.at[i, 'por_pasto']
-            ps: float = df.at[i, 'por_suple']
-            vs_id: int = int(df.at[i, 'id_suple'])
-            vp_id: int = int(df.at[i, 'id_pasto'])
-            weight: float = df.at[i, 'peso']
-            adult_w: float = df.at[i, 'adult_peso']
-            cp_id: int = int(df.at[i, 'id_cp'])
-            gan: float = df.at[i, 'gn_peso']
-            milk: float = df.at[i, 'leche']
-            grease: float = df.at[i, 'grasa']
-            ht: float = df.at[i, 'ht']
-            cs_id: int = (df.at[i, 'id_cs'])
-            sp_id: int = (df.at[i, 'id_prod_metano'])
-            sgea_id: int = (df.at[i, 'id_gestion_est1'])
-            sgra_id: int = (df.at[i, 'id_gestion_res1'])
-            p_sga: float = df.at[i, 'por_gestion1']
-            sgeb_id: int = (df.at[i, 'id_gestion_est2'])
-            sgrb_id: int = (df.at[i, 'id_gestion_res2'])
-            p_sgb: float = df.at[i, 'por_gestion2']
-            fe, _ceb, _cms, _cf, _cc, _cpms, _ccms, _dpcms, ym, fge = ef_execution(at_id=at_id,
-                                                                                   ca_id=ca_id,
-                                                                                   coe_act_id=coe_act_id,
-                                                                                   ta=ta,
-                                                                                   pf=pf,
-                                                                                   ps=ps,
-                                                                                   vp_id=vp_id,
-                                                                                   vs_id=vs_id,
-                                                                                   weight=weight,
-                                                                                   adult_w=adult_w,
-                                                                                   cp_id=cp_id,
-                                                                                   gan=gan,
-                                                                                   milk=milk,
-                                                                                   grease=grease,
-                                                                                   ht=ht,
-                                                                                   cs_id=cs_id,
-                                                                                   sp_id=sp_id,
-                                                                                   sgea_id=sgea_id,
-                                                                                   sgra_id=sgra_id,
-                                                                                   p_sga=p_sga,
-                                                                                   sgeb_id=sgeb_id,
-                                                                                   sgrb_id=sgrb_id,
-                                                                                   p_sgb=p_sgb,
-                                                                                   prnt=False)
-            df.loc[i, 'fe_fermentacion_ent'] = fe
-            df.loc[i, 'ym'] = ym
-            df.loc[i, 'fe_gestion_est'] = fge
-        except (IndexError, ValueError, ZeroDivisionError)as e:
-            fails += 1
-            pass
-    update_db(df)
-    rows, _cols = df.shape
-    print(f"salida={rows - fails}")
-    print(f"error={fails}")
+    if ids is not None:
+        df = df[df['id'].isin(ids)]
+    df = df.sort_values(by=['id']).reset_index(drop=True)
+    catalog = Catalog()
+    df['huella'] = fingerprints(df, catalog)
+    signature = run_signature(df, incremental, chunk_rows)
+    checkpoint_dir = checkpoint_path(signature)
+    done = load_checkpoint(signature) if resume else set()
+    if not resume:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    df_stored = get_fingerprints()
+    stored = df_stored.set_index('id')['huella']
+    computed = []
+    skipped, total, written = 0, 0, 0
+    for chunk, start in enumerate(range(0, len(df), chunk_rows)):
+        if chunk in done:
+            continue
+        df_chunk = df.iloc[start:start + chunk_rows]
+        if incremental:
+            unchanged = df_chunk['huella'].values == df_chunk['id'].map(stored).values
+            skipped += unchanged.sum()
+            df_chunk = df_chunk[~unchanged]
+        df_rejects = rejects_frame(df_chunk, np.zeros(len(df_chunk), dtype=bool), '', 'id', '')
+        if not df_chunk.empty:
+            df_chunk, df_ok, df_rejects = chunk_calc(df_chunk, catalog)
+            written += update_db(df_chunk, df_stored)
+            computed.append(df_ok)
+            total += len(df_chunk)
+        save_checkpoint(signature, done, chunk, df_rejects)
+    if incremental:
+        print(f"omitidos={skipped}")
+    files = glob.glob(f'{checkpoint_dir}/rechazos_*.csv')
+    df_rejects = pd.concat([rejects_frame(df, np.zeros(len(df), dtype=bool), '', 'id', '')] +
+                           [pd.read_csv(f) for f in files], ignore_index=True)
+    write_rejects(df_rejects, None if ids is None else df['id'].values)
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    df_out = pd.concat(computed) if computed else df.iloc[:0]
+    print(f"salida={len(df_out)}")
+    print(f"error={total - len(df_out)}")
+    print(f"escritas={written}")
+    return df_out
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Cálculo masivo de los factores de emisión de fe_fermentacion')
+    parser.add_argument('--completo', action='store_true',
+                        help='Recalcula todas las filas aunque sus entradas no hayan cambiado')
+    parser.add_argument('--bloque', type=int, default=50000, help='Perfiles por bloque (punto de control)')
+    parser.add_argument('--reanudar', action='store_true',
+                        help='Omite los bloques terminados de la ultima corrida interrumpida')
+    return parser.parse_args()
 
 
 def main():
-    masive_calc()
-    pass
+    args = create_parser()
+    masive_calc(incremental=not args.completo, chunk_rows=args.bloque, resume=args.reanudar)
 
 
 if __name__ == '__main__':
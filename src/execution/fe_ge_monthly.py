@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import argparse
+import numpy as np
+import pandas as pd
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+from src.execution.fe_ge_all import get_data
+
+# Días de cada mes (año no bisiesto) para ponderar los factores mensuales al factor anual
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype='float64')
+
+# Columnas de la tabla fe_fermentacion_mes -> parámetros mensuales
+MONTHLY_COLUMNS = {
+    'temp': 'ta',
+    'leche': 'milk',
+    'peso': 'weight',
+}
+
+
+def get_monthly_data() -> pd.DataFrame:
+    """
+    Valores mensuales por perfil de fe_fermentacion (id, mes 1-12, temp y opcionalmente leche y peso)
+    :return: DataFrame
+    """
+    query = "SELECT * FROM fe_fermentacion_mes"
+    return pd.read_sql_query(query, pg_connection_str())
+
+
+def monthly_matrix(df, df_month, column) -> np.ndarray:
+    """
+    Matriz perfiles x 12 meses de una columna de la tabla mensual, alineada con el orden de df.
+    Los meses sin dato quedan como NaN
+    :param df: perfiles con la columna id
+    :param df_month: tabla mensual con id, mes y la columna
+    :param column: columna de la tabla mensual
+    :return: arreglo (perfiles, 12)
+    """
+    table = df_month.pivot_table(index='id', columns='mes', values=column, aggfunc='mean')
+    table = table.reindex(index=df['id'].values, columns=range(1, 13))
+    return table.values.astype('float64')
+
+
+def check_months(df, months, name, fill_missing=False) -> np.ndarray:
+    """
+    Valida una matriz mensual: debe tener una fila por perfil de df y 12 columnas. Los meses sin dato (NaN),
+    incluidos los perfiles que no están en la tabla mensual, son un error salvo que fill_missing lo permita
+    :param df: perfiles con la columna id
+    :param months: matriz (perfiles, 12)
+    :param name: parámetro de la matriz, para el mensaje de error
+    :param fill_missing: permite meses sin dato
+    :return: matriz (perfiles, 12) en float64
+    """
+    months = np.asarray(months, dtype='float64')
+    if months.shape != (len(df), 12):
+        raise ValueError(f'Matriz mensual de {name} con forma {months.shape}, se esperaba {(len(df), 12)}')
+    missing = np.isnan(months)
+    if missing.any() and not fill_missing:
+        ids = df['id'].values[missing.any(axis=1)]
+        raise ValueError(f'{missing.sum()} meses sin dato de {name} en {len(ids)} perfiles '
+                         f'(ids {", ".join(str(i) for i in ids[:10])}{", ..." if len(ids) > 10 else ""})')
+    return months
+
+
+def monthly_calc(df, ta_months, milk_months=None, weight_months=None, catalog=None, dtype='float64',
+                 fill_missing=False):
+    """
+    Cálculo mensual de fe y fge. Cada perfil se evalúa en los 12 meses con su temperatura mensual (y leche y
+    peso mensuales si se entregan) en un solo FeGeBatch de perfiles x 12 filas. El factor anual es el
+    promedio de los factores mensuales ponderado por los días de cada mes.
+    Las matrices se validan con check_months antes del cálculo
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param ta_months: temperatura mensual (perfiles, 12) en °C
+    :param milk_months: leche producida en cada mes (perfiles, 12) en kg. Por defecto leche anual / 365 * días
+    :param weight_months: peso en cada mes (perfiles, 12) en kg. Por defecto el peso anual
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :param dtype: precisión del cálculo
+    :param fill_missing: los meses sin dato toman el valor anual del perfil en lugar de generar un error. El
+        número de meses imputados de cada perfil queda en la columna meses_imputados
+    :return: factores anuales por perfil, factores por perfil y mes
+    """
+    catalog = catalog if catalog is not None else Catalog()
+    params = profiles_from_frame(df)
+    size = len(df)
+    block = {k: np.repeat(np.asarray(v, dtype='float64'), 12) for k, v in params.items()}
+    days = np.tile(MONTH_DAYS, size)
+    filled = np.zeros((size, 12), dtype=bool)
+    for name, months in (('ta', ta_months), ('weight', weight_months)):
+        if months is not None:
+            months = check_months(df, months, name, fill_missing)
+            filled |= np.isnan(months)
+            months = months.ravel()
+            block[name] = np.where(np.isnan(months), block[name], months)
+    if milk_months is not None:
+        milk = check_months(df, milk_months, 'milk', fill_missing)
+        filled |= np.isnan(milk)
+        # FeGe usa la leche como producción anual: la producción del mes se lleva a tasa anual
+        milk = milk.ravel() * 365 / days
+        block['milk'] = np.where(np.isnan(milk), block['milk'], milk)
+    ef = FeGeBatch(catalog=catalog, dtype=dtype, **block)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fe = ef.ef_calc().astype('float64')
+        fge = ef.ef_ge_calc().astype('float64')
+    df_month = pd.DataFrame({'id': np.repeat(df['id'].values, 12), 'mes': np.tile(np.arange(1, 13), size),
+                             'temp': block['ta'], 'fe': fe, 'fge': fge})
+    df_year = df[['id']].copy()
+    df_year['fe'] = (fe * days).reshape(size, 12).sum(axis=1) / MONTH_DAYS.sum()
+    df_year['fge'] = (fge * days).reshape(size, 12).sum(axis=1) / MONTH_DAYS.sum()
+    df_year['meses_imputados'] = filled.sum(axis=1)
+    return df_year, df_month
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Cálculo mensual de los factores de emisión de fe_fermentacion')
+    parser.add_argument('--float32', action='store_true', help='Calcula en precisión simple')
+    parser.add_argument('--imputar', action='store_true',
+                        help='Los meses sin dato en fe_fermentacion_mes toman el valor anual del perfil')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    df = get_data()
+    df_monthly = get_monthly_data()
+    matrices = {param: monthly_matrix(df, df_monthly, col) if col in df_monthly.columns else None
+                for col, param in MONTHLY_COLUMNS.items()}
+    df_year, df_month = monthly_calc(df, matrices['ta'], matrices['milk'], matrices['weight'],
+                                     dtype='float32' if args.float32 else 'float64', fill_missing=args.imputar)
+    df_year.to_sql('fe_fermentacion_anual_mes', con=pg_connection_str(), if_exists='replace', index=False,
+                   method="multi", chunksize=5000)
+    df_month.to_sql('fe_fermentacion_mensual', con=pg_connection_str(), if_exists='replace', index=False,
+                    method="multi", chunksize=5000)
+    print(df_year.describe())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import argparse
+import numpy as np
+import pandas as pd
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+from src.execution.fe_ge_all import get_data
+from src.execution.fe_validation import validate_profiles
+
+
+def get_climate() -> pd.DataFrame:
+    """
+    Temperatura media anual por municipio y año
+    :return: DataFrame cod_muni, ano, temp
+    """
+    query = "SELECT cod_muni, ano, temp FROM clima_municipio"
+    return pd.read_sql_query(query, pg_connection_str())
+
+
+def get_keys() -> pd.DataFrame:
+    """
+    Combinaciones municipio, región ganadera, animal tipo y año presentes en los datos de actividad de bovinos
+    :return: DataFrame cod_muni, id_reg, id_at, ano
+    """
+    query = """ SELECT DISTINCT cod_muni, id_reg_ganadera as id_reg, id_ani_tipo_ipcc as id_at, ano
+                FROM datos_act_bovinos_ipcc_temporal
+            """
+    return pd.read_sql_query(query, pg_connection_str())
+
+
+def municipality_profiles(df, df_keys, df_climate) -> pd.DataFrame:
+    """
+    Perfiles por municipio x animal tipo x año: el perfil regional de fe_fermentacion con la temperatura
+    del municipio. Los municipios sin temperatura conservan la temperatura regional
+    :param df: perfiles de fe_fermentacion
+    :param df_keys: combinaciones de get_keys
+    :param df_climate: temperaturas de get_climate
+    :return: perfiles con cod_muni, ano y temp_region
+    """
+    df = df.rename(columns={'temp': 'temp_region'})
+    df_mun = df_keys.merge(df, on=['id_reg', 'id_at'], how='inner')
+    df_mun = df_mun.merge(df_climate, on=['cod_muni', 'ano'], how='left')
+    df_mun['temp'] = df_mun['temp'].fillna(df_mun['temp_region'])
+    return df_mun.reset_index(drop=True)
+
+
+def municipality_calc(df_mun, catalog=None, block_rows=500000, dtype='float64') -> pd.DataFrame:
+    """
+    Cálculo en lote de fe, ym y fge por municipio. Los perfiles inválidos o con resultado no finito quedan
+    nulos para que las emisiones usen el factor regional
+    :param df_mun: perfiles de municipality_profiles
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :param block_rows: número máximo de perfiles por evaluación de FeGeBatch
+    :param dtype: precisión del cálculo
+    :return: DataFrame cod_muni, id_reg, id_at, ano, temp, fe_fermentacion_ent, ym, fe_gestion_est
+    """
+    catalog = catalog if catalog is not None else Catalog()
+    valid, _rejects = validate_profiles(df_mun, catalog)
+    res = np.full((len(df_mun), 3), np.nan)
+    params = profiles_from_frame(df_mun)
+    for start in range(0, len(df_mun), block_rows):
+        end = min(start + block_rows, len(df_mun))
+        ef = FeGeBatch(catalog=catalog, dtype=dtype, **{k: v[start:end] for k, v in params.items()})
+        with np.errstate(divide='ignore', invalid='ignore'):
+            res[start:end] = np.column_stack([ef.ef_calc(), ef.ym, ef.ef_ge_calc()])
+    res[~valid | ~np.isfinite(res).all(axis=1)] = np.nan
+    df_res = df_mun[['cod_muni', 'id_reg', 'id_at', 'ano', 'temp']].copy()
+    df_res['fe_fermentacion_ent'], df_res['ym'], df_res['fe_gestion_est'] = res.T
+    return df_res
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Cálculo de los factores de emisión por municipio')
+    parser.add_argument('--float32', action='store_true', help='Calcula en precisión simple')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    df_mun = municipality_profiles(get_data(), get_keys(), get_climate())
+    df_res = municipality_calc(df_mun, dtype='float32' if args.float32 else 'float64')
+    df_res.to_sql('fe_fermentacion_municipio', con=pg_connection_str(), if_exists='replace', index=False,
+                  method="multi", chunksize=5000)
+    print(f"salida={df_res['fe_fermentacion_ent'].notnull().sum()}")
+    print(f"regional={df_res['fe_fermentacion_ent'].isnull().sum()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.database.db_utils import pg_connection_str
+from src.database.catalog import Catalog
+from src.manure_management.manure_batch import FE_FERMENTACION_COLUMNS
+
+# Códigos de rechazo
+NAN = 'NAN'
+ID_CATALOGO = 'ID_CATALOGO'
+ANIMAL_TIPO = 'ANIMAL_TIPO'
+CATEGORIA_ANIMAL = 'CATEGORIA_ANIMAL'
+RANGO = 'RANGO'
+DENOMINADOR_CERO = 'DENOMINADOR_CERO'
+RESULTADO_NO_FINITO = 'RESULTADO_NO_FINITO'
+
+# Columnas de ids de fe_fermentacion -> tabla del catálogo
+CATALOG_IDS = {
+    'id_ca': 'categoria_animal',
+    'id_cs': 'condicion_sexual',
+    'id_pasto': 'variedad_pasto',
+    'id_suple': 'suplemento',
+    'id_coe_acti': 'coeficiente_actividad',
+    'id_cp': 'coeficiente_prenez',
+    'id_gestion_res1': 'gestion_residuos',
+    'id_gestion_res2': 'gestion_residuos',
+}
+
+# Rangos permitidos, los mismos de GrossEnergy
+RANGES = {
+    'temp': (-10.0, 50.0),
+    'por_pasto': (0.0, 100.0),
+    'por_suple': (0.0, 100.0),
+}
+
+# Valores del catálogo que aparecen como denominador: columna -> (tabla, columna del catálogo, animales tipo)
+DENOMINATORS = {
+    'ebf': ('id_pasto', 'variedad_pasto', 'energia_bruta_pasto', None),
+    'ebs': ('id_suple', 'suplemento', 'energia_bruta_pasto', None),
+    'enmf': ('id_pasto', 'variedad_pasto', 'enm_rumiantes', [2, 3, 5, 6, 7]),
+    'fcs': ('id_cs', 'condicion_sexual', 'coe_cond_sexual', [5, 6, 7]),
+}
+
+
+def rejects_frame(df, mask, code, column, detail) -> pd.DataFrame:
+    """
+    Filas rechazadas por una regla
+    :param df: perfiles
+    :param mask: arreglo booleano de filas rechazadas
+    :param code: código de rechazo
+    :param column: columna evaluada
+    :param detail: descripción de la regla
+    :return: DataFrame id, codigo, columna, valor, detalle
+    """
+    rows = df.loc[mask]
+    return pd.DataFrame({'id': rows['id'].values if 'id' in rows.columns else rows.index.values,
+                         'codigo': code,
+                         'columna': column,
+                         'valor': rows[column].values if column in rows.columns else np.nan,
+                         'detalle': detail})
+
+
+def validate_profiles(df, catalog=None):
+    """
+    Validación vectorizada de los perfiles de fe_fermentacion antes del cálculo. Reemplaza las excepciones
+    por fila de masive_calc y los assert de GrossEnergy por códigos de rechazo
+    :param df: perfiles con la estructura de fe_fermentacion
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :return: arreglo booleano de filas válidas, DataFrame de rechazos (una fila por perfil y motivo)
+    """
+    catalog = catalog if catalog is not None else Catalog()
+    checks = []
+    valid = np.ones(len(df), dtype=bool)
+
+    def check(mask, code, column, detail):
+        valid[mask] = False
+        checks.append(rejects_frame(df, mask, code, column, detail))
+
+    for col in FE_FERMENTACION_COLUMNS:
+        mask = df[col].isnull().values
+        check(mask, NAN, col, 'Valor faltante')
+    for col, table in CATALOG_IDS.items():
+        ids = df[col].values.astype('float64')
+        mask = ~np.isnan(ids) & ~catalog.has(table, ids)
+        check(mask, ID_CATALOGO, col, f'Id inexistente en {table}')
+    at_id = df['id_at'].values.astype('float64')
+    mask = ~np.isnan(at_id) & ~np.isin(at_id, [1, 2, 3, 4, 5, 6, 7])
+    check(mask, ANIMAL_TIPO, 'id_at', 'Animal tipo fuera del rango 1-7')
+    mask = (at_id == 1) & (df['id_ca'].values != 1)
+    check(mask, CATEGORIA_ANIMAL, 'id_ca', 'La categoria animal debe ser Bos Taurus')
+    for col, (low, high) in RANGES.items():
+        values = df[col].values.astype('float64')
+        with np.errstate(invalid='ignore'):
+            mask = (values < low) | (values > high)
+        check(mask, RANGO, col, f'Fuera del rango permitido [{low}, {high}]')
+    for name, (col, table, column, at_ids) in DENOMINATORS.items():
+        values = catalog.lookup(table, column, df[col].values)
+        mask = values == 0
+        if at_ids is not None:
+            mask &= np.isin(at_id, at_ids)
+        check(mask, DENOMINADOR_CERO, col, f'{name} = 0 en {table}')
+    edr_f = catalog.lookup('variedad_pasto', 'ed_rumiantes', df['id_pasto'].values)
+    edr_s = catalog.lookup('suplemento', 'edt_rumiantes', df['id_suple'].values)
+    mask = (edr_f * df['por_pasto'].values + edr_s * df['por_suple'].values) == 0
+    check(mask, DENOMINADOR_CERO, 'por_pasto', 'Digestibilidad de la dieta (dep) = 0')
+    mask = df['adult_peso'].values.astype('float64') == 0
+    check(mask, DENOMINADOR_CERO, 'adult_peso', 'Peso adulto = 0')
+    return valid, pd.concat(checks, ignore_index=True)
+
+
+def main():
+    df = pd.read_sql_query("SELECT * FROM fe_fermentacion", con=pg_connection_str())
+    valid, rejects = validate_profiles(df)
+    print(rejects)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+
+from src.database.db_utils import pg_connection_str, pg_connection
+from src.execution import projected_emissions
+
+# Cohortes en el orden de id_ani_tipo_ipcc (ver GrossEnergy.energy_selection): vacas de alta producción, vacas de
+# baja producción, vacas para carne, toros reproductores, terneros pre-destete, terneras de reemplazo, engorde
+COHORTS = [1, 2, 3, 4, 5, 6, 7]
+COWS = [0, 1, 2]
+BULLS, CALVES, HEIFERS, FATTENING = 3, 4, 5, 6
+
+# Tasas anuales por región ganadera: natalidad (terneros por vaca), mortalidad, extracción (sacrificio, venta y
+# descarte), destino de los terneros destetados (reemplazo, toros; el resto va a engorde) e incorporación de las
+# terneras de reemplazo al hato de vacas. Valores de referencia para las regiones sin fila en RATES_TABLE
+DEFAULT_RATES = {
+    'natalidad': 0.55,
+    'mortalidad_terneros': 0.08,
+    'mortalidad_adultos': 0.03,
+    'extraccion_vacas': 0.15,
+    'extraccion_toros': 0.20,
+    'extraccion_engorde': 0.45,
+    'reemplazo': 0.30,
+    'toros': 0.02,
+    'incorporacion': 0.40,
+}
+
+# Tabla opcional con las tasas por región: id_reg_ganadera y cualquier subconjunto de DEFAULT_RATES
+RATES_TABLE = 'tasas_poblacion_bovinos'
+
+HISTORY_TABLE = 'datos_act_bovinos_ipcc_temporal'
+PROJECTED_TABLE = 'datos_act_bovinos_ipcc_proyectados'
+
+# Unidad de proyección: municipio dentro de una región ganadera
+UNIT_KEYS = ['cod_depto', 'cod_muni', 'id_reg_ganadera']
+
+
+def get_history() -> pd.DataFrame:
+    """
+    Serie histórica de bovinos por municipio, región ganadera, año y animal tipo
+    :return: DataFrame cod_depto, cod_muni, id_reg_ganadera, ano, id_ani_tipo_ipcc, numero
+    """
+    query = f""" SELECT cod_depto, cod_muni, id_reg_ganadera, ano, id_ani_tipo_ipcc, SUM(numero) as numero
+                 FROM {HISTORY_TABLE}
+                 WHERE id_ani_tipo_ipcc IN ({', '.join(str(at) for at in COHORTS)})
+                 GROUP BY cod_depto, cod_muni, id_reg_ganadera, ano, id_ani_tipo_ipcc
+             """
+    return pd.read_sql_query(query, con=pg_connection_str())
+
+
+def get_rates() -> pd.DataFrame:
+    """
+    Tasas por región de RATES_TABLE. Si la tabla no existe se retorna vacía
+    :return: DataFrame id_reg_ganadera y columnas de DEFAULT_RATES
+    """
+    conn_ = pg_connection()
+    with conn_ as connection:
+        cur = connection.cursor()
+        cur.execute(f"SELECT to_regclass('{RATES_TABLE}')")
+        exists = cur.fetchall()[0][0] is not None
+    conn_.close()
+    if not exists:
+        return pd.DataFrame(columns=['id_reg_ganadera'])
+    return pd.read_sql(RATES_TABLE, con=pg_connection_str())
+
+
+def cohort_matrix(df_hist):
+    """
+    Matriz unidades x años x cohortes de la serie histórica
+    :param df_hist: serie de get_history
+    :return: DataFrame de unidades (UNIT_KEYS), años, arreglo (unidades, años, cohortes)
+    """
+    units = df_hist[UNIT_KEYS].drop_duplicates().sort_values(by=UNIT_KEYS).reset_index(drop=True)
+    years = np.sort(df_hist['ano'].unique())
+    unit_pos = df_hist[UNIT_KEYS].merge(units.reset_index(), on=UNIT_KEYS, how='left')['index'].values
+    year_pos = np.searchsorted(years, df_hist['ano'].values)
+    cohort_pos = np.searchsorted(COHORTS, df_hist['id_ani_tipo_ipcc'].values)
+    flat = (unit_pos * len(years) + year_pos) * len(COHORTS) + cohort_pos
+    herd = np.bincount(flat, weights=df_hist['numero'].values.astype('float64'),
+                       minlength=len(units) * len(years) * len(COHORTS))
+    return units, years, herd.reshape(len(units), len(years), len(COHORTS))
+
+
+def observed_growth(units, years, herd) -> pd.Series:
+    """
+    Crecimiento anual observado del hato por región: exponencial de la pendiente del ajuste lineal del logaritmo
+    del total de bovinos contra el año
+    :param units: unidades de cohort_matrix
+    :param years: años de cohort_matrix
+    :param herd: arreglo (unidades, años, cohortes)
+    :return: tasa de crecimiento (total del año siguiente / total del año) por id_reg_ganadera, solo regiones con
+             al menos dos años con bovinos
+    """
+    regions, reg_pos = np.unique(units['id_reg_ganadera'].values, return_inverse=True)
+    totals = np.zeros((len(regions), len(years)))
+    np.add.at(totals, reg_pos, herd.sum(axis=2))
+    growth = pd.Series(np.nan, index=regions)
+    for r in range(len(regions)):
+        valid = totals[r] > 0
+        if valid.sum() >= 2:
+            growth.iloc[r] = np.exp(np.polyfit(years[valid].astype('float64'), np.log(totals[r, valid]), 1)[0])
+    return growth.dropna()
+
+
+def dominant_eigenvalue(matrix) -> np.ndarray:
+    """
+    Tasa de crecimiento asintótica de cada matriz de transición
+    :param matrix: arreglo (n, cohortes, cohortes)
+    :return: arreglo (n)
+    """
+    return np.abs(np.linalg.eigvals(matrix)).max(axis=1)
+
+
+def calibrated_births(rates, growth, low=0.0, high=3.0, iterations=60) -> np.ndarray:
+    """
+    Natalidad que hace que la matriz de transición reproduzca el crecimiento observado (su valor propio dominante
+    es el crecimiento), por bisección con las demás tasas fijas. La tasa de crecimiento no depende de la
+    composición de vacas porque las tres cohortes de vacas tienen las mismas tasas
+    :param rates: diccionario tasa -> arreglo con las demás tasas de cada región
+    :param growth: crecimiento observado por región
+    :param low: natalidad mínima
+    :param high: natalidad máxima
+    :param iterations: iteraciones de la bisección
+    :return: natalidad por región, recortada a [low, high] si el crecimiento no se alcanza en ese rango
+    """
+    growth = np.asarray(growth, dtype='float64')
+    shares = np.tile([0.0, 0.0, 1.0], (len(growth), 1))
+    low = np.full(len(growth), low)
+    high = np.full(len(growth), high)
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        above = dominant_eigenvalue(transition_matrices(dict(rates, natalidad=mid), shares)) > growth
+        high = np.where(above, mid, high)
+        low = np.where(above, low, mid)
+    return (low + high) / 2
+
+
+def region_births(units, years, herd, df_rates) -> pd.Series:
+    """
+    Natalidad calibrada por región para las regiones sin natalidad en RATES_TABLE. La natalidad de la serie
+    histórica (terneros pre-destete por vaca en el censo) es un inventario y no una tasa anual, por lo que se
+    calibra con el crecimiento observado de cada región
+    :param units: unidades de cohort_matrix
+    :param years: años de cohort_matrix
+    :param herd: arreglo (unidades, años, cohortes)
+    :param df_rates: tasas de get_rates
+    :return: natalidad por id_reg_ganadera
+    """
+    growth = observed_growth(units, years, herd)
+    regions = pd.DataFrame({'id_reg_ganadera': growth.index.values})
+    rates = unit_rates(regions, df_rates)
+    return pd.Series(calibrated_births(rates, growth.values), index=growth.index)
+
+
+def unit_rates(units, df_rates, births=None) -> dict:
+    """
+    Tasas por unidad: RATES_TABLE, luego la natalidad calibrada con la serie histórica y por último DEFAULT_RATES
+    :param units: unidades con id_reg_ganadera
+    :param df_rates: tasas de get_rates
+    :param births: natalidad por región de region_births
+    :return: diccionario tasa -> arreglo (unidades)
+    """
+    df = units[['id_reg_ganadera']].merge(df_rates, on='id_reg_ganadera', how='left')
+    rates = {}
+    for name, default in DEFAULT_RATES.items():
+        values = df[name].values.astype('float64') if name in df.columns else np.full(len(units), np.nan)
+        if name == 'natalidad' and births is not None:
+            values = np.where(np.isnan(values), units['id_reg_ganadera'].map(births).values, values)
+        rates[name] = np.where(np.isnan(values), default, values)
+    return rates
+
+
+def transition_matrices(rates, cow_shares) -> np.ndarray:
+    """
+    Matriz de transición anual de cohortes por unidad (destino x origen). Las vacas y los toros que sobreviven y
+    no se extraen permanecen; las vacas paren terneros; los terneros sobrevivientes pasan a reemplazo, toros o
+    engorde; las terneras de reemplazo se incorporan a las vacas según la composición de vacas de la unidad
+    :param rates: tasas por unidad de unit_rates
+    :param cow_shares: arreglo (unidades, 3) con la fracción de vacas de alta, baja producción y carne
+    :return: arreglo (unidades, cohortes, cohortes)
+    """
+    n = len(cow_shares)
+    adult = 1 - rates['mortalidad_adultos']
+    calf = 1 - rates['mortalidad_terneros']
+    matrix = np.zeros((n, len(COHORTS), len(COHORTS)))
+    for cow in COWS:
+        matrix[:, cow, cow] = adult * (1 - rates['extraccion_vacas'])
+        matrix[:, CALVES, cow] = rates['natalidad']
+        matrix[:, cow, HEIFERS] = adult * rates['incorporacion'] * cow_shares[:, cow]
+    matrix[:, BULLS, BULLS] = adult * (1 - rates['extraccion_toros'])
+    matrix[:, BULLS, CALVES] = calf * rates['toros']
+    matrix[:, HEIFERS, CALVES] = calf * rates['reemplazo']
+    matrix[:, FATTENING, CALVES] = calf * (1 - rates['reemplazo'] - rates['toros'])
+    matrix[:, HEIFERS, HEIFERS] = adult * (1 - rates['incorporacion'])
+    matrix[:, FATTENING, FATTENING] = adult * (1 - rates['extraccion_engorde'])
+    return matrix
+
+
+def project(herd0, matrix, years) -> np.ndarray:
+    """
+    Proyección de todas las unidades a la vez: un producto matricial por lote por año
+    :param herd0: arreglo (unidades, cohortes) del año base
+    :param matrix: arreglo (unidades, cohortes, cohortes) de transition_matrices
+    :param years: años a proyectar
+    :return: arreglo (unidades, años, cohortes)
+    """
+    res = np.empty((herd0.shape[0], years, herd0.shape[1]))
+    herd = herd0[:, :, None]
+    for year in range(years):
+        herd = np.matmul(matrix, herd)
+        res[:, year] = herd[:, :, 0]
+    return res
+
+
+def projection_calc(df_hist, df_rates=None, years=30) -> pd.DataFrame:
+    """
+    Proyección del hato bovino por municipio desde el último año de la serie histórica
+    :param df_hist: serie de get_history
+    :param df_rates: tasas de get_rates. Si no se entrega se usan la natalidad calibrada y DEFAULT_RATES
+    :param years: años a proyectar
+    :return: DataFrame cod_depto, cod_muni, id_reg_ganadera, ano, id_ani_tipo_ipcc, numero
+    """
+    units, hist_years, herd = cohort_matrix(df_hist)
+    df_rates = df_rates if df_rates is not None else pd.DataFrame(columns=['id_reg_ganadera'])
+    rates = unit_rates(units, df_rates, region_births(units, hist_years, herd, df_rates))
+    herd0 = herd[:, -1]
+    cows = herd0[:, COWS].sum(axis=1, keepdims=True)
+    # sin vacas en el año base las terneras se incorporan como vacas para carne
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cow_shares = np.where(cows > 0, herd0[:, COWS] / cows, [0.0, 0.0, 1.0])
+    res = project(herd0, transition_matrices(rates, cow_shares), years)
+    n_units, n_cohorts = len(units), len(COHORTS)
+    df = units.loc[np.repeat(np.arange(n_units), years * n_cohorts)].reset_index(drop=True)
+    df['ano'] = np.tile(np.repeat(hist_years[-1] + np.arange(1, years + 1), n_cohorts), n_units)
+    df['id_ani_tipo_ipcc'] = np.tile(COHORTS, n_units * years)
+    df['numero'] = res.ravel()
+    return df
+
+
+def backtest(df_hist, df_rates=None, years=5) -> pd.DataFrame:
+    """
+    Validación retrospectiva: calibra y proyecta desde el año anterior a los últimos años históricos y compara el
+    total de bovinos por región con el observado
+    :param df_hist: serie de get_history
+    :param df_rates: tasas de get_rates
+    :param years: últimos años históricos que se proyectan
+    :return: DataFrame id_reg_ganadera, ano, observado, proyectado, error_rel
+    """
+    hist_years = np.sort(df_hist['ano'].unique())
+    cutoff = hist_years[-years - 1]
+    df_proj = projection_calc(df_hist[df_hist['ano'] <= cutoff], df_rates, years)
+    keys = ['id_reg_ganadera', 'ano']
+    observed = df_hist[df_hist['ano'] > cutoff].groupby(keys)['numero'].sum().rename('observado')
+    projected = df_proj.groupby(keys)['numero'].sum().rename('proyectado')
+    df = pd.concat([observed, projected], axis=1).fillna(0.0).reset_index()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['error_rel'] = (df['proyectado'] - df['observado']) / df['observado']
+    return df
+
+
+def write_projection(df, table=PROJECTED_TABLE) -> None:
+    """
+    Reemplaza las filas de bovinos proyectadas de los años calculados; las otras especies no se modifican.
+    El borrado y la escritura se hacen en una sola transacción, de modo que una falla no deja los años sin filas.
+    Los ids los asigna la secuencia de la columna id de la tabla. Las filas nuevas quedan con emision_fe y
+    emision_ge nulas hasta que se calculan sus emisiones (ver projection_emissions)
+    :param df: proyección de projection_calc
+    :param table: tabla de datos de actividad proyectados
+    """
+    engine = create_engine(pg_connection_str())
+    with engine.begin() as connection:
+        connection.execute(text(f"""DELETE FROM {table}
+                                    WHERE id_ani_tipo_ipcc IN ({', '.join(str(at) for at in COHORTS)})
+                                    AND ano BETWEEN {int(df['ano'].min())} AND {int(df['ano'].max())}"""))
+        df.to_sql(table, con=connection, if_exists='append', index=False, method="multi", chunksize=5000)
+    engine.dispose()
+
+
+def projection_emissions(df) -> None:
+    """
+    Emisiones de las filas escritas por write_projection con los factores de fe_fermentacion_temporal
+    (projected_emissions sobre los pares región ganadera, animal tipo de la proyección)
+    :param df: proyección de projection_calc
+    """
+    keys = df[['id_reg_ganadera', 'id_ani_tipo_ipcc']].drop_duplicates()
+    projected_emissions.calculation(keys=list(keys.itertuples(index=False, name=None)), pushdown=True)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Proyeccion del hato bovino con un modelo matricial de cohortes')
+    parser.add_argument('--anos', type=int, default=30, help='Años a proyectar desde el ultimo año historico')
+    parser.add_argument('--tabla', type=str, default=PROJECTED_TABLE, help='Tabla de salida')
+    parser.add_argument('--validacion', type=int, default=0,
+                        help='Solo compara la proyeccion de los ultimos N años historicos con lo observado')
+    parser.add_argument('--sin_emisiones', action='store_true',
+                        help='No calcula las emisiones de las filas proyectadas (quedan nulas)')
+    return parser.parse_args()
+
+
+def main():
+    args = create_parser()
+    if args.validacion:
+        df = backtest(get_history(), get_rates(), args.validacion)
+        print(df.to_string(index=False))
+        print(f"error relativo medio absoluto={df['error_rel'].abs().mean():.4f}")
+        return
+    df = projection_calc(get_history(), get_rates(), args.anos)
+    write_projection(df, args.tabla)
+    # projected_emissions solo actualiza la tabla de proyección por defecto
+    if args.tabla == PROJECTED_TABLE and not args.sin_emisiones:
+        projection_emissions(df)
+    print(df.groupby(['ano', 'id_ani_tipo_ipcc'])['numero'].sum().unstack().round(0))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,32 +2,74 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import argparse
 import pandas as pd
 sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
 
 from src.database.db_utils import pg_connection_str, pg_connection
+from src.execution.emissions import keys_filter, pushdown_update, parity_check, changed_rows
+from src.database.other_species import refresh_other_factors, OTHER_FACTORS_TABLE
 
 
-def get_act_data():
-    query = """ SELECT DA.id, ano as año, id_reg_ganadera, id_ani_tipo_ipcc, numero,
+def bovine_query(keys=None) -> str:
+    """
+    Consulta de los datos de actividad proyectados de bovinos con sus factores de fe_fermentacion_temporal
+    :param keys: lista de pares (id_reg, id_at)
+    :return: consulta SQL
+    """
+    query = """ SELECT DA.id, ano as año, id_reg_ganadera, id_ani_tipo_ipcc, numero, emision_fe, emision_ge,
                 FE.fe_fermentacion_ent as fe, FE.fe_gestion_est as gen
                 FROM datos_act_bovinos_ipcc_proyectados as DA
                 INNER JOIN fe_fermentacion_temporal as FE ON FE.id_reg = DA.id_reg_ganadera AND 
                 FE.id_at = DA.id_ani_tipo_ipcc
             """
-    df_bovinos = pd.read_sql_query(query, con=pg_connection_str())
-    query_2 = "SELECT DA.id, DA.ano as año, DA.id_reg_ganadera, DA.id_ani_tipo_ipcc, DA.numero," \
-              "V.fe, V.gen FROM datos_act_bovinos_ipcc_proyectados as DA " \
-              "INNER JOIN (select id_animal_tipo_ipcc,  AVG(fe_ch4_fermentacin_enterica) as fe, " \
-              "avg(fe_ch4_gestion_estiercol) as gen from fe_otras_especies group by (id_animal_tipo_ipcc)) as V " \
-              "on V.id_animal_tipo_ipcc = DA.id_ani_tipo_ipcc "
-    df_others = pd.read_sql_query(query_2, con=pg_connection_str())
+    if keys is not None:
+        query = query + keys_filter(keys)
+    return query
+
+
+def others_query() -> str:
+    """
+    Consulta de los datos de actividad proyectados de otras especies con el promedio precalculado de
+    fe_otras_especies (ver refresh_other_factors)
+    :return: consulta SQL
+    """
+    return "SELECT DA.id, DA.ano as año, DA.id_reg_ganadera, DA.id_ani_tipo_ipcc, DA.numero, DA.emision_fe, " \
+           "DA.emision_ge, V.fe, V.gen FROM datos_act_bovinos_ipcc_proyectados as DA " \
+           f"INNER JOIN {OTHER_FACTORS_TABLE} as V on V.id_animal_tipo_ipcc = DA.id_ani_tipo_ipcc "
+
+
+def get_act_data(keys=None):
+    """
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se leen las filas de bovinos que usan esos
+                 factores (las otras especies no dependen de fe_fermentacion_temporal)
+    """
+    if keys is not None:
+        df_bovinos = pd.read_sql_query(bovine_query(keys), con=pg_connection_str())
+        return df_bovinos.sort_values(by=['id'])
+    df_bovinos = pd.read_sql_query(bovine_query(), con=pg_connection_str())
+    refresh_other_factors()
+    df_others = pd.read_sql_query(others_query(), con=pg_connection_str())
     df = pd.concat([df_bovinos, df_others], ignore_index=True)
     df = df.sort_values(by=['id'])
     return df
 
 
-def update_db(df) -> None:
+def update_db(df, previous=None, rtol=1e-9) -> int:
+    """
+    Escritura masiva de emision_fe y emision_ge. Si se entregan los valores leídos antes del cálculo solo se
+    envían las filas que cambiaron (ver emissions.update_db)
+    :param df: id, emision_fe, emision_ge
+    :param previous: id, emision_fe, emision_ge guardados
+    :param rtol: tolerancia relativa de la comparación
+    :return: filas escritas
+    """
+    if previous is not None:
+        changed = changed_rows(df, previous, ['emision_fe', 'emision_ge'], rtol)
+        print(f"datos_act_bovinos_ipcc_proyectados: cambiadas={changed.sum()} sin_cambio={(~changed).sum()}")
+        df = df[changed]
+        if df.empty:
+            return 0
     df = df.where(pd.notnull(df), 'nan')
     zipped = zip(df.id, df.emision_fe, df.emision_ge)
     tp_to_str = str(tuple(zipped))
@@ -41,17 +83,46 @@ def update_db(df) -> None:
         cur = connection.cursor()
         cur.execute(query_)
     conn_.close()
+    return len(df)
+
+
+def calculation(keys=None, pushdown=False, check=False):
+    """
+    Cálculo de las emisiones de datos_act_bovinos_ipcc_proyectados
+    :param keys: lista de pares (id_reg, id_at). Si se entrega solo se actualizan las filas de bovinos que usan
+                 esos factores
+    :param pushdown: calcula con UPDATE ... FROM dentro de Postgres en lugar de pandas
+    :param check: después del cálculo compara las emisiones guardadas con el cálculo de pandas
+    :return: resultado de la comparación si check, None en otro caso
+    """
+    if pushdown:
+        pushdown_update('datos_act_bovinos_ipcc_proyectados', bovine_query(keys))
+        if keys is None:
+            refresh_other_factors()
+            pushdown_update('datos_act_bovinos_ipcc_proyectados', others_query())
+    else:
+        df = get_act_data(keys=keys)
+        if df.empty:
+            return
+        previous = df[['id', 'emision_fe', 'emision_ge']].copy()
+        df['emision_ge'] = df.gen * df.numero / 1000000.0
+        df['emision_fe'] = df.fe * df.numero / 1000000.0
+        update_db(df, previous)
+    if check:
+        return parity_check(get_act_data(keys=keys))
 
 
-def calculation():
-    df = get_act_data()
-    df['emision_ge'] = df.gen * df.numero / 1000000.0
-    df['emision_fe'] = df.fe * df.numero / 1000000.0
-    update_db(df)
+def create_parser():
+    parser = argparse.ArgumentParser(description='Cálculo de las emisiones proyectadas')
+    parser.add_argument('--sql', action='store_true', help='Calcula las emisiones dentro de la base de datos')
+    parser.add_argument('--verificar', action='store_true',
+                        help='Compara las emisiones guardadas con el calculo de pandas')
+    return parser.parse_args()
 
 
 def main():
-    calculation()
+    args = create_parser()
+    calculation(pushdown=args.sql, check=args.verificar)
 
 
 if __name__ == '__main__':
@@ -5,6 +5,11 @@ import os
 sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
 from src.database.db_utils import pg_connection_str
 
+# Unidad de los reportes de deforestacion_resultado: (id_type, id_report) de emisiones en t CO2, los demás en ha
+EMISSION_REPORTS = [(id_type, id_report) for id_type in (2, 3) for id_report in (3, 4, 5, 6)]
+EMISSION_UNIT = 't CO2'
+AREA_UNIT = 'ha'
+
 
 def get_query_da(id_bioma=None, year=None):
     query = """ SELECT id_bioma
@@ -131,6 +136,7 @@ def deforestacion(id_bioma=None, year=None, id_type=1, id_report=1):
     cols = list(df_res.columns)
     cols = [cols[-1]] + cols[:-1]
     df_res = df_res[cols]
+    df_res.insert(2, 'unidad', EMISSION_UNIT if (id_type, id_report) in EMISSION_REPORTS else AREA_UNIT)
     df_res.to_sql('deforestacion_resultado', con=pg_connection_str(), if_exists='replace', index=False,
                   method="multi", chunksize=5000)
     print('Done!')
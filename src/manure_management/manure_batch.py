@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../../'))}")
+from src.enteric_fermentation.emission_factor_batch import FactorEFBatch
+
+# Columnas de fe_fermentacion -> parámetros de FeGe
+FE_FERMENTACION_COLUMNS = {
+    'id_at': 'at_id',
+    'id_ca': 'ca_id',
+    'id_coe_acti': 'coe_act_id',
+    'temp': 'ta',
+    'por_pasto': 'pf',
+    'por_suple': 'ps',
+    'id_suple': 'vs_id',
+    'id_pasto': 'vp_id',
+    'peso': 'weight',
+    'adult_peso': 'adult_w',
+    'id_cp': 'cp_id',
+    'gn_peso': 'gan',
+    'leche': 'milk',
+    'grasa': 'grease',
+    'ht': 'ht',
+    'id_cs': 'cs_id',
+    'id_prod_metano': 'sp_id',
+    'id_gestion_est1': 'sgea_id',
+    'id_gestion_res1': 'sgra_id',
+    'por_gestion1': 'p_sga',
+    'id_gestion_est2': 'sgeb_id',
+    'id_gestion_res2': 'sgrb_id',
+    'por_gestion2': 'p_sgb',
+}
+
+# Salidas de ef_execution en el mismo orden
+RESULT_COLUMNS = ['fe', 'ceb', 'cms', 'cf', 'cc', 'cpms', 'ccms', 'dpcms', 'ym', 'fge']
+
+
+def profiles_from_frame(df) -> dict:
+    """
+    Parámetros de FeGeBatch a partir de una tabla con la estructura de fe_fermentacion
+    :param df: DataFrame con las columnas de fe_fermentacion
+    :return: diccionario parámetro -> arreglo
+    """
+    return {param: df[col].values for col, param in FE_FERMENTACION_COLUMNS.items()}
+
+
+def manure_systems(profile, sge_id, sgr_id, share) -> dict:
+    """
+    Sistemas de gestión de estiércol por perfil en formato disperso (COO): una entrada por perfil y sistema
+    :param profile: posición del perfil en el lote
+    :param sge_id: sistema de gestión de estiércol (MCF)
+    :param sgr_id: sistema de gestión de residuos (AWMS)
+    :param share: porcentaje del estiércol manejado en el sistema (%)
+    :return: diccionario row, sge, sgr, share
+    """
+    row, sge, sgr, share = np.broadcast_arrays(np.asarray(profile, dtype='int64'), np.asarray(sge_id, dtype='float64'),
+                                               np.asarray(sgr_id, dtype='float64'),
+                                               np.asarray(share, dtype='float64'))
+    return {'row': row.ravel(), 'sge': sge.ravel(), 'sgr': sgr.ravel(), 'share': share.ravel()}
+
+
+def mcf_values(sge_id, ta, dtype='float64') -> np.ndarray:
+    """
+    Factores de conversión de metano (MCF) por sistema de gestión de estiércol y temperatura
+    :param sge_id: arreglo de sistemas de gestión de estiércol
+    :param ta: arreglo de temperaturas
+    :param dtype: tipo de los valores constantes
+    :return: MCF
+    """
+    sge_id, ta = np.broadcast_arrays(np.asarray(sge_id), np.asarray(ta))
+    return np.select(
+        [sge_id == 1, sge_id == 2, sge_id == 3, sge_id == 4, sge_id == 5, sge_id == 6],
+        [80.38 * 1 * (1 - np.exp(-0.17 * ta)),
+         np.where(ta <= 27.0, 7.09 * np.exp(0.089 * ta), 80.0),
+         np.where(ta > 0.0, 5.03 / (1 + 140.65 * np.exp(-0.33 * ta)), 0.0),
+         np.select([(0.0 < ta) & (ta < 30.0), ta >= 30], [-0.82 + (0.19 * ta) + (-0.0032 * (ta ** 2)), 2.0],
+                   0.0),
+         np.full(ta.shape, 0.47, dtype=dtype),
+         np.select([(9.0 < ta) & (ta < 30.0), ta >= 30.0], [-1.023 + (0.134 * ta) + (-0.0022 * (ta ** 2)), 1.0],
+                   0.0)],
+        10.0)
+
+
+class FeGeBatch(FactorEFBatch):
+    def __init__(self, sp_id=1, sgea_id=1, sgra_id=2, p_sga=20, sgeb_id=2, sgrb_id=3, p_sgb=80, **kwargs):
+        """
+        Versión vectorizada de FeGe. Los valores de produccion_metano (sap, sbp) y gestion_residuos
+        (awms_a, awms_b) también pueden entregarse en kwargs.
+        En lugar de los dos sistemas A y B, kwargs puede traer cualquier número de sistemas por perfil
+        (manure, ver manure_systems); mcfp y awmsp son entonces sumas ponderadas sobre las entradas dispersas
+        :param kwargs: parámetros de FactorEFBatch
+        """
+        super().__init__(**kwargs)
+        self.sp_id, self.sgea_id, self.sgra_id, self.p_sga, self.sgeb_id, self.sgrb_id, self.p_sgb = \
+            self._arrays(sp_id, sgea_id, sgra_id, p_sga, sgeb_id, sgrb_id, p_sgb, self.at_id)[:-1]
+        self.pm_id = np.where(self.at_id == 1, 1, 2)
+        self.sap = self.catalog_value('sap', 'produccion_metano', 'bovino_alta_prod', self.pm_id)
+        self.sbp = self.catalog_value('sbp', 'produccion_metano', 'bovino_otras', self.pm_id)
+        self.awms_a = self.awms_sel('awms_a', self.sgra_id)
+        self.awms_b = self.awms_sel('awms_b', self.sgrb_id)
+        self.manure: dict = self.manure_calc()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.pcp = self.pcp_calc()
+            self.eu = self.eu_calc()
+            self.cen_p = self.cen_p_calc()
+            self.sv = self.sv_calc()
+            self.bo = self.bo_calc()
+            self.mcfp = self.mcfp_calc()
+            self.awmsp = self.awmsp_calc()
+
+    def manure_calc(self):
+        """
+        Entradas dispersas perfil x sistema con el AWMS de cada entrada. Sin manure en kwargs son los
+        sistemas A y B de cada perfil
+        :return: diccionario row, sge, sgr, share, awms
+        """
+        if self.kwargs.get('manure') is None:
+            rows = np.arange(self.size)
+            manure = manure_systems(np.concatenate([rows, rows]), np.concatenate([self.sgea_id, self.sgeb_id]),
+                                    np.concatenate([self.sgra_id, self.sgrb_id]),
+                                    np.concatenate([self.p_sga, self.p_sgb]))
+            manure['awms'] = np.concatenate([self.awms_a, self.awms_b])
+        else:
+            manure = dict(self.kwargs['manure'])
+            at_id = self.at_id[manure['row']]
+            manure['awms'] = np.where(at_id == 1, self.catalog.lookup('gestion_residuos', 'alta_prod', manure['sgr']),
+                                      self.catalog.lookup('gestion_residuos', 'otras', manure['sgr']))
+        for name in ('sge', 'share', 'awms'):
+            manure[name] = np.asarray(manure[name], dtype=self.dtype)
+        return manure
+
+    def manure_weighted(self, values):
+        """
+        Suma por perfil de los valores de las entradas dispersas ponderados por su porcentaje
+        :param values: valor por entrada
+        :return: arreglo por perfil
+        """
+        weights = values * self.manure['share'] / 100
+        return np.bincount(self.manure['row'], weights=weights, minlength=self.size).astype(self.dtype)
+
+    def awms_sel(self, name, awms_id):
+        """
+        Seleccion de promedios para América latina de la fracción del estiércol del ganado manejado usando
+        un determinado sistema de manejo de los desechos animales (AWMS), (IPCC, 2019)
+        :param name: atributo que puede entregarse en kwargs (awms_a, awms_b)
+        :param awms_id: arreglo de sistemas de gestión de residuos
+        :return: awms por sistema de gestion de estiercol
+        """
+        if name in self.kwargs:
+            return self._arrays(self.kwargs[name], awms_id)[0]
+        return np.where(self.at_id == 1, self.catalog.lookup('gestion_residuos', 'alta_prod', awms_id),
+                        self.catalog.lookup('gestion_residuos', 'otras', awms_id)).astype(self.dtype)
+
+    def ef_ge_calc(self):
+        """
+        Estimación del factor de emisión de CH4 por la gestión del estiércol bovino
+        :return:
+        """
+        return (self.sv * 365) * (self.bo * 0.67 * (self.mcfp / 100) * self.awmsp)
+
+    def sv_calc(self):
+        """
+        Sólidos volátiles excretados por día, kg materia seca animal-1 día-1
+        :return:
+        """
+        return (self.tge * (1 - (self.dep / 100)) + self.eu) * ((1 - (self.cen_p / 100)) / 18.45)
+
+    def cen_p_calc(self):
+        """
+        Ceniza ponderada (%).
+        :return:
+        """
+        if self.diet is not None:
+            return self.diet_values['cen']
+        return self.cen_f * self.pf / 100 + self.cen_s * self.ps / 100
+
+    def eu_calc(self):
+        """
+        Energía urinaria
+        :return:
+        """
+        return -2.71 + 0.028 * (10 * self.pcp) + 0.589 * self.cms
+
+    def bo_calc(self):
+        """
+        Capacidad máxima de producción de metano del estiércol producido por el ganado
+        :return:m 3 CH4 kg -1 de VS excretados
+        """
+        return np.where(self.sp_id == 1, self.sap, self.sbp)
+
+    def mcf_calc(self, sge_id, ta=None):
+        """
+        Factores de conversión de metano para sistemas de gestión de estiércol (MCF)
+        :param sge_id: arreglo de sistemas de gestión de estiércol
+        :param ta: temperatura de cada sistema. Por defecto la del perfil
+        :return: MCF
+        """
+        return mcf_values(sge_id, self.ta if ta is None else ta, self.dtype)
+
+    def mcfp_calc(self):
+        """
+        Factores de conversión de metano ponderado (%).
+        :return:
+        """
+        mcf = self.mcf_calc(self.manure['sge'], self.ta[self.manure['row']])
+        return self.manure_weighted(mcf) / 100
+
+    def pcp_calc(self):
+        """
+        Proteína cruda ponderada (%).
+        :return:
+        """
+        if self.diet is not None:
+            return self.diet_values['pc']
+        return self.pc_f * self.pf / 100 + self.pc_s * self.ps / 100
+
+    def awmsp_calc(self):
+        """
+        Fracción del estiércol del ganado manejado usando un determinado sistema de manejo de los
+        desechos animales ponderado.
+        :return:
+        """
+        return self.manure_weighted(self.manure['awms'])
+
+    def results(self) -> pd.DataFrame:
+        """
+        Resultados por perfil con las mismas salidas de ef_execution
+        :return: DataFrame con fe, ceb, cms, cf, cc, cpms, ccms, dpcms, ym, fge
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cpms = self.cpms_selection()
+            res = pd.DataFrame({'fe': self.ef_calc(),
+                                'ceb': self.tge,
+                                'cms': self.cms,
+                                'cf': self.cmcf_calc(),
+                                'cc': self.cmcs_calc(),
+                                'cpms': cpms,
+                                'ccms': cpms - self.cms,
+                                'dpcms': ((self.cms * 100 / cpms) - 100) / 100,
+                                'ym': self.ym,
+                                'fge': self.ef_ge_calc()})
+        return res[RESULT_COLUMNS]
+
+
+def precision_report(catalog=None, dtype='float32', **params) -> pd.DataFrame:
+    """
+    Compara los resultados de FeGeBatch con precisión reducida frente a float64 para el mismo lote
+    :param catalog: Catalog. Si no se entrega se lee de la base de datos
+    :param dtype: precisión a evaluar
+    :param params: parámetros de FeGeBatch (ver profiles_from_frame)
+    :return: DataFrame por salida con error absoluto y relativo máximo, percentil 99 del error relativo,
+        filas finitas solo en una de las precisiones y memoria de los arreglos del lote (bytes)
+    """
+    ef64 = FeGeBatch(catalog=catalog, **params)
+    ef = FeGeBatch(catalog=ef64.catalog, dtype=dtype, **params)
+    res64, res = ef64.results(), ef.results().astype('float64')
+    nbytes = [sum(v.nbytes for v in vars(e).values() if isinstance(v, np.ndarray)) for e in (ef64, ef)]
+    report = []
+    for col in RESULT_COLUMNS:
+        exact, approx = res64[col].values, res[col].values
+        finite = np.isfinite(exact) & np.isfinite(approx)
+        diff = np.abs(approx[finite] - exact[finite])
+        scale = np.abs(exact[finite])
+        rel = diff[scale > 0] / scale[scale > 0]
+        report.append({'salida': col,
+                       'error_abs': diff.max() if diff.size else np.nan,
+                       'error_rel': rel.max() if rel.size else np.nan,
+                       'error_rel_p99': np.percentile(rel, 99) if rel.size else np.nan,
+                       'no_finitos': int((np.isfinite(exact) != np.isfinite(approx)).sum())})
+    report = pd.DataFrame(report)
+    report['memoria_float64'], report[f'memoria_{np.dtype(dtype).name}'] = nbytes
+    return report
+
+
+def main():
+    ef = FeGeBatch(at_id=[1, 2], ca_id=1, weight=540.0, adult_w=600.0, milk=3660, grease=3.5, cp_id=2, cs_id=1,
+                   coe_act_id=2, pf=80, ps=20, vp_id=15, vs_id=1, ta=14, ht=0.0, sp_id=2, sgea_id=1, p_sga=7,
+                   sgra_id=1, p_sgb=93, sgeb_id=5, sgrb_id=5)
+    print(ef.results())
+
+
+if __name__ == '__main__':
+    main()
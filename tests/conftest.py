@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, f"{os.path.abspath(os.path.join(os.path.abspath(__file__), '../../'))}")
+from src.database import db_utils
+from src.database.catalog import Catalog, CATALOG_TABLES
+from src.manure_management import manure_mgmt
+from src.manure_management.manure_batch import FE_FERMENTACION_COLUMNS
+
+# Número de forrajes y de suplementos del catálogo sintético
+N_FEEDS = 30
+
+
+def make_tables(seed=0) -> dict:
+    """
+    Catálogo sintético con la estructura de CATALOG_TABLES
+    :param seed: semilla
+    :return: diccionario tabla -> DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    n = N_FEEDS
+    return {
+        'categoria_animal': pd.DataFrame({'id_categoria_animal': [1, 2, 3], 'coe_cat_animal': [0.386, 0.322, 0.37],
+                                          'temp_conf': [20.0, 15.0, 25.0], 'rcms': [1.0, 1.0, 1.0],
+                                          'ib': [1.0, 1.05, 0.9]}),
+        'condicion_sexual': pd.DataFrame({'id_cond_sexual': [1, 2, 3], 'coe_cond_sexual': [0.8, 1.0, 1.2]}),
+        'variedad_pasto': pd.DataFrame({'id_variedad': np.arange(1, n + 1), 'ed_rumiantes': rng.uniform(9, 12, n),
+                                        'energia_bruta_pasto': rng.uniform(17, 19, n),
+                                        'fdn_dieta': rng.uniform(50, 70, n), 'fda': rng.uniform(25, 40, n),
+                                        'enm_rumiantes': rng.uniform(4, 6, n), 'ceniza_dieta': rng.uniform(8, 12, n),
+                                        'pc_dieta': rng.uniform(6, 15, n)}),
+        'suplemento': pd.DataFrame({'id_suplemento': np.arange(1, n + 1), 'edt_rumiantes': rng.uniform(11, 14, n),
+                                    'energia_bruta_pasto': rng.uniform(17, 19, n), 'fdn_dieta': rng.uniform(20, 40, n),
+                                    'fda': rng.uniform(10, 20, n), 'enm_rumiantes': rng.uniform(6, 8, n),
+                                    'ceniza_dieta': rng.uniform(5, 8, n), 'pc_dieta': rng.uniform(12, 20, n)}),
+        'coeficiente_actividad': pd.DataFrame({'id_coe_actividad': [1, 2, 3], 'coe_actividad': [0.0, 0.17, 0.36]}),
+        'coeficiente_prenez': pd.DataFrame({'id_coe_prenez': [1, 2], 'coe_prenez': [0.0, 0.1]}),
+        'produccion_metano': pd.DataFrame({'id': [1, 2], 'bovino_alta_prod': [0.24, 0.13],
+                                           'bovino_otras': [0.13, 0.1]}),
+        'gestion_residuos': pd.DataFrame({'id': [1, 2, 3, 4, 5, 6], 'alta_prod': [0.1, 0.2, 0.3, 0.1, 0.2, 0.1],
+                                          'otras': [0.05, 0.1, 0.2, 0.3, 0.3, 0.05]}),
+    }
+
+
+def random_profiles(m, seed=0, n_feeds=N_FEEDS) -> pd.DataFrame:
+    """
+    Perfiles sintéticos con la estructura de fe_fermentacion
+    :param m: número de perfiles
+    :param seed: semilla
+    :param n_feeds: forrajes y suplementos disponibles
+    :return: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    at = rng.integers(1, 8, m)
+    pf = rng.choice([100.0, 90.0, 80.0, 60.0], m)
+    return pd.DataFrame({
+        'id': np.arange(1, m + 1), 'id_reg': rng.integers(1, 9, m), 'id_at': at,
+        'id_ca': np.where(at == 1, 1, rng.integers(1, 4, m)), 'id_coe_acti': rng.integers(1, 4, m),
+        'temp': rng.uniform(5, 32, m), 'por_pasto': pf, 'por_suple': 100 - pf,
+        'id_suple': rng.integers(1, n_feeds + 1, m), 'id_pasto': rng.integers(1, n_feeds + 1, m),
+        'peso': np.where(at == 5, rng.uniform(60, 150, m), rng.uniform(250, 600, m)),
+        'adult_peso': rng.uniform(500, 650, m), 'id_cp': rng.integers(1, 3, m),
+        'gn_peso': np.where(np.isin(at, [5, 6, 7]), rng.uniform(0.2, 0.8, m), 0.0),
+        'leche': np.where(np.isin(at, [1, 2, 3]), rng.uniform(1000, 6000, m),
+                          np.where(at == 5, rng.uniform(300, 700, m), 0.0)),
+        'grasa': rng.uniform(3, 4.5, m), 'ht': 0.0, 'id_cs': rng.integers(1, 4, m),
+        'id_prod_metano': rng.integers(1, 3, m), 'id_gestion_est1': rng.integers(1, 8, m),
+        'id_gestion_res1': rng.integers(1, 7, m), 'por_gestion1': 20.0, 'id_gestion_est2': rng.integers(1, 8, m),
+        'id_gestion_res2': rng.integers(1, 7, m), 'por_gestion2': 80.0})
+
+
+def scalar_params(row) -> dict:
+    """
+    Parámetros de ef_execution para una fila de fe_fermentacion
+    :param row: Series
+    :return: diccionario parámetro -> valor
+    """
+    params = {param: row[col] for col, param in FE_FERMENTACION_COLUMNS.items()}
+    for key in ('at_id', 'ca_id', 'coe_act_id', 'vs_id', 'vp_id', 'cp_id'):
+        params[key] = int(params[key])
+    return params
+
+
+@pytest.fixture
+def tables():
+    return make_tables()
+
+
+@pytest.fixture
+def catalog(tables):
+    return Catalog(tables=tables)
+
+
+@pytest.fixture
+def scalar_db(tables, monkeypatch):
+    """
+    Reemplaza las consultas por id de db_utils con el catálogo sintético, para comparar con GrossEnergy,
+    FactorEF y FeGe sin base de datos
+    """
+    def row(table, id_):
+        key, columns = CATALOG_TABLES[table]
+        df = tables[table]
+        values = df.loc[df[key] == id_, columns].values
+        if len(values) == 0:
+            raise IndexError('list index out of range')
+        return tuple(float(v) for v in values[0])
+
+    monkeypatch.setattr(db_utils, 'get_from_ca_table', lambda i: row('categoria_animal', i))
+    monkeypatch.setattr(db_utils, 'get_from_cs_table', lambda i: row('condicion_sexual', i)[0])
+    monkeypatch.setattr(db_utils, 'get_from_grass_type', lambda i: row('variedad_pasto', i))
+    monkeypatch.setattr(db_utils, 'get_from_suplement_type', lambda i: row('suplemento', i))
+    monkeypatch.setattr(db_utils, 'get_from_ac_table', lambda i: row('coeficiente_actividad', i)[0])
+    monkeypatch.setattr(db_utils, 'get_from_cp_table', lambda i: row('coeficiente_prenez', i)[0])
+    monkeypatch.setattr(manure_mgmt, 'get_from_pm_table', lambda i: row('produccion_metano', i))
+    monkeypatch.setattr(manure_mgmt, 'get_from_awms_table', lambda i: row('gestion_residuos', i))
+    return tables
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.analysis.co2e_rollup import CO2eRollup, GWP_SETS, UNASSIGNED
+
+
+def test_null_keys_count_in_national_total():
+    df_act = pd.DataFrame({'cod_depto': [5, 5, None, 8], 'id_reg_ganadera': [1, None, 2, 3],
+                           'ano': [2020, 2020, 2020, None], 'id_ani_tipo_ipcc': [1, 4, 6, 2],
+                           'emision_fe': [1.0, 2.0, 4.0, 8.0], 'emision_ge': [0.5, 0.25, np.nan, 1.0]})
+    rollup = CO2eRollup(df_act)
+    total = rollup.totals('AR5', category_level=1)['co2e'].sum()
+    expected = (df_act['emision_fe'].sum() + df_act['emision_ge'].sum()) * GWP_SETS['AR5']['CH4']
+    assert np.isclose(total, expected)
+    departments = rollup.totals('AR5', territory='departamento', category_level=1)
+    assert np.isclose(departments['co2e'].sum(), expected)
+    assert UNASSIGNED in departments['territorio'].values
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from conftest import random_profiles, scalar_params
+from src.database.catalog import Catalog
+from src.enteric_fermentation.gross_energy_batch import diet_matrix
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+from src.execution.ef_exe import ef_execution
+
+OUTPUTS = {'fe': 0, 'ym': 8, 'fge': 9}
+
+
+def legacy_diet(catalog, df):
+    """
+    Matriz de la dieta equivalente a un forraje y un suplemento por perfil
+    """
+    n = len(df)
+    return diet_matrix(catalog, np.tile(np.arange(n), 2), np.repeat(['variedad_pasto', 'suplemento'], n),
+                       np.concatenate([df['id_pasto'].values, df['id_suple'].values]),
+                       np.concatenate([df['por_pasto'].values, df['por_suple'].values]), size=n)
+
+
+def diet_results(catalog, df):
+    params = {k: v for k, v in profiles_from_frame(df).items() if k not in ('pf', 'ps', 'vp_id', 'vs_id')}
+    return FeGeBatch(catalog=catalog, diet=legacy_diet(catalog, df), **params).results()
+
+
+def test_diet_matches_scalar(catalog, scalar_db):
+    df = random_profiles(60, seed=1)
+    res = diet_results(catalog, df)
+    for i in df.index:
+        expected = ef_execution(prnt=False, **scalar_params(df.loc[i]))
+        for col, pos in OUTPUTS.items():
+            assert res.at[i, col] == pytest.approx(expected[pos], rel=1e-9)
+
+
+def test_invalid_feed_only_affects_its_profiles(tables, scalar_db):
+    tables['variedad_pasto'].loc[tables['variedad_pasto']['id_variedad'] == 3, 'energia_bruta_pasto'] = 0.0
+    tables['suplemento'].loc[tables['suplemento']['id_suplemento'] == 5, 'fdn_dieta'] = np.nan
+    catalog = Catalog(tables=tables)
+    df = random_profiles(200, seed=2)
+    res = diet_results(catalog, df)
+    affected = (df['id_pasto'] == 3) | ((df['id_suple'] == 5) & (df['por_suple'] > 0))
+    assert affected.any() and not affected.all()
+    assert res.loc[affected, 'fe'].isnull().all()
+    assert np.isfinite(res.loc[~affected, ['fe', 'ym', 'fge']].values).all()
+    for i in df.index[~affected & (df['id_suple'] != 5)]:
+        expected = ef_execution(prnt=False, **scalar_params(df.loc[i]))
+        for col, pos in OUTPUTS.items():
+            assert res.at[i, col] == pytest.approx(expected[pos], rel=1e-9)
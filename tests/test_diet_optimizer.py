@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import random_profiles, N_FEEDS
+from src.analysis import diet_optimizer
+from src.analysis.diet_optimizer import candidates, pareto_front, optimize_diet
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+
+def test_pareto_front():
+    fe = np.array([1.0, 2.0, 3.0, 1.0, 2.0, 4.0])
+    cms = np.array([5.0, 3.0, 1.0, 6.0, 3.0, 0.5])
+    # 3 está dominado por 0; 4 empata con 1 y solo uno de los dos queda en el frente
+    front = pareto_front(fe, cms)
+    assert front[[0, 2, 5]].all()
+    assert not front[3]
+    assert front[1] != front[4]
+    assert front.sum() == 4
+
+
+def test_candidates_prune_supplement_at_full_forage(catalog):
+    df = candidates(catalog, vp_ids=[1, 2], vs_ids=[3, 4, 5], shares=[0.0, 50.0, 100.0])
+    full = df[df['pf'] == 100]
+    assert len(full) == 2
+    assert (full['vs_id'] == 3).all()
+    assert len(df) == 2 * 3 * 2 + 2
+    np.testing.assert_array_equal(df['ps'].values, 100 - df['pf'].values)
+    assert len(candidates(catalog)) == N_FEEDS * N_FEEDS * 10 + N_FEEDS
+
+
+def test_optimize_diet_front_is_feasible_and_exact(catalog):
+    profile = random_profiles(1, seed=3).iloc[0]
+    df_pareto, df = optimize_diet(profile, catalog, vp_ids=range(1, 11), vs_ids=range(1, 11))
+    assert len(df_pareto) > 0
+    assert (df['cms'] <= df['cpms']).all()
+    assert df_pareto['fe'].min() == df['fe'].min()
+    best = df_pareto.iloc[0]
+    check = profile.to_frame().T.assign(id_pasto=best['vp_id'], id_suple=best['vs_id'], por_pasto=best['pf'],
+                                        por_suple=best['ps'])
+    res = FeGeBatch(catalog=catalog, **profiles_from_frame(check)).results()
+    assert np.isclose(res['fe'].item(), best['fe'])
+
+
+def test_write_pareto_replaces_only_its_profile(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    url = f"sqlite:///{tmp_path / 'pareto.db'}"
+    monkeypatch.setattr(diet_optimizer, 'pg_connection_str', lambda: url)
+    front = pd.DataFrame({'vp_id': [1, 2], 'vs_id': [1, 1], 'pf': [100.0, 80.0], 'fe': [50.0, 48.0]})
+    diet_optimizer.write_pareto(front, 1, 'pareto')
+    diet_optimizer.write_pareto(front.head(1), 2, 'pareto')
+    diet_optimizer.write_pareto(front.assign(fe=[40.0, 39.0]), 1, 'pareto')
+    res = pd.read_sql('pareto', con=url).sort_values(by=['id', 'fe'])
+    assert res['id'].tolist() == [1, 1, 2]
+    assert res['fe'].tolist() == [39.0, 40.0, 50.0]
+    # una columna que no existe en la tabla hace fallar la escritura después del borrado
+    with pytest.raises(Exception):
+        diet_optimizer.write_pareto(front.assign(otra=1), 2, 'pareto')
+    assert len(pd.read_sql('pareto', con=url)) == 3
+    create_engine(url).dispose()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import io
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import random_profiles
+from src.execution.ef_exe import batch_execution, batch_format
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+
+def test_output_format_defaults_to_input():
+    assert batch_format('-') == 'jsonl'
+    assert batch_format('-', batch_format('perfiles.csv')) == 'csv'
+    assert batch_format('resultados', 'csv') == 'csv'
+    assert batch_format('resultados.parquet', 'csv') == 'parquet'
+
+
+def test_csv_to_stdout_is_csv(tmp_path, catalog, monkeypatch):
+    df = random_profiles(30, seed=7)
+    source = tmp_path / 'perfiles.csv'
+    df.to_csv(source, index=False)
+    out = io.StringIO()
+    monkeypatch.setattr('sys.stdout', out)
+    assert batch_execution(str(source), '-', chunk_rows=8, catalog=catalog) == len(df)
+    res = pd.read_csv(io.StringIO(out.getvalue()))
+    expected = FeGeBatch(catalog=catalog, **profiles_from_frame(df)).results()
+    np.testing.assert_allclose(res['fe'].values, expected['fe'].values, rtol=1e-12)
+    np.testing.assert_allclose(res['fge'].values, expected['fge'].values, rtol=1e-12)
+
+
+def test_parquet_without_engine_fails_before_reading(tmp_path, catalog, monkeypatch):
+    from src.execution import ef_exe
+    monkeypatch.setattr(ef_exe.importlib.util, 'find_spec', lambda name: None)
+    source = tmp_path / 'perfiles.csv'
+    random_profiles(5, seed=9).to_csv(source, index=False)
+    with pytest.raises(ImportError, match='pyarrow o fastparquet'):
+        batch_execution(str(source), str(tmp_path / 'resultados.parquet'), catalog=catalog)
+    assert not (tmp_path / 'resultados.parquet').exists()
+    with pytest.raises(ImportError, match='Parquet'):
+        batch_execution(str(tmp_path / 'perfiles.parquet'), '-', catalog=catalog)
+    ef_exe.check_parquet('csv', 'jsonl')
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.execution.emissions_all import act_emissions, table_factors
+
+
+def test_municipal_factors_override_regional():
+    df_act = pd.DataFrame({'id': [3, 1, 2, 4], 'cod_muni': [5001, 5001, 5002, 5001], 'ano': [2020, 2020, 2020, 2021],
+                           'id_reg_ganadera': [1, 1, 1, 2], 'id_ani_tipo_ipcc': [1, 2, 1, 1],
+                           'numero': [1e6, 2e6, 1e6, 1e6], 'emision_fe': 0.0, 'emision_ge': 0.0})
+    df_factors = pd.DataFrame({'id_reg_ganadera': [1, 1, 2], 'id_ani_tipo_ipcc': [1, 2, 1],
+                               'fe': [50.0, 40.0, 60.0], 'gen': [1.0, 2.0, 3.0]})
+    # 5001 tiene factor municipal para el animal tipo 1 en 2020; el de la región 2 es nulo (perfil inválido)
+    df_municipal = pd.DataFrame({'cod_muni': [5001, 5001, 5001], 'id_reg_ganadera': [1, 2, 1],
+                                 'id_ani_tipo_ipcc': [1, 1, 1], 'ano': [2020, 2021, 2019],
+                                 'fe': [55.0, np.nan, 99.0], 'gen': [1.5, np.nan, 9.0]})
+    regional = act_emissions(df_act, df_factors)
+    municipal = act_emissions(df_act, df_factors, df_municipal=df_municipal)
+    assert regional['id'].tolist() == municipal['id'].tolist() == [1, 2, 3, 4]
+    assert regional['emision_fe'].tolist() == [80.0, 50.0, 50.0, 60.0]
+    assert municipal['emision_fe'].tolist() == [80.0, 50.0, 55.0, 60.0]
+    assert municipal['emision_ge'].tolist() == [4.0, 1.0, 1.5, 3.0]
+    assert table_factors('datos_act_bovinos_ipcc_proyectados', df_municipal) is None
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from conftest import random_profiles
+from src.analysis.fast_grid import FastGrid, COMBO_COLUMNS
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+# Error relativo máximo aceptado de la interpolación frente a FeGeBatch
+MAX_REL_ERROR = 0.02
+
+
+def shared_combos(m, n_combos, seed=0):
+    """
+    Perfiles sintéticos que comparten pocas combinaciones de ids y varían en los parámetros continuos
+    """
+    df = random_profiles(m, seed=seed)
+    base = random_profiles(n_combos, seed=seed + 1)
+    pick = np.random.default_rng(seed + 2).integers(0, n_combos, m)
+    for col in COMBO_COLUMNS:
+        df[col] = base[col].values[pick]
+    rng = np.random.default_rng(seed + 3)
+    df['adult_peso'] = rng.uniform(350, 700, m)
+    df['ht'] = rng.uniform(0, 4, m)
+    df['por_gestion1'] = rng.uniform(0, 100, m)
+    df['por_gestion2'] = 100 - df['por_gestion1']
+    return df
+
+
+@pytest.fixture
+def grid_profiles():
+    return shared_combos(1500, 10)
+
+
+def test_interpolation_error_is_bounded(tmp_path, catalog, grid_profiles):
+    fast = FastGrid.build(str(tmp_path / 'grilla'), grid_profiles, catalog, seed=0)
+    assert len(fast.combos) == 10
+    exact = FeGeBatch(catalog=catalog, **profiles_from_frame(grid_profiles)).results()
+    approx = fast.profiles_calc(grid_profiles)
+    for k, name in enumerate(['fe', 'fge']):
+        rel = np.abs(approx[k] - exact[name].values) / np.abs(exact[name].values)
+        assert np.isfinite(rel).all()
+        assert rel.max() < MAX_REL_ERROR
+        assert fast.meta['error_max'][name]['rel'] < MAX_REL_ERROR
+
+
+def test_unknown_combo_is_nan(tmp_path, catalog, grid_profiles):
+    fast = FastGrid.build(str(tmp_path / 'grilla'), grid_profiles, catalog, n_check=100, seed=0)
+    df = grid_profiles.head(20).copy()
+    expected = fast.profiles_calc(df)
+    df.loc[df.index[:5], 'id_pasto'] = 999
+    res = fast.profiles_calc(df)
+    assert np.isnan(res[:, :5]).all()
+    np.testing.assert_allclose(res[:, 5:], expected[:, 5:])
+
+
+def test_supplement_off_diagonal_is_excluded(tmp_path, catalog, grid_profiles):
+    fast = FastGrid.build(str(tmp_path / 'grilla'), grid_profiles, catalog, n_check=100, seed=0)
+    df = grid_profiles.head(40).copy()
+    expected = fast.profiles_calc(df)
+    # por_suple distinto de 100 - por_pasto: dieta que los nodos de la grilla no cubren
+    df.loc[df.index[:10], 'por_pasto'] = 70.0
+    df.loc[df.index[:10], 'por_suple'] = 20.0
+    res = fast.profiles_calc(df)
+    assert np.isnan(res[:, :10]).all()
+    np.testing.assert_allclose(res[:, 10:], expected[:, 10:])
+    errors = fast.max_error(df, catalog)
+    assert errors['excluidos'] == 10
+    assert errors['fe']['rel'] < MAX_REL_ERROR
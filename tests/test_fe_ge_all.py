@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import pandas as pd
+import pytest
+
+from src.execution import fe_ge_all
+from src.execution.fe_validation import rejects_frame
+
+
+@pytest.fixture
+def offline_run(tmp_path, monkeypatch):
+    """
+    masive_calc sin base de datos: 6 perfiles, sin huellas guardadas y sin rechazos
+    """
+    df = pd.DataFrame({'id': range(1, 7)})
+    calls = []
+    monkeypatch.setattr(fe_ge_all, 'checkpoint_root', str(tmp_path / 'checkpoint'))
+    monkeypatch.setattr(fe_ge_all, 'get_data', lambda: df.copy())
+    monkeypatch.setattr(fe_ge_all, 'Catalog', lambda: None)
+    monkeypatch.setattr(fe_ge_all, 'fingerprints', lambda d, catalog: 'h' + d['id'].astype(str))
+    monkeypatch.setattr(fe_ge_all, 'get_fingerprints', lambda: pd.DataFrame({'id': [], 'huella': []}))
+    monkeypatch.setattr(fe_ge_all, 'update_db', lambda d, previous=None: len(d))
+    monkeypatch.setattr(fe_ge_all, 'write_rejects', lambda d, ids=None: None)
+
+    def chunk_calc(d, catalog):
+        calls.append(d['id'].tolist())
+        return d, d, rejects_frame(d, d['id'].values < 0, '', 'id', '')
+
+    monkeypatch.setattr(fe_ge_all, 'chunk_calc', chunk_calc)
+    return df.assign(huella='h' + df['id'].astype(str)), calls
+
+
+def test_partial_run_keeps_interrupted_checkpoint(offline_run):
+    df, calls = offline_run
+    signature = fe_ge_all.run_signature(df, True, 2)
+    # corrida completa interrumpida después del primer bloque
+    fe_ge_all.save_checkpoint(signature, set(), 0, rejects_frame(df, df['id'].values < 0, '', 'id', ''))
+    fe_ge_all.masive_calc(ids=[5, 6], chunk_rows=2)
+    assert calls == [[5, 6]]
+    assert fe_ge_all.load_checkpoint(signature) == {0}
+    assert os.listdir(fe_ge_all.checkpoint_root) == [signature]
+    calls.clear()
+    fe_ge_all.masive_calc(chunk_rows=2, resume=True)
+    assert calls == [[3, 4], [5, 6]]
+    assert not os.path.exists(fe_ge_all.checkpoint_path(signature))
+
+
+def test_changed_run_does_not_resume(offline_run):
+    df, calls = offline_run
+    fe_ge_all.save_checkpoint(fe_ge_all.run_signature(df, True, 3), set(), 0, df.iloc[:0])
+    fe_ge_all.masive_calc(chunk_rows=2, resume=True)
+    assert calls == [[1, 2], [3, 4], [5, 6]]
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import random_profiles
+from src.execution.fe_ge_monthly import monthly_calc, monthly_matrix, MONTH_DAYS
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+
+def test_constant_months_match_annual(catalog):
+    df = random_profiles(50, seed=11)
+    params = profiles_from_frame(df)
+    ta = np.repeat(np.asarray(params['ta'], dtype='float64')[:, None], 12, axis=1)
+    milk = np.asarray(params['milk'], dtype='float64')[:, None] * MONTH_DAYS[None, :] / 365
+    weight = np.repeat(np.asarray(params['weight'], dtype='float64')[:, None], 12, axis=1)
+    df_year, df_month = monthly_calc(df, ta, milk, weight, catalog=catalog)
+    expected = FeGeBatch(catalog=catalog, **params).results()
+    np.testing.assert_allclose(df_year['fe'].values, expected['fe'].values, rtol=1e-12)
+    np.testing.assert_allclose(df_year['fge'].values, expected['fge'].values, rtol=1e-12)
+    assert (df_year['meses_imputados'] == 0).all()
+    assert len(df_month) == 12 * len(df)
+
+
+def test_invalid_matrices_raise(catalog):
+    df = random_profiles(5, seed=12)
+    ta = np.full((5, 12), 20.0)
+    with pytest.raises(ValueError, match='forma'):
+        monthly_calc(df, ta[:, :11], catalog=catalog)
+    with pytest.raises(ValueError, match='forma'):
+        monthly_calc(df, ta[:4], catalog=catalog)
+    ta[1, 3] = np.nan
+    with pytest.raises(ValueError, match='1 meses sin dato de ta en 1 perfiles'):
+        monthly_calc(df, ta, catalog=catalog)
+
+
+def test_profiles_missing_from_monthly_table(catalog):
+    df = random_profiles(4, seed=13)
+    df_month = pd.DataFrame({'id': np.repeat(df['id'].values[:3], 12), 'mes': np.tile(np.arange(1, 13), 3),
+                             'temp': 18.0})
+    ta = monthly_matrix(df, df_month, 'temp')
+    with pytest.raises(ValueError, match=f'ids {df["id"].values[3]}'):
+        monthly_calc(df, ta, catalog=catalog)
+    df_year, _df = monthly_calc(df, ta, catalog=catalog, fill_missing=True)
+    assert df_year['meses_imputados'].tolist() == [0, 0, 0, 12]
+    annual = FeGeBatch(catalog=catalog, **profiles_from_frame(df.iloc[3:])).results()
+    assert np.isclose(df_year['fe'].values[3], annual['fe'].item(), rtol=1e-12)
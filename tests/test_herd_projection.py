@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.execution.herd_projection import (COHORTS, UNIT_KEYS, DEFAULT_RATES, backtest, cohort_matrix, project,
+                                           projection_calc, region_births, transition_matrices, unit_rates)
+
+# Natalidad con la que se simula la serie histórica de cada región
+TRUE_BIRTHS = {1: 0.62, 2: 0.75, 3: 0.9}
+
+
+def history_frame(units, years, herd) -> pd.DataFrame:
+    """
+    Serie histórica con la estructura de get_history a partir de un arreglo (unidades, años, cohortes)
+    """
+    n_units, n_years, n_cohorts = herd.shape
+    df = units.loc[np.repeat(np.arange(n_units), n_years * n_cohorts)].reset_index(drop=True)
+    df['ano'] = np.tile(np.repeat(years, n_cohorts), n_units)
+    df['id_ani_tipo_ipcc'] = np.tile(COHORTS, n_units * n_years)
+    df['numero'] = herd.ravel()
+    return df
+
+
+def simulated_history(n_years=12, municipalities=4, seed=0) -> pd.DataFrame:
+    """
+    Serie histórica generada con el modelo de cohortes y la natalidad de TRUE_BIRTHS
+    """
+    rng = np.random.default_rng(seed)
+    regions = np.repeat(list(TRUE_BIRTHS), municipalities)
+    units = pd.DataFrame({'cod_depto': regions, 'cod_muni': np.arange(len(regions)) + 100,
+                          'id_reg_ganadera': regions})
+    births = pd.Series(TRUE_BIRTHS)
+    shares = rng.dirichlet(np.ones(3), len(units))
+    matrix = transition_matrices(unit_rates(units, pd.DataFrame(columns=['id_reg_ganadera']), births), shares)
+    herd0 = rng.uniform(100, 1000, (len(units), len(COHORTS)))
+    # los primeros años llevan cada unidad a su estructura estable
+    herd = project(herd0, matrix, 40 + n_years)[:, 40:]
+    return history_frame(units, np.arange(2000, 2000 + n_years), herd)
+
+
+def test_calibration_recovers_birth_rate():
+    df_hist = simulated_history()
+    units, years, herd = cohort_matrix(df_hist)
+    births = region_births(units, years, herd, pd.DataFrame(columns=['id_reg_ganadera']))
+    for region, value in TRUE_BIRTHS.items():
+        assert abs(births[region] - value) < 1e-3
+
+
+def test_backtest_reproduces_last_years():
+    df = backtest(simulated_history(), years=5)
+    assert len(df) == len(TRUE_BIRTHS) * 5
+    assert df['error_rel'].abs().max() < 0.01
+
+
+def test_flat_herd_stays_flat():
+    rng = np.random.default_rng(1)
+    units = pd.DataFrame({'cod_depto': [1, 1, 2], 'cod_muni': [10, 11, 20], 'id_reg_ganadera': [1, 1, 2]})
+    herd0 = rng.uniform(100, 1000, (len(units), len(COHORTS)))
+    years = np.arange(2005, 2020)
+    df_hist = history_frame(units, years, np.repeat(herd0[:, None], len(years), axis=1))
+    df = projection_calc(df_hist, years=30)
+    totals = df.groupby('ano')['numero'].sum()
+    base = herd0.sum()
+    assert 0.8 < totals.iloc[-1] / base < 1.25
+    assert (df['numero'] >= 0).all()
+    assert set(df.columns) == set(UNIT_KEYS + ['ano', 'id_ani_tipo_ipcc', 'numero'])
+
+
+def test_table_birth_rate_is_kept():
+    df_hist = simulated_history()
+    units, years, herd = cohort_matrix(df_hist)
+    df_rates = pd.DataFrame({'id_reg_ganadera': [1], 'natalidad': [0.5]})
+    rates = unit_rates(units, df_rates, region_births(units, years, herd, df_rates))
+    region = units['id_reg_ganadera'].values
+    assert np.allclose(rates['natalidad'][region == 1], 0.5)
+    assert np.allclose(rates['mortalidad_adultos'], DEFAULT_RATES['mortalidad_adultos'])
+
+
+def test_write_projection_is_atomic(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, text
+    from src.execution import herd_projection
+    url = f"sqlite:///{tmp_path / 'proyectados.db'}"
+    monkeypatch.setattr(herd_projection, 'pg_connection_str', lambda: url)
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        # la columna id tiene su propia secuencia, como el serial de Postgres
+        connection.execute(text("""CREATE TABLE proyectados (id INTEGER PRIMARY KEY, cod_depto INTEGER,
+                                   cod_muni INTEGER, id_reg_ganadera INTEGER, ano INTEGER, id_ani_tipo_ipcc INTEGER,
+                                   numero FLOAT, emision_fe FLOAT, emision_ge FLOAT)"""))
+    engine.dispose()
+    old = pd.DataFrame({'id': [1, 2, 3], 'cod_depto': 1, 'cod_muni': 10, 'id_reg_ganadera': 1, 'ano': 2030,
+                        'id_ani_tipo_ipcc': [1, 2, 20], 'numero': 5.0, 'emision_fe': 1.0, 'emision_ge': 1.0})
+    old.to_sql('proyectados', con=url, index=False, if_exists='append')
+    df = old.drop(columns=['id', 'emision_fe', 'emision_ge']).head(2).assign(numero=7.0)
+    # una columna que no existe en la tabla hace fallar la escritura después del borrado
+    with pytest.raises(Exception):
+        herd_projection.write_projection(df.assign(otra=1), 'proyectados')
+    assert pd.read_sql('proyectados', con=url)['numero'].tolist() == [5.0, 5.0, 5.0]
+    herd_projection.write_projection(df, 'proyectados')
+    res = pd.read_sql('proyectados', con=url).sort_values(by='id')
+    assert res['id'].tolist() == [3, 4, 5]
+    assert res['numero'].tolist() == [5.0, 7.0, 7.0]
+    assert res['emision_fe'].isna().tolist() == [False, True, True]
+
+
+def test_projection_emissions_uses_projected_keys(monkeypatch):
+    from src.execution import herd_projection, projected_emissions
+    calls = []
+    monkeypatch.setattr(projected_emissions, 'calculation', lambda **kwargs: calls.append(kwargs))
+    df = pd.DataFrame({'id_reg_ganadera': [1, 1, 2, 1], 'id_ani_tipo_ipcc': [1, 2, 1, 1], 'numero': 1.0})
+    herd_projection.projection_emissions(df)
+    assert calls == [{'keys': [(1, 1), (1, 2), (2, 1)], 'pushdown': True}]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.analysis import inventory
+from src.analysis.inventory import category_levels, subtotals_calc, livestock_slice, deforestation_slice, \
+    forest_plantation_slice, national_totals, LONG_COLUMNS
+from src.analysis.co2e_rollup import UNASSIGNED
+from src.database.territory import TerritoryIndex
+from src.land_use.deforestacion import EMISSION_UNIT, AREA_UNIT
+
+
+@pytest.fixture
+def index():
+    livestock = pd.DataFrame({'cod_muni': [5001, 5002, 8001], 'cod_depto': [5, 5, 8], 'id_reg_ganadera': [1, 1, 3]})
+    forest = pd.DataFrame({'cod_muni': [5001], 'cod_depto': [5], 'id_subregion': [10], 'id_zona_upra': [1]})
+    return TerritoryIndex({'datos_act_bovinos_ipcc_temporal': livestock, 'b1aiii_datos_actividad': forest})
+
+
+def deforestation_table(unit) -> pd.DataFrame:
+    return pd.DataFrame({'bioma': ['Andes', 'Andes', 'Caribe'], 'ano': [2020, 2021, 2020], 'unidad': unit,
+                         'Pastizales': [1000.0, 2000.0, 500.0], 'Tierras forestales': [100.0, 0.0, 300.0]})
+
+
+def test_category_levels():
+    assert category_levels('3B1aiii', '3B') == ['3B1aiii', '3B1a', '3B1', '3B', '3']
+    assert category_levels('3A1a', '3A') == ['3A1a', '3A1', '3A', '3']
+    assert category_levels('Pastizales', '3B') == ['Pastizales', '3B', '3']
+
+
+def test_livestock_slice_rolls_up_municipalities(index):
+    df_act = pd.DataFrame({'cod_muni': [5001, 5002, 8001, 7777], 'ano': [2020] * 4, 'id_ani_tipo_ipcc': [1, 1, 4, 4],
+                           'emision_fe': [1.0, 2.0, 4.0, 8.0], 'emision_ge': [0.5, np.nan, 1.0, 1.0]})
+    df = livestock_slice(index, df_act)
+    fe = df[df['categoria'] == '3A1a']
+    assert dict(zip(fe['territorio'], fe['valor'])) == {5: 3.0, 8: 4.0, UNASSIGNED: 8.0}
+    assert np.isclose(df['valor'].sum(), np.nansum(df_act[['emision_fe', 'emision_ge']].values))
+
+
+def test_deforestation_slice_requires_emission_report(index):
+    df = deforestation_slice(index, deforestation_table(EMISSION_UNIT))
+    assert set(df['categoria']) == {'Pastizales', 'Tierras forestales'}
+    assert np.isclose(df['valor'].sum(), 3.9)
+    with pytest.raises(ValueError):
+        deforestation_slice(index, deforestation_table(AREA_UNIT))
+    with pytest.raises(ValueError):
+        deforestation_slice(index, deforestation_table(EMISSION_UNIT).drop(columns='unidad'))
+
+
+def test_forest_plantation_slice_levels(index):
+    df = pd.DataFrame({'id_especie': 'Todas', 'id_subregion': 'Todas', 'cod_muni': [5001, 5002, 9999],
+                       'anio': 2020, 'ems_bt_net': [1000.0, 2000.0, 4000.0]})
+    res = forest_plantation_slice(index, df)
+    assert dict(zip(res['territorio'], res['valor'])) == {5: 3.0, UNASSIGNED: 4.0}
+    assert set(res['nivel_territorio']) == {'cod_depto'}
+    res = forest_plantation_slice(index, df.assign(cod_muni='Todas'))
+    assert res['valor'].tolist() == [7.0]
+    assert set(res['nivel_territorio']) == {'nacional'}
+
+
+def test_subtotals_calc_hierarchy():
+    df = pd.DataFrame({'modulo': 'deforestacion', 'categoria': ['Pastizales', 'Tierras forestales', '3B1aiii'],
+                       'nivel_territorio': 'bioma', 'territorio': 'Andes', 'ano': 2020, 'gas': 'CO2',
+                       'valor': [1.0, 2.0, 4.0]})[LONG_COLUMNS]
+    df_sub = subtotals_calc(df, '3B').set_index('categoria')
+    assert df_sub.loc['3', 'valor'] == 7.0
+    assert df_sub.loc['3B', 'valor'] == 7.0
+    assert df_sub.loc['3B1', 'valor'] == 4.0
+    assert df_sub.loc['Pastizales', 'nivel_categoria'] == 3
+    assert df_sub.loc['3B1aiii', 'nivel_categoria'] == 5
+    totals = national_totals('AR5', df_sub.reset_index())
+    assert totals.loc[totals['nivel_categoria'] == 1, 'co2e'].tolist() == [7.0]
+
+
+def test_replace_slice_is_atomic(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    url = f"sqlite:///{tmp_path / 'inventario.db'}"
+    monkeypatch.setattr(inventory, 'pg_connection_str', lambda: url)
+    old = pd.DataFrame({'modulo': ['ganaderia', 'plantaciones'], 'valor': [1.0, 2.0]})
+    old.to_sql('inventario', con=url, index=False)
+    # una columna que no existe en la tabla hace fallar la escritura después del borrado
+    with pytest.raises(Exception):
+        inventory.replace_slice('inventario', 'ganaderia', old.head(1).assign(otra=1))
+    assert pd.read_sql('inventario', con=url)['valor'].tolist() == [1.0, 2.0]
+    inventory.replace_slice('inventario', 'ganaderia', old.head(1).assign(valor=5.0))
+    res = pd.read_sql('inventario', con=url).sort_values(by='modulo')
+    assert res['valor'].tolist() == [5.0, 2.0]
+    inventory.replace_slice('nueva', 'ganaderia', old.head(1))
+    assert len(pd.read_sql('nueva', con=url)) == 1
+    create_engine(url).dispose()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from conftest import random_profiles
+from src.analysis.monte_carlo import monte_carlo
+from src.analysis.co2e_rollup import UNASSIGNED
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+
+def test_no_uncertainty_matches_point_estimate(catalog):
+    df = random_profiles(40, seed=5)
+    df_prof, df_agg = monte_carlo(df, n_draws=20, uncertainty={}, seed=0, catalog=catalog)
+    res = FeGeBatch(catalog=catalog, **profiles_from_frame(df)).results()
+    for name in ('fe', 'fge'):
+        np.testing.assert_allclose(df_prof[name].values, res[name].values, rtol=1e-12)
+        np.testing.assert_allclose(df_prof[f'{name}_p50'].values, res[name].values, rtol=1e-6)
+        totals = res[name].groupby(df['id_at'].values).sum().values
+        np.testing.assert_allclose(df_agg[name].values, totals, rtol=1e-12)
+        np.testing.assert_allclose(df_agg[f'{name}_p2.5'].values, totals, rtol=1e-6)
+        assert (df_agg[f'{name}_excluidos'] == 0).all()
+
+
+def test_nan_profiles_are_excluded_not_zeroed(catalog):
+    df = random_profiles(40, seed=6)
+    bad = df.index[df['id_at'] == df['id_at'].iloc[0]][:1]
+    df.loc[bad, 'id_pasto'] = 999
+    df_prof, df_agg = monte_carlo(df, n_draws=200, seed=1, catalog=catalog)
+    assert df_prof.loc[bad, 'fe'].isna().all()
+    row = df_agg['id_at'] == df.loc[bad[0], 'id_at']
+    assert df_agg.loc[row, 'fe_excluidos'].item() == 1
+    assert (df_agg.loc[~row, 'fe_excluidos'] == 0).all()
+    valid = df['id_at'].values == df.loc[bad[0], 'id_at']
+    expected = df_prof.loc[valid, 'fe'].sum()
+    assert np.isclose(df_agg.loc[row, 'fe'].item(), expected)
+    assert np.isfinite(df_agg[['fe_p2.5', 'fe_p50', 'fe_p97.5']].values).all()
+    assert df_agg.loc[row, 'fe_p2.5'].item() < expected < df_agg.loc[row, 'fe_p97.5'].item()
+
+
+def test_null_group_keys_get_their_own_group(catalog):
+    df = random_profiles(40, seed=7)
+    df['id_depto'] = np.where(np.arange(40) < 10, np.nan, np.where(np.arange(40) < 25, 5.0, 8.0))
+    df_prof, df_agg = monte_carlo(df, n_draws=20, uncertainty={}, group_by='id_depto', seed=0, catalog=catalog)
+    assert df_agg['id_depto'].tolist() == [UNASSIGNED, 5.0, 8.0]
+    assert df_agg['perfiles'].tolist() == [10, 15, 15]
+    for key, rows in ((UNASSIGNED, slice(0, 10)), (5.0, slice(10, 25)), (8.0, slice(25, 40))):
+        row = df_agg['id_depto'] == key
+        assert np.isclose(df_agg.loc[row, 'fe'].item(), np.nansum(df_prof['fe'].values[rows]))
+
+
+def test_profile_percentiles_use_a_bounded_sample(catalog):
+    df = random_profiles(30, seed=8)
+    df_prof, df_agg = monte_carlo(df, n_draws=400, seed=3, catalog=catalog, profile_draws=50, block_rows=900)
+    valid = df_prof['fe'].notnull()
+    assert (df_prof.loc[valid, 'fe_p2.5'] < df_prof.loc[valid, 'fe_p97.5']).all()
+    assert (df_agg['fe_p2.5'] < df_agg['fe']).all() and (df_agg['fe'] < df_agg['fe_p97.5']).all()
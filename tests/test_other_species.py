@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from src.database import other_species
+
+
+class FakeConnection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def cursor(self):
+        return None
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def state(monkeypatch):
+    """
+    Contador de fe_otras_especies y versión de la tabla de promedios en memoria (None: la tabla no existe)
+    """
+    state = {'version': 1, 'built': None, 'builds': 0}
+
+    def build_averages(cur, version):
+        state['built'] = version
+        state['builds'] += 1
+
+    monkeypatch.setattr(other_species, 'pg_connection', FakeConnection)
+    monkeypatch.setattr(other_species, 'source_version', lambda cur: state['version'])
+    monkeypatch.setattr(other_species, 'built_version', lambda cur: state['built'])
+    monkeypatch.setattr(other_species, 'build_averages', build_averages)
+    return state
+
+
+def test_cache_hit_and_miss(state):
+    assert other_species.refresh_other_factors()
+    assert not other_species.refresh_other_factors()
+    assert state['builds'] == 1
+    # una escritura en fe_otras_especies (o un trigger reinstalado) incrementa el contador
+    state['version'] += 1
+    assert other_species.refresh_other_factors()
+    assert not other_species.refresh_other_factors()
+    assert other_species.refresh_other_factors(force=True)
+    assert state['builds'] == 3
+
+
+def test_empty_source_is_cached(state):
+    # la versión no depende del contenido: una fuente vacía construida una vez no se reconstruye
+    state['version'] = 0
+    assert other_species.refresh_other_factors()
+    assert not other_species.refresh_other_factors()
+    # si la tabla de promedios se borra se reconstruye
+    state['built'] = None
+    assert other_species.refresh_other_factors()
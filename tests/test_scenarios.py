@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from conftest import random_profiles
+from src.analysis.scenarios import BASE, apply_rule, run_scenarios
+from src.manure_management.manure_batch import FeGeBatch, profiles_from_frame
+
+SCENARIOS = {
+    'pasto': {'id_pasto': 3, 'filtro': {'id_at': [1, 2]}},
+    'leche': {'leche': {'multiplicar': 1.1}},
+    'suplemento': {'por_pasto': {'sumar': -10.0}, 'por_suple': {'sumar': 10.0}},
+    'gestion': {'id_gestion_res1': 2, 'id_gestion_est1': 3},
+}
+
+
+def activity(df, seed=0) -> pd.DataFrame:
+    """
+    Número de animales sintético con la estructura de get_act_data
+    """
+    rng = np.random.default_rng(seed)
+    keys = df[['id_reg', 'id_at']].drop_duplicates()
+    df_act = pd.concat([keys.assign(año=year) for year in (2019, 2020)], ignore_index=True)
+    df_act['numero'] = rng.uniform(1000, 50000, len(df_act))
+    return df_act
+
+
+def direct_emissions(df, df_act, scenario, catalog) -> pd.DataFrame:
+    """
+    Emisiones de un escenario recalculando todos los perfiles modificados con FeGeBatch
+    """
+    df = df.copy()
+    scenario = dict(scenario)
+    rows = np.ones(len(df), dtype=bool)
+    for col, values in scenario.pop('filtro', {}).items():
+        rows &= df[col].isin(values).values
+    for col, rule in scenario.items():
+        df[col] = np.where(rows, apply_rule(df[col].values, rule), df[col].values)
+    res = FeGeBatch(catalog=catalog, **profiles_from_frame(df)).results()
+    factors = df[['id_reg', 'id_at']].assign(fe=res['fe'].values, fge=res['fge'].values)
+    act = df_act.merge(factors, on=['id_reg', 'id_at'], how='inner')
+    act = act[act['fe'].notnull() & act['fge'].notnull()]
+    act['emision_fe'] = act['fe'] * act['numero'] / 1000000.0
+    act['emision_ge'] = act['fge'] * act['numero'] / 1000000.0
+    df = act.groupby(['año', 'id_at'], sort=True)[['emision_fe', 'emision_ge']].sum()
+    keys = df_act.merge(factors[['id_reg', 'id_at']], on=['id_reg', 'id_at'])[['año', 'id_at']].drop_duplicates()
+    return df.reindex(pd.MultiIndex.from_frame(keys.sort_values(by=['año', 'id_at'])), fill_value=0.0).reset_index()
+
+
+def test_scenarios_match_direct_recompute(catalog):
+    df = random_profiles(120, seed=11)
+    df_act = activity(df)
+    df_emis, df_nat = run_scenarios(df, df_act, SCENARIOS, catalog=catalog, block_rows=37)
+    assert set(df_emis['escenario']) == {BASE, *SCENARIOS}
+    for name, scenario in {BASE: {}, **SCENARIOS}.items():
+        expected = direct_emissions(df, df_act, scenario, catalog)
+        res = df_emis[df_emis['escenario'] == name].reset_index(drop=True)
+        np.testing.assert_array_equal(res[['año', 'id_at']].values, expected[['año', 'id_at']].values)
+        for col in ('emision_fe', 'emision_ge'):
+            np.testing.assert_allclose(res[col].values, expected[col].values, rtol=1e-10)
+        nat = df_nat[df_nat['escenario'] == name]
+        np.testing.assert_allclose(nat['emision_fe'].values, expected.groupby('año')['emision_fe'].sum().values,
+                                   rtol=1e-10)
+
+
+def test_scenarios_change_only_targeted_rows(catalog):
+    df = random_profiles(60, seed=12)
+    df_act = activity(df)
+    df_emis, _df_nat = run_scenarios(df, df_act, {'pasto': SCENARIOS['pasto']}, catalog=catalog)
+    base = df_emis[df_emis['escenario'] == BASE].set_index(['año', 'id_at'])
+    pasto = df_emis[df_emis['escenario'] == 'pasto'].set_index(['año', 'id_at'])
+    untouched = ~base.index.get_level_values('id_at').isin([1, 2])
+    np.testing.assert_array_equal(pasto.loc[untouched, 'emision_fe'].values, base.loc[untouched, 'emision_fe'].values)
+
+
+def test_invalid_profiles_are_excluded_and_reported(catalog):
+    df = random_profiles(60, seed=13)
+    df_act = activity(df)
+    scenario = {'id_pasto': 999, 'filtro': {'id_at': [1]}}
+    df_emis, df_nat = run_scenarios(df, df_act, {'desconocido': scenario}, catalog=catalog)
+    base = df_emis[df_emis['escenario'] == BASE].set_index(['año', 'id_at'])
+    res = df_emis[df_emis['escenario'] == 'desconocido'].set_index(['año', 'id_at'])
+    at1 = res.index.get_level_values('id_at') == 1
+    assert (base['perfiles_excluidos'] == 0).all()
+    assert (res.loc[at1, 'emision_fe'] == 0).all()
+    # cada fila de actividad cuenta una vez por perfil de su región y animal tipo
+    expected = df_act[df_act['id_at'] == 1].merge(df[['id_reg', 'id_at']], on=['id_reg', 'id_at'])
+    assert res.loc[at1, 'perfiles_excluidos'].sum() == len(expected)
+    np.testing.assert_allclose(res.loc[at1, 'numero_excluido'].values,
+                               expected.groupby('año')['numero'].sum().values)
+    np.testing.assert_array_equal(res.loc[~at1, 'emision_fe'].values, base.loc[~at1, 'emision_fe'].values)
+    nat = df_nat.set_index('escenario')
+    assert nat.loc['desconocido', 'perfiles_excluidos'].sum() == len(expected)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+from src.database.territory import TerritoryIndex, NATIONAL
+from src.analysis.co2e_rollup import CO2eRollup, UNASSIGNED
+
+
+def make_index(counts=(1, 1)) -> TerritoryIndex:
+    """
+    Índice con tres municipios en dos departamentos. El municipio 5002 aparece en las regiones 1 y 2 con los
+    números de filas de counts
+    """
+    livestock = pd.DataFrame({'cod_muni': [5001, 5002, 5002, 8001], 'cod_depto': [5, 5, 5, 8],
+                              'id_reg_ganadera': [1, 1, 2, 3], 'n': [4, counts[0], counts[1], 2]})
+    forest = pd.DataFrame({'cod_muni': [5001, 8001, 9001], 'cod_depto': [5, 8, None], 'id_subregion': [10, 20, 30],
+                           'id_zona_upra': [None, 1, 1], 'n': [1, 1, 1]})
+    return TerritoryIndex({'datos_act_bovinos_ipcc_temporal': livestock, 'b1aiii_datos_actividad': forest})
+
+
+def test_level_calc_uses_parent_with_most_rows():
+    index = make_index(counts=(1, 5))
+    assert list(index.parent_codes([5002], 'id_reg_ganadera')) == [2]
+    assert index.ambiguous['id_reg_ganadera'] == 1
+    assert index.ambiguous['cod_depto'] == 0
+    index = make_index(counts=(5, 1))
+    assert list(index.parent_codes([5002], 'id_reg_ganadera')) == [1]
+
+
+def test_parent_unknown_municipalities():
+    index = make_index()
+    assert list(index.parent_codes([5001, 8001, 9001, 7777, np.nan], 'cod_depto', missing=UNASSIGNED)) == \
+        [5, 8, UNASSIGNED, UNASSIGNED, UNASSIGNED]
+    assert list(index.parent([5001, 7777], NATIONAL)) == [0, -1]
+    assert list(index.parent([9001], 'id_zona_upra')) == [0]
+
+
+def test_rollup_unknown_municipalities():
+    index = make_index()
+    cod_muni = np.array([5001, 5002, 8001, 7777, 9001])
+    values = {'valor': [1.0, 2.0, 4.0, 8.0, 16.0]}
+    df = index.rollup(cod_muni, values, 'cod_depto')
+    assert dict(zip(df['cod_depto'], df['valor'])) == {5: 3.0, 8: 4.0}
+    df = index.rollup(cod_muni, values, 'cod_depto', unassigned=UNASSIGNED)
+    assert dict(zip(df['cod_depto'], df['valor'])) == {5: 3.0, 8: 4.0, UNASSIGNED: 24.0}
+    df = index.rollup(cod_muni, values, NATIONAL)
+    assert df['valor'].tolist() == [23.0]
+
+
+def test_rollup_by_several_keys():
+    index = make_index()
+    df_by = pd.DataFrame({'ano': [2020, 2020, 2021, 2020], 'id_ani_tipo_ipcc': [1, 1, 1, np.nan]})
+    df = index.rollup([5001, 5002, 5001, 8001], {'valor': [1.0, 2.0, 4.0, 8.0]}, 'cod_depto', by=df_by)
+    assert df.columns.tolist() == ['cod_depto', 'ano', 'id_ani_tipo_ipcc', 'valor']
+    assert df[['cod_depto', 'ano', 'valor']].values.tolist() == [[5, 2020, 3.0], [5, 2021, 4.0]]
+
+
+def test_co2e_rollup_departments_from_index():
+    index = make_index()
+    df_act = pd.DataFrame({'cod_muni': [5001, 5002, 8001, 7777], 'cod_depto': [99, 99, 99, 99],
+                           'id_reg_ganadera': [1, 2, 3, 3], 'ano': [2020] * 4, 'id_ani_tipo_ipcc': [1, 4, 6, 2],
+                           'emision_fe': [1.0, 2.0, 4.0, 8.0], 'emision_ge': [0.5, np.nan, 1.0, 1.0]})
+    rollup = CO2eRollup(df_act, index)
+    departments = rollup.totals({'CH4': 1.0}, territory='departamento', category_level=1)
+    assert dict(zip(departments['territorio'], departments['co2e'])) == {UNASSIGNED: 9.0, 5: 3.5, 8: 5.0}
+    regions = rollup.totals({'CH4': 1.0}, territory='region', category_level=1)
+    assert dict(zip(regions['territorio'], regions['co2e'])) == {1: 1.5, 2: 2.0, 3: 14.0}